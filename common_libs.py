@@ -6,35 +6,92 @@ This module provides:
 - Global paths to the best segmentation and classification models.
 - Definitions for key segmentation evaluation metrics: Jaccard Index and Dice Coefficient.
 
+Heavy libraries (NumPy, OpenCV, PIL, TensorFlow/Keras) are imported lazily on
+first attribute access, e.g. `from common_libs import np`. Modules that only
+need Tkinter, such as the views, therefore import this module without paying
+for TensorFlow, which lets the window appear before the models are loaded.
+
 Modules Used:
 -------------
 - TensorFlow/Keras for deep learning.
-- PIL, OpenCV, and Matplotlib for image processing and visualization.
+- PIL and OpenCV for image processing.
 - Tkinter for GUI components.
 """
 
 # === Standard and GUI Libraries ===
 import os
 import re
+import argparse
+import asyncio
+import base64
+import cProfile
+import csv
+import glob
+import hashlib
+import importlib
+import io
+import json
+import platform
+import queue
+import shutil
+import sqlite3
+import threading
+import time
 import tkinter as tk
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 import tkinter.messagebox as msg
 from tkinter import filedialog
 from tkinter import messagebox
 
-# === Scientific and Image Processing Libraries ===
-import numpy as np
-import cv2
-from PIL import Image, ImageTk
-import matplotlib.pyplot as plt
-
-# === TensorFlow and Keras ===
-import tensorflow as tf
-from tensorflow import keras
-
 # === Warnings Management ===
 import warnings
 
 
+# ======================
+# Lazy Heavy Imports
+# ======================
+_LAZY_MODULES = {
+    'np': 'numpy',
+    'cv2': 'cv2',
+    'Image': 'PIL.Image',
+    'ImageTk': 'PIL.ImageTk',
+    'tf': 'tensorflow',
+    'keras': 'tensorflow.keras',
+}
+"""dict: Attribute name -> module imported on first access."""
+
+
+def __getattr__(name):
+    """
+    Imports a heavy library the first time it is requested from this module.
+
+    Parameters:
+    -----------
+    name : str
+        Attribute name, e.g. 'np', 'cv2', 'tf' or 'keras'.
+
+    Returns:
+    --------
+    module
+        The imported module, cached in the module globals for later lookups.
+    """
+    if name not in _LAZY_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module = importlib.import_module(_LAZY_MODULES[name])
+    globals()[name] = module
+
+    if name == 'keras':
+        # Register the custom metrics once Keras is available
+        module.utils.register_keras_serializable()(jaccard_index)
+        module.utils.register_keras_serializable()(dice_coefficient)
+
+    return module
+
+
 # ======================
 # UI Theme Configuration
 # ======================
@@ -72,18 +129,97 @@ TXT_11_B = ('Helvetica', 11, 'bold')
 TXT_12_B = ('Helvetica', 12, 'bold')
 PROD_11_B = ('Courier', 11, 'bold')
 
+# ======================
+# Display Configuration
+# ======================
+DISPLAY_FIT = os.environ.get('LUNGSIGHT_DISPLAY_FIT', '0') == '1'  # scale result images to their panel size
+DISPLAY_MIN_SIZE = 64  # smallest edge in pixels of a fitted result image
+
 # ======================
 # Model File Paths
 # ======================
-CLF_PATH = os.path.abspath('resource/best_clf_model.keras')
-SEG_PATH = os.path.abspath('resource/best_seg_model.keras')
+# Override with LUNGSIGHT_CLF_PATH / LUNGSIGHT_SEG_PATH, e.g. to run exported .tflite or .onnx models
+CLF_PATH = os.path.abspath(os.environ.get('LUNGSIGHT_CLF_PATH', 'resource/best_clf_model.keras'))
+SEG_PATH = os.path.abspath(os.environ.get('LUNGSIGHT_SEG_PATH', 'resource/best_seg_model.keras'))
+
+# ======================
+# Inference Configuration
+# ======================
+TB_THRESHOLD = 0.5
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+COMPILED_INFERENCE = os.environ.get('LUNGSIGHT_COMPILED', '1') == '1'  # tf.function instead of Model.predict
+XLA_JIT = os.environ.get('LUNGSIGHT_XLA', '0') == '1'  # XLA JIT compile the tf.function
+DECODE_WINDOW = (0.5, 99.5)  # intensity percentiles mapped to 0..255 when decoding 16-bit radiographs
+REDUCED_DECODE = os.environ.get('LUNGSIGHT_REDUCED_DECODE', '1') == '1'  # decode large films at 1/2-1/8 scale; '0' keeps the exact baseline inputs
+MASK_THRESHOLD = 1 / 255  # sigmoid value from which a pixel is lung (any non-zero display mask pixel)
+OVERLAY_COLOR = (255, 20, 255)  # BGR color of the lung overlay
+OVERLAY_ALPHA = 0.4  # weight of the overlay color in the blend
+
+# ======================
+# Progressive Preview Configuration
+# ======================
+PREVIEW_ENABLED = os.environ.get('LUNGSIGHT_PREVIEW', '0') == '1'  # show a low-resolution result before the full one
+PREVIEW_SIZE = int(os.environ.get('LUNGSIGHT_PREVIEW_SIZE', '256'))  # input edge in pixels of the preview pass
+
+# ======================
+# Test-time Augmentation Configuration
+# ======================
+TTA_ENABLED = os.environ.get('LUNGSIGHT_TTA', '0') == '1'  # re-check borderline predictions with augmented views
+TTA_BAND = float(os.environ.get('LUNGSIGHT_TTA_BAND', '0.15'))  # |tb - TB_THRESHOLD| that triggers augmentation
+TTA_SHIFT = 16  # pixels of the shifted views
+TTA_CONTRAST = (0.85, 1.15)  # contrast gains of the jittered views
+
+# ======================
+# Explainability Configuration
+# ======================
+EXPLAIN_MODE = os.environ.get('LUNGSIGHT_EXPLAIN', '')  # '' off, 'attention' (gate maps) or 'gradcam' (gates + Grad-CAM)
+HEATMAP_ALPHA = 0.5  # weight of the heatmap colors in the explanation overlays
+
+# ======================
+# Result Cache Configuration
+# ======================
+CACHE_DIR = os.environ.get('LUNGSIGHT_CACHE_DIR')  # None keeps the cache in memory only
+CACHE_MEMORY_MB = 256
+CACHE_DISK_MB = 2048
+
+# ======================
+# Results Index Configuration
+# ======================
+# The index keeps file paths, probabilities and features of every film scored in the GUI, so it is opt-in:
+# set LUNGSIGHT_INDEX_DIR to a directory only the station's users can read
+INDEX_DIR = os.path.expanduser(os.environ.get('LUNGSIGHT_INDEX_DIR', ''))  # embeddings and metadata of scored cases; '' (default) disables
+SIMILAR_CASES = int(os.environ.get('LUNGSIGHT_SIMILAR_CASES', '5'))  # nearest prior cases shown per upload
+
+# ======================
+# Gallery Configuration
+# ======================
+GALLERY_THUMB_SIZE = 96  # edge in pixels of the gallery thumbnails
+GALLERY_PHOTO_CACHE = 256  # Tk images kept for gallery thumbnails, least recently shown dropped first
+GALLERY_THUMB_MEMORY_MB = 64  # size bound of the decoded thumbnail cache
+GALLERY_THUMB_DIR = os.environ.get('LUNGSIGHT_THUMB_DIR')  # None keeps thumbnails in memory only
+
+# ======================
+# Watch Folder Configuration
+# ======================
+WATCH_INTERVAL = 1.0  # seconds between directory scans
+WATCH_SETTLE = 2.0  # seconds a file's size and mtime must stay unchanged before it is scored
+WATCH_RETRIES = 3  # attempts per version of an unreadable or undecodable file before it is given up
+WATCH_IGNORED = ('.tmp', '.part', '.partial', '.crdownload', '.filepart')  # suffixes of files still being copied
+
+# ======================
+# Instrumentation Configuration
+# ======================
+TIMINGS = os.environ.get('LUNGSIGHT_TIMINGS', '0') == '1'  # per-stage timings in the status panel
+TRACE_LOG = os.environ.get('LUNGSIGHT_TRACE_LOG')  # JSON lines file of per-request timings
+PROFILE_MODE = os.environ.get('LUNGSIGHT_PROFILE')  # 'tf' (TensorFlow profiler trace) or 'cprofile'
+PROFILE_REQUESTS = int(os.environ.get('LUNGSIGHT_PROFILE_REQUESTS', '5'))  # requests captured by the profiler
+PROFILE_DIR = os.environ.get('LUNGSIGHT_PROFILE_DIR', 'profiles')
 
 
 # ======================
 # Evaluation Metrics
 # ======================
 
-@keras.utils.register_keras_serializable()
 def jaccard_index(y_true, y_pred, smooth=100):
     """
     Computes the Jaccard Index (IoU) for evaluating segmentation masks.
@@ -104,6 +240,7 @@ def jaccard_index(y_true, y_pred, smooth=100):
     jaccard : tensor
         Jaccard index (IoU) as a scalar tensor.
     """
+    import tensorflow as tf
     y_true_f = tf.reshape(tf.cast(y_true, tf.float32), [-1])
     y_pred_f = tf.reshape(tf.cast(y_pred, tf.float32), [-1])
     intersection = tf.reduce_sum(y_true_f * y_pred_f)
@@ -111,7 +248,6 @@ def jaccard_index(y_true, y_pred, smooth=100):
     return (intersection + smooth) / (union + smooth)
 
 
-@keras.utils.register_keras_serializable()
 def dice_coefficient(y_true, y_pred, smooth=1):
     """
     Computes the Dice Coefficient for evaluating segmentation overlap.
@@ -132,6 +268,7 @@ def dice_coefficient(y_true, y_pred, smooth=1):
     dice : tensor
         Dice coefficient as a scalar tensor.
     """
+    import tensorflow as tf
     y_true_f = tf.reshape(tf.cast(y_true, tf.float32), [-1])
     y_pred_f = tf.reshape(tf.cast(y_pred, tf.float32), [-1])
     intersection = tf.reduce_sum(y_true_f * y_pred_f)
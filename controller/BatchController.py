@@ -0,0 +1,435 @@
+import model.SegmentationModel as sm
+import model.ClassificationModel as cm
+import model.FusedModel as fm
+import model.TensorStore as ts
+import controller.StreamingPipeline as sp
+import controller.InferencePool as ip
+from common_libs import os, re, csv, glob, json, threading, cv2
+from common_libs import SEG_PATH, CLF_PATH, IMG_EXTENSIONS
+
+class BatchController:
+    """
+    Headless controller that scores many chest X-rays without the GUI.
+
+    Images are read from a directory or glob pattern, stacked into batches of
+    `batchSize`, run through the fused segmentation/classification model in one
+    call per batch, and written as JSON lines or CSV records. Masks and overlays
+    can optionally be saved as PNG files, named after the image path relative to
+    the input root ('sub/a.png' -> 'sub__a_mask.png') and made unique within the
+    run, so two inputs never share an output. Decoding, inference and output writing
+    overlap through a StreamingPipeline. With a TensorStore, inputs are read
+    from the memory-mapped store instead of being decoded again. With
+    `decodeProcesses` > 0, decoding runs in worker processes that write into a
+    shared-memory ring read in place by the model. With `processes` > 0, batches are decoded and scored by an InferencePool of
+    worker processes with partitioned CPU cores instead.
+
+    Attributes:
+    -----------
+    batchSize : int
+        Number of images per model call.
+
+    maskDir : str or None
+        Directory where predicted masks are saved, or None to skip.
+
+    overlayDir : str or None
+        Directory where colored overlays are saved, or None to skip.
+
+    fusedModel : FusedModel or None
+        Model returning the mask and TB probability in one pass, None in process pool mode.
+
+    store : TensorStore or None
+        Preprocessed inputs read instead of decoding, or None.
+
+    pipeline : StreamingPipeline or None
+        Overlapped decode / inference / output stages, None in process pool mode.
+
+    pool : InferencePool or None
+        Worker processes scoring the batches, or None for in-process inference.
+    """
+
+    FIELDS = ('file', 'probability', 'label', 'confidence', 'lung_fraction', 'mask', 'overlay', 'error')
+    """tuple: Column order of the written records."""
+
+    def __init__(self, batchSize=8, maskDir=None, overlayDir=None, workers=None, prefetch=2, store=None,
+                 processes=0, threads=None, interThreads=1, cvThreads=1, pin=True, decodeProcesses=0):
+        """
+        Loads the models and prepares the output directories.
+
+        Parameters:
+        -----------
+        batchSize : int, optional (default=8)
+            Number of images per model call.
+
+        maskDir : str, optional
+            Directory where predicted masks are saved.
+
+        overlayDir : str, optional
+            Directory where colored overlays are saved.
+
+        workers : int, optional
+            Decode threads. Defaults to the number of CPUs, capped at 8.
+
+        prefetch : int, optional (default=2)
+            Number of batches decoded ahead of the one being inferred.
+
+        store : str, optional
+            Tensor store directory built with the `build-store` command.
+
+        processes : int, optional (default=0)
+            Worker processes of an InferencePool; 0 runs inference in this process.
+
+        threads : int, optional
+            Pool mode: TensorFlow intra-op threads per worker (default: cores / processes).
+
+        interThreads : int, optional (default=1)
+            Pool mode: TensorFlow inter-op threads per worker.
+
+        cvThreads : int, optional (default=1)
+            Pool mode: OpenCV threads per worker.
+
+        pin : bool, optional (default=True)
+            Pool mode: pin each worker to its own cores.
+
+        decodeProcesses : int, optional (default=0)
+            Decode in this many processes sharing the batch buffers instead of in threads.
+        """
+        self.batchSize: int = max(1, batchSize)
+        """int: Number of images per model call."""
+
+        self.maskDir: str = maskDir
+        """str: Directory where predicted masks are saved, or None to skip."""
+
+        self.overlayDir: str = overlayDir
+        """str: Directory where colored overlays are saved, or None to skip."""
+
+        for directory in (self.maskDir, self.overlayDir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        self.fusedModel: fm.FusedModel = None
+        """FusedModel: Model returning the mask and TB probability in one pass, None in process pool mode."""
+
+        self.store: ts.TensorStore = ts.TensorStore(store) if store else None
+        """TensorStore: Preprocessed inputs read instead of decoding, or None."""
+
+        self.pipeline: sp.StreamingPipeline = None
+        """StreamingPipeline: Overlapped decode / inference / output stages, None in process pool mode."""
+
+        self.pool: ip.InferencePool = None
+        """InferencePool: Worker processes scoring the batches, or None for in-process inference."""
+
+        # file -> output name reserved by `score`, and every name handed out by this controller -> its file
+        self._names = {}
+        self._usedNames = {}
+        self._namesLock = threading.Lock()
+
+        if processes > 0:
+            self.pool = ip.InferencePool(processes, threads, interThreads, cvThreads, pin, store)
+            self.pool.warmup()
+        else:
+            self.fusedModel = fm.FusedModel(SEG_PATH, CLF_PATH)
+            self.fusedModel.warmup()
+            self.pipeline = sp.StreamingPipeline(
+                self.fusedModel, self.finish, self.batchSize, workers, prefetch=prefetch, store=self.store,
+                decodeProcesses=decodeProcesses)
+
+    @staticmethod
+    def collectFiles(source):
+        """
+        Resolves a directory or glob pattern into a sorted list of image files.
+
+        Parameters:
+        -----------
+        source : str
+            Directory containing X-rays, or a glob pattern such as 'scans/*.png'.
+
+        Returns:
+        --------
+        list of str
+            Paths of the matched image files.
+        """
+        if os.path.isdir(source):
+            files = [os.path.join(source, name) for name in os.listdir(source)]
+        else:
+            files = glob.glob(source, recursive=True)
+
+        return sorted(f for f in files if os.path.isfile(f) and f.lower().endswith(IMG_EXTENSIONS))
+
+    @staticmethod
+    def inputRoot(source):
+        """
+        Returns the directory output names are made relative to.
+
+        Parameters:
+        -----------
+        source : str or None
+            Directory or glob pattern of input X-rays.
+
+        Returns:
+        --------
+        str or None
+            `source` itself for a directory, the fixed leading directories of a glob
+            pattern, or None without a source.
+        """
+        if source is None:
+            return None
+        if os.path.isdir(source):
+            return os.path.abspath(source)
+        fixed = re.split(r'[*?\[]', source, maxsplit=1)[0]
+        return os.path.abspath(os.path.dirname(fixed) or os.curdir)
+
+    def reserveNames(self, files, root=None):
+        """
+        Assigns each file the name its mask and overlay PNGs are saved under.
+
+        The name is the path relative to `root` without its extension, directories
+        joined by '__' (the file name alone outside `root`). A name already handed
+        out by this controller for another file gets the file extension appended,
+        then a counter, so no output of the run is ever overwritten by another
+        input's; a file scored again keeps its name.
+
+        Parameters:
+        -----------
+        files : list of str
+            Image paths, in scoring order.
+
+        root : str, optional
+            Input root directory.
+        """
+        with self._namesLock:
+            for file in files:
+                relative = os.path.basename(file)
+                if root:
+                    try:
+                        candidate = os.path.relpath(os.path.abspath(file), root)
+                        if not candidate.startswith(os.pardir):
+                            relative = candidate
+                    except ValueError:
+                        # Another drive on Windows
+                        pass
+
+                base, ext = os.path.splitext(relative)
+                base = base.replace(os.sep, '__')
+                if os.altsep:
+                    base = base.replace(os.altsep, '__')
+
+                taken = lambda candidate: self._usedNames.get(candidate, file) != file
+                name = base
+                if taken(name):
+                    base = name = f"{base}_{ext.lstrip('.').lower()}" if ext else base
+                    count = 2
+                    while taken(name):
+                        name = f'{base}_{count}'
+                        count += 1
+
+                self._usedNames[name] = file
+                self._names[file] = name
+
+    def outputName(self, file):
+        """
+        Returns (and forgets) the output name reserved for a file, reserving one if needed.
+        """
+        with self._namesLock:
+            name = self._names.pop(file, None)
+        if name is None:
+            self.reserveNames([file])
+            with self._namesLock:
+                name = self._names.pop(file)
+        return name
+
+    def run(self, source, out):
+        """
+        Scores every image matched by `source` and writes the records to `out`.
+
+        Parameters:
+        -----------
+        source : str or None
+            Directory or glob pattern of input X-rays. May be None with a tensor
+            store to score every stored image.
+
+        out : str
+            Output file; '.csv' writes CSV, anything else writes JSON lines.
+
+        Returns:
+        --------
+        int
+            Number of images processed.
+        """
+        count = 0
+        with open(out, 'w', newline='') as fh:
+            write = self.openWriter(fh, out)
+
+            files = self.store.paths() if source is None and self.store else self.collectFiles(source)
+            for record in self.score(files, self.inputRoot(source)):
+                write(record)
+                count += 1
+
+        return count
+
+    def score(self, files, root=None):
+        """
+        Scores a list of files, yielding their output records in order.
+
+        Parameters:
+        -----------
+        files : list of str
+            Image paths (looked up in the tensor store when one is set).
+
+        root : str, optional
+            Input root directory the output names are made relative to.
+
+        Returns:
+        --------
+        iterator of dict
+            One output record per file.
+        """
+        if self.maskDir or self.overlayDir:
+            files = list(files)
+            self.reserveNames(files, root)
+
+        if self.pool is not None:
+            withImages = bool(self.maskDir or self.overlayDir)
+            return (self.finish(*result) for result in self.pool.run(files, self.batchSize, withImages))
+        return self.pipeline.run(files)
+
+    def openWriter(self, fh, out):
+        """
+        Creates the record writer matching the output file extension.
+
+        Parameters:
+        -----------
+        fh : file object
+            Open output file.
+
+        out : str
+            Output file path.
+
+        Returns:
+        --------
+        function
+            Callable that writes one record dictionary.
+        """
+        if out.lower().endswith('.csv'):
+            writer = csv.DictWriter(fh, fieldnames=self.FIELDS)
+            writer.writeheader()
+            return writer.writerow
+
+        return lambda record: fh.write(json.dumps(record) + '\n')
+
+    @classmethod
+    def readResults(cls, path):
+        """
+        Reads the records of a results file written by `run`.
+
+        Parameters:
+        -----------
+        path : str
+            Results file; '.csv' is read as CSV, anything else as JSON lines.
+
+        Returns:
+        --------
+        list of dict
+            Records with the numeric fields as floats and empty fields as None.
+        """
+        with open(path, newline='') as fh:
+            if path.lower().endswith('.csv'):
+                records = list(csv.DictReader(fh))
+            else:
+                records = [json.loads(line) for line in fh if line.strip()]
+
+        for record in records:
+            for field in cls.FIELDS:
+                value = record.get(field)
+                if value == '':
+                    value = None
+                if value is not None and field in ('probability', 'confidence', 'lung_fraction'):
+                    value = float(value)
+                record[field] = value
+
+        return records
+
+    def finish(self, file, img, mask, tb, error, fraction=None):
+        """
+        Output stage: builds the record for one image and writes its PNGs.
+
+        Parameters:
+        -----------
+        file : str
+            Source image path.
+
+        img : np.ndarray or None
+            512x512 grayscale source image.
+
+        mask : np.ndarray or None
+            Raw sigmoid mask of shape (512, 512, 1).
+
+        tb : float or None
+            Predicted TB probability.
+
+        error : Exception or None
+            Decode failure, if any.
+
+        fraction : float, optional
+            Lung area fraction computed upstream; derived from `mask` when omitted.
+
+        Returns:
+        --------
+        dict
+            The output record.
+        """
+        record = dict.fromkeys(self.FIELDS)
+        record['file'] = file
+
+        if error is not None:
+            record['error'] = str(error)
+            return record
+
+        binary = None
+        if fraction is None:
+            binary = sm.SegmentationModel.postprocessor.binarize(mask)
+            fraction = sm.SegmentationModel.postprocessor.areaFraction(binary)
+
+        label, confidence = cm.ClassificationModel.interpret(tb)
+        record.update(probability=round(float(tb), 6), label=label, confidence=round(confidence, 2),
+                      lung_fraction=round(float(fraction), 4))
+        self.saveOutputs(file, img, mask, record, binary)
+
+        return record
+
+    def saveOutputs(self, file, img, mask, record, binary=None):
+        """
+        Writes the mask and overlay PNGs for one image if enabled.
+
+        Parameters:
+        -----------
+        file : str
+            Source image path, used to name the outputs.
+
+        img : np.ndarray
+            512x512 grayscale source image.
+
+        mask : np.ndarray
+            Raw sigmoid mask of shape (512, 512, 1).
+
+        record : dict
+            Record updated with the written file paths.
+
+        binary : np.ndarray, optional
+            Thresholded mask, when already computed.
+        """
+        if not (self.maskDir or self.overlayDir):
+            return
+
+        stem = self.outputName(file)
+        postprocessor = sm.SegmentationModel.postprocessor
+
+        if self.maskDir:
+            record['mask'] = os.path.join(self.maskDir, stem + '_mask.png')
+            cv2.imwrite(record['mask'], postprocessor.toMask(mask))
+
+        if self.overlayDir:
+            # Blended straight from the grayscale image, without a BGR copy
+            if binary is None:
+                binary = postprocessor.binarize(mask)
+            record['overlay'] = os.path.join(self.overlayDir, stem + '_overlay.png')
+            cv2.imwrite(record['overlay'], postprocessor.overlay(img, binary))
@@ -0,0 +1,425 @@
+import multiprocessing
+from common_libs import os, json, time, platform
+from common_libs import SEG_PATH, CLF_PATH
+
+class BenchmarkController:
+    """
+    End-to-end benchmark of the inference pipeline.
+
+    For every thread count and inference path a fresh process is spawned
+    (TensorFlow's thread pools cannot be resized once created), which loads only
+    the models of its path and records its peak resident memory:
+    - 'separate': the standalone segmentation and classification models, timed
+      on a single image;
+    - 'fused': the single-pass model `MainController.loadInsight` runs. It times
+      the other stages of `loadInsight` on a single image: decode (at reduced
+      resolution), resize to 512x512, fused predict, `getColoredMask` and
+      `ImageTk.PhotoImage` conversion (when a display is available). It also
+      sweeps batch sizes and reports images per second.
+
+    Latencies are summarized as p50/p95/p99. Results are written as JSON and can
+    be compared against a stored baseline, failing when a latency percentile,
+    a throughput or a peak RSS regresses by more than a threshold.
+
+    Attributes:
+    -----------
+    image : str or None
+        Benchmark image; None uses a synthetic X-ray-sized image.
+
+    repeats : int
+        Timed iterations per measurement.
+
+    batchSizes : list of int
+        Batch sizes of the throughput sweep.
+
+    threads : list of int
+        Thread counts to sweep; 0 keeps the library defaults.
+    """
+
+    PATHS = ('separate', 'fused')
+    """tuple: Inference paths, each measured in its own process."""
+
+    def __init__(self, image=None, repeats=10, batchSizes=(1, 4, 8), threads=(0,)):
+        """
+        Configures the benchmark.
+
+        Parameters:
+        -----------
+        image : str, optional
+            Benchmark image. Defaults to the bundled `resource/lungs-original.png`,
+            or a synthetic image if that is missing.
+
+        repeats : int, optional (default=10)
+            Timed iterations per measurement.
+
+        batchSizes : list of int, optional (default=(1, 4, 8))
+            Batch sizes of the throughput sweep.
+
+        threads : list of int, optional (default=(0,))
+            Thread counts to sweep; 0 keeps the library defaults.
+        """
+        bundled = os.path.abspath('resource/lungs-original.png')
+        self.image: str = image or (bundled if os.path.isfile(bundled) else None)
+        """str: Benchmark image; None uses a synthetic X-ray-sized image."""
+
+        self.repeats: int = max(1, repeats)
+        """int: Timed iterations per measurement."""
+
+        self.batchSizes: list = list(batchSizes)
+        """list of int: Batch sizes of the throughput sweep."""
+
+        self.threads: list = list(threads)
+        """list of int: Thread counts to sweep; 0 keeps the library defaults."""
+
+    def run(self, out=None):
+        """
+        Runs every configuration and path in its own process.
+
+        Parameters:
+        -----------
+        out : str, optional
+            Path of the JSON results file.
+
+        Returns:
+        --------
+        dict
+            Benchmark results.
+        """
+        context = multiprocessing.get_context('spawn')
+        results = {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'host': platform.node(),
+                'cpu_count': os.cpu_count(),
+                'image': self.image or 'synthetic',
+                'repeats': self.repeats,
+                'models': [SEG_PATH, CLF_PATH],
+            },
+            'configs': [],
+        }
+
+        for threads in self.threads:
+            config = {'threads': threads, 'stages': {}, 'batches': [], 'peak_rss_mb': {}}
+            for path in self.PATHS:
+                with context.Pool(1) as pool:
+                    part = pool.apply(runConfig, (self.image, self.repeats, self.batchSizes, threads, path))
+                config['stages'].update(part['stages'])
+                config['batches'].extend(part['batches'])
+                config['peak_rss_mb'][path] = part['peak_rss_mb']
+            results['configs'].append(config)
+            print(self.describe(config))
+
+        if out:
+            with open(out, 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+        return results
+
+    @staticmethod
+    def describe(config):
+        """
+        Formats one configuration's results as readable lines.
+        """
+        rss = '  '.join(f'{path}={mb} MB' for path, mb in config['peak_rss_mb'].items())
+        lines = [f"threads={config['threads'] or 'default'}  peak RSS {rss}"]
+        for name, stats in config['stages'].items():
+            lines.append(f"  {name:<22} p50={stats['p50']:9.2f} ms  p95={stats['p95']:9.2f} ms  p99={stats['p99']:9.2f} ms")
+        for batch in config['batches']:
+            lines.append(f"  batch={batch['batch_size']:<3} p50={batch['p50']:9.2f} ms  {batch['images_per_sec']:.2f} img/s")
+        return '\n'.join(lines)
+
+    @staticmethod
+    def compare(results, baseline, threshold=0.1):
+        """
+        Compares results with a baseline run.
+
+        A stage or batch latency percentile (p50, p95 or p99) or a path's peak RSS
+        higher than baseline * (1 + threshold), or a throughput lower than
+        baseline * (1 - threshold), counts as a regression. Configurations are
+        matched by thread count.
+
+        Parameters:
+        -----------
+        results : dict
+            Current results.
+
+        baseline : dict
+            Stored results to compare against.
+
+        threshold : float, optional (default=0.1)
+            Allowed relative slowdown.
+
+        Returns:
+        --------
+        list of str
+            One message per regression; empty if none.
+        """
+        regressions = []
+        previous = {c['threads']: c for c in baseline.get('configs', [])}
+
+        for config in results['configs']:
+            base = previous.get(config['threads'])
+            if base is None:
+                continue
+            tag = f"threads={config['threads'] or 'default'}"
+
+            def latencies(name, stats, old):
+                for key in ('p50', 'p95', 'p99'):
+                    if key in old and stats[key] > old[key] * (1 + threshold):
+                        regressions.append(f"{tag} {name}: {key} {old[key]:.2f} -> {stats[key]:.2f} ms")
+
+            for name, stats in config['stages'].items():
+                old = base['stages'].get(name)
+                if old:
+                    latencies(name, stats, old)
+
+            old_batches = {b['batch_size']: b for b in base['batches']}
+            for batch in config['batches']:
+                old = old_batches.get(batch['batch_size'])
+                if not old:
+                    continue
+                latencies(f"batch={batch['batch_size']}", batch, old)
+                if batch['images_per_sec'] < old['images_per_sec'] * (1 - threshold):
+                    regressions.append(f"{tag} batch={batch['batch_size']}: "
+                                       f"{old['images_per_sec']:.2f} -> {batch['images_per_sec']:.2f} img/s")
+
+            # Baselines from before the per-path processes hold a single number
+            old_rss = base.get('peak_rss_mb')
+            old_rss = old_rss if isinstance(old_rss, dict) else {}
+            for path, mb in config['peak_rss_mb'].items():
+                old = old_rss.get(path)
+                if old and mb and mb > old * (1 + threshold):
+                    regressions.append(f"{tag} {path}: peak RSS {old} -> {mb} MB")
+
+        return regressions
+
+
+def summarize(samples):
+    """
+    Summarizes latency samples in seconds as millisecond percentiles.
+
+    Parameters:
+    -----------
+    samples : list of float
+        Latencies in seconds.
+
+    Returns:
+    --------
+    dict
+        p50, p95, p99 and mean in milliseconds.
+    """
+    from common_libs import np
+
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'mean': round(float(ms.mean()), 3),
+    }
+
+
+def timeit(function, repeats):
+    """
+    Calls `function` once untimed, then `repeats` timed times.
+
+    Returns:
+    --------
+    list of float
+        Latencies in seconds.
+    """
+    function()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peakRssMB():
+    """
+    Returns this process's peak resident set size in megabytes, or None if unknown.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def runConfig(image, repeats, batchSizes, threads, path='fused'):
+    """
+    Benchmarks one thread configuration of one inference path. Runs in a fresh
+    spawned process, so its peak RSS only covers the models of that path.
+
+    Parameters:
+    -----------
+    image : str or None
+        Benchmark image; None uses a synthetic image.
+
+    repeats : int
+        Timed iterations per measurement.
+
+    batchSizes : list of int
+        Batch sizes of the throughput sweep (fused path only).
+
+    threads : int
+        Intra-op, inter-op and OpenCV thread count; 0 keeps the defaults.
+
+    path : str, optional (default='fused')
+        'fused' or 'separate', see `BenchmarkController.PATHS`.
+
+    Returns:
+    --------
+    dict
+        Stage latencies, batch sweep and peak RSS.
+    """
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    from common_libs import np, cv2, tf
+
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 4))
+        cv2.setNumThreads(threads)
+
+    import model.SegmentationModel as sm
+    import model.Preprocessor as pp
+
+    if image is None:
+        # Synthetic film: a large 8-bit image encoded as PNG in memory
+        rng = np.random.default_rng(0)
+        synthetic = (rng.random((2048, 2048, 3)) * 255).astype(np.uint8)
+        image = cv2.imencode('.png', synthetic)[1].tobytes()
+
+    preprocessor = pp.Preprocessor()
+    loaded = preprocessor.load(image, bgr=True)
+    img = preprocessor.fit(loaded, bgr=True)
+
+    if path == 'separate':
+        import model.ClassificationModel as cm
+
+        seg = sm.SegmentationModel(SEG_PATH)
+        clf = cm.ClassificationModel(CLF_PATH)
+        seg.warmup()
+        clf.warmup()
+        stages = {
+            'segmentation_predict': timeit(lambda: seg.predict(img), repeats),
+            'classification_predict': timeit(lambda: clf.predict(img), repeats),
+        }
+        return {
+            'stages': {name: summarize(samples) for name, samples in stages.items()},
+            'batches': [],
+            'peak_rss_mb': peakRssMB(),
+        }
+
+    import model.FusedModel as fm
+
+    fused = fm.FusedModel(SEG_PATH, CLF_PATH)
+    fused.warmup()
+    mask, _ = fused.predict(img)
+    overlay = sm.SegmentationModel.getColoredMask(img, mask)
+
+    stages = {
+        'decode': timeit(lambda: preprocessor.load(image, bgr=True), repeats),
+        'resize': timeit(lambda: preprocessor.fit(loaded, bgr=True), repeats),
+        'fused_predict': timeit(lambda: fused.predict(img), repeats),
+        'colored_mask': timeit(lambda: sm.SegmentationModel.getColoredMask(img, mask), repeats),
+    }
+
+    try:
+        import tkinter as tk
+        from common_libs import Image, ImageTk
+        root = tk.Tk()
+        root.withdraw()
+        stages['photoimage'] = timeit(lambda: [ImageTk.PhotoImage(Image.fromarray(a)) for a in (img, mask, overlay)],
+                                      repeats)
+        root.destroy()
+    except Exception:
+        # No display available: the Tk conversion stage is skipped
+        pass
+
+    batches = []
+    for batch_size in batchSizes:
+        x = fused.preprocessor.toBatch([img] * batch_size)
+        samples = timeit(lambda: fused.predictTensor(x), repeats)
+        entry = summarize(samples)
+        entry['batch_size'] = batch_size
+        entry['images_per_sec'] = round(batch_size / float(np.median(samples)), 3)
+        batches.append(entry)
+
+    return {
+        'stages': {name: summarize(samples) for name, samples in stages.items()},
+        'batches': batches,
+        'peak_rss_mb': peakRssMB(),
+    }
+
+
+def parity(source, maxSamples=64):
+    """
+    Measures how far the fast decode path moves the model inputs and outputs
+    away from the reference preprocessing.
+
+    Two paths are checked against their reference on every film:
+    - 'grayscale' (batch, watch, store): `Preprocessor.decode` against the training
+      notebook's `cv2.imread(file, 0)` and bilinear `cv2.resize`;
+    - 'bgr' (GUI, server): `Preprocessor.decode(bgr=True)` against the original
+      `loadInsight` path, `cv2.imread(file, 1)`, bilinear `cv2.resize`, then BGR to gray.
+
+    Parameters:
+    -----------
+    source : str
+        Directory or glob of X-rays.
+
+    maxSamples : int, optional (default=64)
+        Largest number of films checked.
+
+    Returns:
+    --------
+    dict
+        Per path: films checked, largest and mean absolute tensor difference (in
+        [0, 1] intensity units), largest probability difference and label agreement.
+    """
+    from common_libs import np, cv2
+    from common_libs import TB_THRESHOLD
+    import model.FusedModel as fm
+    import controller.BatchController as bc
+
+    fused = fm.FusedModel(SEG_PATH, CLF_PATH)
+    preprocessor = fused.preprocessor
+    size = preprocessor.size
+
+    def reference(file, bgr):
+        img = cv2.imread(file, 1 if bgr else 0)
+        if img is None:
+            return None
+        img = cv2.resize(img, size)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if bgr else img
+
+    stats = {path: {'tensor': [], 'prob': [], 'agree': []} for path in ('grayscale', 'bgr')}
+    for file in bc.BatchController.collectFiles(source)[:maxSamples]:
+        for path, bgr in (('grayscale', False), ('bgr', True)):
+            ref, img = reference(file, bgr), preprocessor.decode(file, bgr=bgr)
+            if ref is None or img is None:
+                continue
+            x = preprocessor.toBatch([ref, img])
+            _, probs = fused.predictTensor(x)
+            diff = np.abs(x[0] - x[1])
+            stats[path]['tensor'].append((float(diff.max()), float(diff.mean())))
+            stats[path]['prob'].append(float(abs(probs[0] - probs[1])))
+            stats[path]['agree'].append(bool((probs[0] > TB_THRESHOLD) == (probs[1] > TB_THRESHOLD)))
+
+    report = {}
+    for path, values in stats.items():
+        if not values['tensor']:
+            continue
+        report[path] = {
+            'films': len(values['tensor']),
+            'max_tensor_diff': round(max(v[0] for v in values['tensor']), 6),
+            'mean_tensor_diff': round(float(np.mean([v[1] for v in values['tensor']])), 6),
+            'max_prob_diff': round(max(values['prob']), 6),
+            'label_agreement': float(np.mean(values['agree'])),
+        }
+    return report
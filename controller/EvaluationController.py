@@ -0,0 +1,350 @@
+import model.FusedModel as fm
+import model.PreviewModel as pm
+import model.Postprocessor as ps
+import model.TensorStore as ts
+import controller.StreamingPipeline as sp
+import controller.BatchController as bc
+from common_libs import os, csv, np, cv2
+from common_libs import SEG_PATH, CLF_PATH, IMG_EXTENSIONS, TB_THRESHOLD
+
+class EvaluationController:
+    """
+    Headless controller that scores a validation set against ground truth.
+
+    Images run through the fused model in batches on a StreamingPipeline, so
+    decoding, inference and metric computation overlap. For every image the
+    output stage thresholds the predicted mask, reads the ground-truth mask and
+    keeps only the intersection and the predicted and true pixel counts; no mask
+    outlives its batch. Per-image Dice and IoU follow from these counts, and the
+    global (pooled) scores from their running sums. Per-image rows are streamed
+    to disk, so memory stays bounded however large the set is.
+
+    With a labels CSV, the TB probabilities are also scored: ROC AUC, and
+    sensitivity, specificity and accuracy at the decision threshold.
+
+    With `preview`, the low-resolution PreviewModel is scored instead of the
+    full-resolution model. Against masks saved by `batch --mask-dir`, this
+    measures how closely the progressive preview matches the full result.
+
+    Attributes:
+    -----------
+    masks : dict
+        Ground-truth mask path of each image stem.
+
+    labels : dict
+        Ground-truth TB label (0 or 1) of each image key (path, file name or stem).
+
+    threshold : float
+        TB probability above which a film counts as positive.
+
+    postprocessor : Postprocessor
+        Thresholds the predicted masks.
+
+    store : TensorStore or None
+        Preprocessed inputs read instead of decoding, or None.
+
+    pipeline : StreamingPipeline
+        Overlapped decode / inference / metric stages.
+    """
+
+    FIELDS = ('file', 'dice', 'iou', 'intersection', 'predicted', 'truth', 'probability', 'tb_label', 'error')
+    """tuple: Column order of the per-image rows."""
+
+    MASK_SUFFIXES = ('_mask', '-mask', '_seg', '-seg', '_segmentation')
+    """tuple: Suffixes stripped from ground-truth mask names to find their image."""
+
+    LABEL_VALUES = {'1': 1, 'true': 1, 'yes': 1, 'positive': 1, 'tb': 1, 'tuberculosis': 1,
+                    '0': 0, 'false': 0, 'no': 0, 'negative': 0, 'normal': 0}
+    """dict: Accepted spellings of the labels in the labels CSV."""
+
+    def __init__(self, maskDir=None, labels=None, batchSize=8, workers=None, prefetch=2, store=None,
+                 decodeProcesses=0, maskThreshold=0.5, threshold=TB_THRESHOLD, preview=False):
+        """
+        Loads the models and indexes the ground truth.
+
+        Parameters:
+        -----------
+        maskDir : str, optional
+            Directory of ground-truth lung masks named after their images.
+
+        labels : str, optional
+            CSV of image names and TB labels.
+
+        batchSize : int, optional (default=8)
+            Number of images per model call.
+
+        workers : int, optional
+            Decode threads. Defaults to the number of CPUs, capped at 8.
+
+        prefetch : int, optional (default=2)
+            Number of batches decoded ahead of the one being inferred.
+
+        store : str, optional
+            Tensor store directory built with the `build-store` command.
+
+        decodeProcesses : int, optional (default=0)
+            Decode in this many processes sharing the batch buffers instead of in threads.
+
+        maskThreshold : float, optional (default=0.5)
+            Sigmoid value from which a predicted pixel counts as lung.
+
+        threshold : float, optional (default=TB_THRESHOLD)
+            TB probability above which a film counts as positive.
+
+        preview : bool, optional (default=False)
+            Score the low-resolution preview model instead of the full-resolution one.
+        """
+        self.masks: dict = self.indexMasks(maskDir) if maskDir else {}
+        """dict: Ground-truth mask path of each image stem."""
+
+        self.labels: dict = self.readLabels(labels) if labels else {}
+        """dict: Ground-truth TB label (0 or 1) of each image key (path, file name or stem)."""
+
+        self.threshold: float = threshold
+        """float: TB probability above which a film counts as positive."""
+
+        self.postprocessor: ps.Postprocessor = ps.Postprocessor(threshold=maskThreshold)
+        """Postprocessor: Thresholds the predicted masks."""
+
+        self.store: ts.TensorStore = ts.TensorStore(store) if store else None
+        """TensorStore: Preprocessed inputs read instead of decoding, or None."""
+
+        fused_model = fm.FusedModel(SEG_PATH, CLF_PATH)
+        if preview:
+            fused_model = pm.PreviewModel(fused_model)
+        fused_model.warmup()
+
+        self.pipeline: sp.StreamingPipeline = sp.StreamingPipeline(
+            fused_model, self.finish, batchSize, workers, outputWorkers=workers or min(8, os.cpu_count() or 1),
+            prefetch=prefetch, store=self.store, decodeProcesses=decodeProcesses)
+        """StreamingPipeline: Overlapped decode / inference / metric stages."""
+
+    @staticmethod
+    def stem(path):
+        """
+        Returns the file name of `path` without directory and extension.
+        """
+        return os.path.splitext(os.path.basename(path))[0]
+
+    @classmethod
+    def indexMasks(cls, directory):
+        """
+        Maps image stems to the ground-truth masks in `directory`.
+
+        A mask matches the image with the same stem, optionally followed by one of
+        `MASK_SUFFIXES` (e.g. 'CHNCXR_0001_0_mask.png' for 'CHNCXR_0001_0.png').
+        """
+        masks = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith(IMG_EXTENSIONS):
+                continue
+            stem = cls.stem(name)
+            for suffix in cls.MASK_SUFFIXES:
+                if stem.lower().endswith(suffix):
+                    stem = stem[:-len(suffix)]
+                    break
+            masks[stem] = os.path.join(directory, name)
+        return masks
+
+    @classmethod
+    def readLabels(cls, path):
+        """
+        Reads a labels CSV into a dict keyed by path, file name and stem.
+
+        The image column is the first of 'file', 'image', 'path', 'filename' or
+        'name' present (else the first column); the label column the first of
+        'label', 'tb', 'target' or 'class' (else the second). Labels are 0/1 or
+        words such as 'positive'/'negative' or 'tb'/'normal'.
+        """
+        with open(path, newline='') as fh:
+            reader = csv.DictReader(fh)
+            columns = {name.lower().strip(): name for name in reader.fieldnames or ()}
+            key = next((columns[c] for c in ('file', 'image', 'path', 'filename', 'name') if c in columns),
+                       reader.fieldnames[0])
+            value = next((columns[c] for c in ('label', 'tb', 'target', 'class') if c in columns),
+                         reader.fieldnames[1])
+
+            labels = {}
+            for row in reader:
+                label = cls.LABEL_VALUES.get(str(row[value]).strip().lower())
+                if label is None:
+                    raise ValueError(f'Unrecognized label {row[value]!r} for {row[key]!r} in {path}')
+                name = row[key].strip()
+                for alias in (os.path.abspath(name), os.path.basename(name), cls.stem(name)):
+                    labels.setdefault(alias, label)
+
+        return labels
+
+    def lookupLabel(self, file):
+        """
+        Returns the TB label of `file`, matched by path, file name or stem, or None.
+        """
+        for alias in (os.path.abspath(file), os.path.basename(file), self.stem(file)):
+            if alias in self.labels:
+                return self.labels[alias]
+        return None
+
+    def readMask(self, path, shape):
+        """
+        Reads a ground-truth mask as a bool array of `shape`; white pixels are lung.
+        """
+        mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            raise ValueError(f'unreadable mask {path}')
+        if mask.shape != shape:
+            mask = cv2.resize(mask, shape[::-1], interpolation=cv2.INTER_AREA)
+        return mask > 127
+
+    def finish(self, file, img, mask, tb, error):
+        """
+        Output stage: reduces one prediction to its overlap counts and label.
+
+        Parameters:
+        -----------
+        file : str
+            Source image path.
+
+        img : np.ndarray or None
+            512x512 grayscale source image (unused).
+
+        mask : np.ndarray or None
+            Raw sigmoid mask of shape (512, 512, 1).
+
+        tb : float or None
+            Predicted TB probability.
+
+        error : Exception or None
+            Decode failure, if any.
+
+        Returns:
+        --------
+        dict
+            Per-image row with the counts, Dice, IoU, probability and label.
+        """
+        record = dict.fromkeys(self.FIELDS)
+        record['file'] = file
+
+        if error is not None:
+            record['error'] = str(error)
+            return record
+
+        record['probability'] = round(float(tb), 6)
+        record['tb_label'] = self.lookupLabel(file)
+
+        truth_path = self.masks.get(self.stem(file))
+        if truth_path is not None:
+            try:
+                predicted = self.postprocessor.binarize(mask)
+                truth = self.readMask(truth_path, predicted.shape)
+            except ValueError as e:
+                record['error'] = str(e)
+                return record
+
+            intersection = int(np.count_nonzero(predicted & truth))
+            record.update(intersection=intersection, predicted=int(np.count_nonzero(predicted)),
+                          truth=int(np.count_nonzero(truth)))
+            record.update(self.overlap(intersection, record['predicted'], record['truth']))
+
+        return record
+
+    @staticmethod
+    def overlap(intersection, predicted, truth):
+        """
+        Returns Dice and IoU from pixel counts; two empty masks agree perfectly.
+        """
+        total = predicted + truth
+        union = total - intersection
+        return {'dice': round(2 * intersection / total, 6) if total else 1.0,
+                'iou': round(intersection / union, 6) if union else 1.0}
+
+    @staticmethod
+    def auc(labels, scores):
+        """
+        Computes the ROC AUC as the Mann-Whitney statistic, with tied scores
+        sharing their average rank. Returns None unless both classes are present.
+        """
+        labels = np.asarray(labels, dtype=bool)
+        scores = np.asarray(scores, dtype=np.float64)
+        positives = int(labels.sum())
+        negatives = len(labels) - positives
+        if not positives or not negatives:
+            return None
+
+        _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+        ranks = (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+
+        return float((ranks[labels].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+    def run(self, source, out=None):
+        """
+        Evaluates every image matched by `source`.
+
+        Parameters:
+        -----------
+        source : str or None
+            Directory or glob pattern of input X-rays. May be None with a tensor
+            store to evaluate every stored image.
+
+        out : str, optional
+            CSV file receiving one row per image.
+
+        Returns:
+        --------
+        dict
+            Summary: image counts, mean and global Dice/IoU, and the
+            classification metrics when labels were given.
+        """
+        files = self.store.paths() if source is None and self.store else bc.BatchController.collectFiles(source)
+
+        # Only scalars are kept per image; masks are reduced in the output stage
+        sums = {'intersection': 0, 'predicted': 0, 'truth': 0}
+        dice, iou, labels, scores = [], [], [], []
+        summary = {'images': 0, 'failed': 0, 'with_mask': 0, 'with_label': 0}
+
+        fh = open(out, 'w', newline='') if out else None
+        try:
+            writer = csv.DictWriter(fh, fieldnames=self.FIELDS) if fh else None
+            if writer:
+                writer.writeheader()
+
+            for record in self.pipeline.run(files):
+                summary['images'] += 1
+                if writer:
+                    writer.writerow(record)
+                if record['error'] is not None:
+                    summary['failed'] += 1
+                    continue
+
+                if record['dice'] is not None:
+                    summary['with_mask'] += 1
+                    dice.append(record['dice'])
+                    iou.append(record['iou'])
+                    for key in sums:
+                        sums[key] += record[key]
+
+                if record['tb_label'] is not None:
+                    summary['with_label'] += 1
+                    labels.append(record['tb_label'])
+                    scores.append(record['probability'])
+        finally:
+            if fh:
+                fh.close()
+
+        if dice:
+            pooled = self.overlap(sums['intersection'], sums['predicted'], sums['truth'])
+            summary.update(mean_dice=round(float(np.mean(dice)), 6), mean_iou=round(float(np.mean(iou)), 6),
+                           global_dice=pooled['dice'], global_iou=pooled['iou'])
+
+        if labels:
+            truth = np.asarray(labels, dtype=bool)
+            predicted = np.asarray(scores) > self.threshold
+            tp, tn = int(np.sum(truth & predicted)), int(np.sum(~truth & ~predicted))
+            fp, fn = int(np.sum(~truth & predicted)), int(np.sum(truth & ~predicted))
+            auc = self.auc(labels, scores)
+            summary.update(auc=None if auc is None else round(auc, 6),
+                           sensitivity=round(tp / (tp + fn), 6) if tp + fn else None,
+                           specificity=round(tn / (tn + fp), 6) if tn + fp else None,
+                           accuracy=round((tp + tn) / len(labels), 6),
+                           confusion={'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn})
+
+        return summary
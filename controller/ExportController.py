@@ -0,0 +1,300 @@
+import model.SegmentationModel as sm
+import model.ClassificationModel as cm
+import model.FusedModel as fm
+import model.Preprocessor as pp
+import model.TensorStore as ts
+import controller.BatchController as bc
+from common_libs import os, json, shutil, np, tf
+from common_libs import SEG_PATH, CLF_PATH, TB_THRESHOLD
+from common_libs import dice_coefficient, jaccard_index
+
+class ExportController:
+    """
+    Converts the .keras models into CPU-friendly TFLite and/or ONNX files and
+    reports how closely each export matches the reference Keras models.
+
+    When the classifier embeds the segmentation U-Net, the single-pass graph built
+    by `FusedModel.buildFused` is exported as one model with two outputs, the mask
+    and the probability, so deployments keep running the U-Net once per image.
+    Otherwise the two models are exported separately.
+
+    TFLite exports support fp32, fp16, dynamic-range and full int8 quantization
+    (the latter calibrated on a set of X-rays). ONNX exports support fp32 and,
+    through ONNX Runtime's quantization tools, dynamic and static int8. For each
+    export the segmentation masks are compared with Dice/Jaccard from
+    common_libs and the classification probabilities by absolute difference and
+    label agreement.
+
+    Attributes:
+    -----------
+    outDir : str
+        Directory where the exported models and the report are written.
+
+    calibration : list of np.ndarray
+        Preprocessed calibration inputs, each of shape (1, 512, 512, 1).
+
+    evaluation : list of np.ndarray
+        Preprocessed evaluation inputs, each of shape (1, 512, 512, 1).
+    """
+
+    QUANTIZATIONS = ('fp32', 'fp16', 'dynamic', 'int8')
+    """tuple: Supported quantization modes."""
+
+    def __init__(self, outDir, calibration=None, evaluation=None, maxSamples=64):
+        """
+        Loads the calibration and evaluation images.
+
+        Parameters:
+        -----------
+        outDir : str
+            Directory where the exported models and the report are written.
+
+        calibration : str, optional
+            Directory, glob or tensor store of X-rays used to calibrate int8 quantization.
+
+        evaluation : str, optional
+            Directory, glob or tensor store of X-rays used for the accuracy report. Defaults to
+            the calibration set, or the bundled sample X-ray.
+
+        maxSamples : int, optional (default=64)
+            Largest number of images read from each set.
+        """
+        self.outDir: str = outDir
+        """str: Directory where the exported models and the report are written."""
+        os.makedirs(self.outDir, exist_ok=True)
+
+        preprocessor = pp.Preprocessor()
+
+        def load(source):
+            if ts.TensorStore.isStore(source):
+                store = ts.TensorStore(source)
+                return [store.batch(row, row + 1) for row in range(min(len(store), maxSamples))]
+            files = bc.BatchController.collectFiles(source)[:maxSamples] if source else []
+            images = (preprocessor.decode(f) for f in files)
+            return [preprocessor.toBatch([img]) for img in images if img is not None]
+
+        self.calibration: list = load(calibration)
+        """list of np.ndarray: Preprocessed calibration inputs."""
+
+        self.evaluation: list = load(evaluation) or self.calibration or load(os.path.abspath('resource/lungs-original.png'))
+        """list of np.ndarray: Preprocessed evaluation inputs."""
+
+        self._exported = {}
+
+    def run(self, formats=('tflite',), quantizations=('fp32',)):
+        """
+        Exports the fused model (or both models) in every requested format and
+        quantization and writes `export_report.json` to the output directory.
+
+        Parameters:
+        -----------
+        formats : list of str, optional (default=('tflite',))
+            Any of 'tflite' and 'onnx'.
+
+        quantizations : list of str, optional (default=('fp32',))
+            Any of 'fp32', 'fp16', 'dynamic' and 'int8'.
+
+        Returns:
+        --------
+        list of dict
+            One report entry per exported fused model or model pair.
+        """
+        from common_libs import keras
+
+        if 'int8' in quantizations and not self.calibration:
+            raise ValueError('int8 quantization needs a calibration set (--calibration)')
+
+        fused = fm.FusedModel(SEG_PATH, CLF_PATH, compiled=False)
+        reference = [fused.predictTensor(x) for x in self.evaluation]
+        if fused.fused:
+            # The embedding output is only used by the GUI's results index
+            graph = keras.Model(fused.model.inputs, fused.model.outputs[:2])
+        else:
+            seg = sm.SegmentationModel(SEG_PATH, compiled=False)
+            clf = cm.ClassificationModel(CLF_PATH, compiled=False)
+
+        report = []
+        for fmt in formats:
+            for quant in quantizations:
+                if fmt == 'onnx' and quant == 'fp16':
+                    report.append({'format': fmt, 'quantization': quant, 'error': 'fp16 is only supported for tflite'})
+                    continue
+
+                export = self.tflite if fmt == 'tflite' else self.onnx
+                if fused.fused:
+                    fused_path = export(graph, 'best_fused_model', quant)
+                    entry = {'format': fmt, 'quantization': quant, 'fused': fused_path}
+                    entry.update(self.compare(fused_path, fused_path, reference))
+                else:
+                    seg_path = export(seg.model, 'best_seg_model', quant)
+                    clf_path = export(clf.model, 'best_clf_model', quant)
+                    entry = {'format': fmt, 'quantization': quant, 'segmentation': seg_path, 'classification': clf_path}
+                    entry.update(self.compare(seg_path, clf_path, reference))
+                report.append(entry)
+                print(self.describe(entry))
+
+        # Remove the intermediate SavedModel directories
+        for path in self._exported.values():
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+        with open(os.path.join(self.outDir, 'export_report.json'), 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+        return report
+
+    def representativeData(self):
+        """
+        Yields calibration inputs for int8 quantization.
+        """
+        for x in self.calibration:
+            yield [x]
+
+    def tflite(self, model, name, quant):
+        """
+        Converts a Keras model to TFLite.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            Model to convert.
+
+        name : str
+            Base name of the output file.
+
+        quant : str
+            One of 'fp32', 'fp16', 'dynamic' and 'int8'.
+
+        Returns:
+        --------
+        str
+            Path of the written .tflite file.
+        """
+        saved_model = self._exported.get(('savedmodel', name))
+        if saved_model is None:
+            saved_model = os.path.join(self.outDir, f'.{name}_savedmodel')
+            spec = tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.float32)
+            model.export(saved_model, format='tf_saved_model', input_signature=[spec], verbose=False)
+            self._exported[('savedmodel', name)] = saved_model
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+        if quant != 'fp32':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quant == 'fp16':
+            converter.target_spec.supported_types = [tf.float16]
+        if quant == 'int8':
+            converter.representative_dataset = self.representativeData
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+        path = os.path.join(self.outDir, f'{name}_{quant}.tflite')
+        with open(path, 'wb') as fh:
+            fh.write(converter.convert())
+
+        return path
+
+    def onnx(self, model, name, quant):
+        """
+        Converts a Keras model to ONNX, quantizing it with ONNX Runtime if requested.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            Model to convert.
+
+        name : str
+            Base name of the output file.
+
+        quant : str
+            One of 'fp32', 'dynamic' and 'int8'.
+
+        Returns:
+        --------
+        str
+            Path of the written .onnx file.
+        """
+        try:
+            import tf2onnx
+        except ImportError as e:
+            raise ImportError('ONNX export requires the tf2onnx package (pip install tf2onnx)') from e
+
+        fp32_path = self._exported.get(('onnx', name))
+        if fp32_path is None:
+            spec = tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.float32, name='input')
+            forward = tf.function(lambda x: model(x, training=False), input_signature=[spec])
+            fp32_path = os.path.join(self.outDir, f'{name}_fp32.onnx')
+            tf2onnx.convert.from_function(forward, input_signature=[spec], opset=17, output_path=fp32_path)
+            self._exported[('onnx', name)] = fp32_path
+        if quant == 'fp32':
+            return fp32_path
+
+        from onnxruntime import quantization as oq
+
+        path = os.path.join(self.outDir, f'{name}_{quant}.onnx')
+        if quant == 'dynamic':
+            oq.quantize_dynamic(fp32_path, path, weight_type=oq.QuantType.QInt8)
+        else:
+            class CalibrationReader(oq.CalibrationDataReader):
+                def __init__(self, inputs):
+                    self.inputs = iter(inputs)
+
+                def get_next(self):
+                    x = next(self.inputs, None)
+                    return None if x is None else {'input': x}
+
+            oq.quantize_static(fp32_path, path, CalibrationReader(self.calibration), quant_format=oq.QuantFormat.QDQ,
+                               activation_type=oq.QuantType.QInt8, weight_type=oq.QuantType.QInt8)
+
+        return path
+
+    def compare(self, segPath, clfPath, reference):
+        """
+        Measures how closely exported models reproduce the reference outputs.
+
+        Parameters:
+        -----------
+        segPath : str
+            Exported segmentation model, or the exported fused model.
+
+        clfPath : str
+            Exported classification model, or the exported fused model.
+
+        reference : list of tuple
+            (masks, probabilities) outputs of the Keras models per evaluation input.
+
+        Returns:
+        --------
+        dict
+            Mean Dice and Jaccard of the binarized masks, largest and mean
+            probability difference, label agreement, whether the export runs as a
+            single pass, and model file sizes in MB.
+        """
+        exported = fm.FusedModel(segPath, clfPath)
+
+        dice, jaccard, diffs, agree = [], [], [], []
+        for x, (ref_mask, ref_prob) in zip(self.evaluation, reference):
+            mask, prob = exported.predictTensor(x)
+            mask = mask > 0.5
+            dice.append(float(dice_coefficient(ref_mask > 0.5, mask)))
+            jaccard.append(float(jaccard_index(ref_mask > 0.5, mask)))
+            diffs.append(float(np.abs(prob - ref_prob).max()))
+            agree.append(bool(np.all((prob > TB_THRESHOLD) == (ref_prob > TB_THRESHOLD))))
+
+        return {
+            'dice': float(np.mean(dice)),
+            'jaccard': float(np.mean(jaccard)),
+            'max_prob_diff': float(np.max(diffs)),
+            'mean_prob_diff': float(np.mean(diffs)),
+            'label_agreement': float(np.mean(agree)),
+            'single_pass': exported.fused,
+            'size_mb': round(sum(os.path.getsize(path) for path in {segPath, clfPath}) / 2 ** 20, 2),
+        }
+
+    @staticmethod
+    def describe(entry):
+        """
+        Formats one report entry as a single line.
+        """
+        return (f"{entry['format']:>6} {entry['quantization']:>7}: "
+                f"dice={entry['dice']:.4f} jaccard={entry['jaccard']:.4f} "
+                f"max|dp|={entry['max_prob_diff']:.4f} agreement={entry['label_agreement']:.2%} "
+                f"size={entry['size_mb']} MB" + (' (single pass)' if entry['single_pass'] else ''))
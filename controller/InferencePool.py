@@ -0,0 +1,453 @@
+import multiprocessing
+import model.Preprocessor as pp
+import model.SegmentationModel as sm
+import controller.StreamingPipeline as sp
+import controller.SharedRing as sr
+from common_libs import os, time, queue, threading, warnings, ThreadPoolExecutor
+from common_libs import SEG_PATH, CLF_PATH
+
+_worker = {}
+"""dict: State of the current worker process (index, cores, model, decoder or error)."""
+
+
+class InferencePool:
+    """
+    Pool of worker processes, each holding its own copy of the models.
+
+    A single TensorFlow process on a many-core machine lets its intra-op and
+    inter-op pools and OpenCV's threads compete for every core. The pool instead
+    partitions the cores: each worker is pinned (where the OS supports it) to its
+    own slice of `threads` cores and configures TensorFlow and OpenCV to use
+    exactly that many threads. Workers load the fused segmentation/classification
+    model once at start-up. Batches are distributed to whichever worker is free
+    and results come back in submission order.
+
+    `predictTensor` hands batches over through a SharedRing with one slot per
+    worker: the caller copies the batch into a free slot, only the slot index
+    crosses the process boundary, and the worker writes the masks and
+    probabilities back into the same slot.
+
+    Attributes:
+    -----------
+    processes : int
+        Number of worker processes.
+
+    threads : int
+        TensorFlow intra-op threads (and pinned cores) per worker.
+
+    interThreads : int
+        TensorFlow inter-op threads per worker.
+
+    cvThreads : int
+        OpenCV threads per worker.
+
+    cores : list of int or None
+        CPUs the workers are pinned to, or None to leave scheduling to the OS.
+
+    preprocessor : Preprocessor
+        Builds the input tensors submitted to `predictTensor`.
+
+    fused : bool
+        True when every worker runs the single-pass fused model.
+
+    batchSize : int
+        Images per ring slot; larger batches are split into slot-sized calls.
+    """
+
+    def __init__(self, processes, threads=None, interThreads=1, cvThreads=1, pin=True, store=None, batchSize=8):
+        """
+        Starts the worker processes; they load the models in the background.
+
+        Parameters:
+        -----------
+        processes : int
+            Number of worker processes.
+
+        threads : int, optional
+            TensorFlow intra-op threads per worker. Defaults to the available
+            cores divided evenly between the workers.
+
+        interThreads : int, optional (default=1)
+            TensorFlow inter-op threads per worker.
+
+        cvThreads : int, optional (default=1)
+            OpenCV threads per worker.
+
+        pin : bool, optional (default=True)
+            Pin each worker to its own slice of `threads` cores.
+
+        store : str, optional
+            Tensor store directory read by `run` instead of decoding the files.
+
+        batchSize : int, optional (default=8)
+            Images per ring slot used by `predictTensor`.
+        """
+        available = availableCores()
+
+        self.processes: int = max(1, processes)
+        """int: Number of worker processes."""
+
+        self.threads: int = threads or max(1, len(available) // self.processes)
+        """int: TensorFlow intra-op threads (and pinned cores) per worker."""
+
+        self.interThreads: int = max(1, interThreads)
+        """int: TensorFlow inter-op threads per worker."""
+
+        self.cvThreads: int = max(1, cvThreads)
+        """int: OpenCV threads per worker."""
+
+        self.cores: list = available if pin and hasattr(os, 'sched_setaffinity') else None
+        """list of int: CPUs the workers are pinned to, or None to leave scheduling to the OS."""
+
+        self.preprocessor: pp.Preprocessor = pp.Preprocessor()
+        """Preprocessor: Builds the input tensors submitted to `predictTensor`."""
+
+        self.fused: bool = False
+        """bool: True when every worker runs the single-pass fused model."""
+
+        self.batchSize: int = max(1, batchSize)
+        """int: Images per ring slot; larger batches are split into slot-sized calls."""
+
+        # The ring is only created by the first predictTensor call; `run` does not use it
+        self._ring = None
+        self._slots = queue.Queue()
+        self._ringLock = threading.Lock()
+
+        config = {'processes': self.processes, 'threads': self.threads, 'interThreads': self.interThreads,
+                  'cvThreads': self.cvThreads, 'cores': self.cores, 'store': store}
+
+        context = multiprocessing.get_context('spawn')
+        self._started = context.Value('i', 0)
+        self._ready = context.Value('i', 0)
+        self.pool = context.Pool(self.processes, initWorker, (config, self._started, self._ready))
+        """multiprocessing.Pool: The worker processes."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def warmup(self, timeout=600):
+        """
+        Waits until every worker has loaded its model.
+
+        Parameters:
+        -----------
+        timeout : float, optional (default=600)
+            Longest wait in seconds.
+
+        Returns:
+        --------
+        list of dict
+            Status of each worker: index, pinned cores, fused flag, load time.
+
+        Raises:
+        -------
+        RuntimeError
+            If a worker failed to load the models or the timeout expired.
+        """
+        deadline = time.monotonic() + timeout
+        while self._ready.value < self.processes:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Timed out waiting for inference workers')
+            time.sleep(0.05)
+
+        # One status call per worker: each call blocks its worker until all have picked one up
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            barrier = manager.Barrier(self.processes)
+            statuses = self.pool.map(workerStatus, [barrier] * self.processes, chunksize=1)
+
+        errors = [s['error'] for s in statuses if s.get('error')]
+        if errors:
+            raise RuntimeError(f'Inference worker failed to start: {errors[0]}')
+
+        self.fused = all(s['fused'] for s in statuses)
+        return sorted(statuses, key=lambda s: s['index'])
+
+    def run(self, files, batchSize=8, withImages=False):
+        """
+        Scores files across the workers, yielding results in input order.
+
+        Parameters:
+        -----------
+        files : list of str
+            Image paths (looked up in the tensor store when one is set).
+
+        batchSize : int, optional (default=8)
+            Images per job and per model call.
+
+        withImages : bool, optional (default=False)
+            Also return the 512x512 grayscale image and raw mask of each file, e.g. to save
+            overlays; otherwise only probabilities cross the process boundary.
+
+        Yields:
+        -------
+        tuple
+            (file, img, mask, tb, error, fraction) as expected by `BatchController.finish`.
+        """
+        batchSize = max(1, batchSize)
+        jobs = ((files[i:i + batchSize], withImages) for i in range(0, len(files), batchSize))
+        for results in self.pool.imap(scoreFiles, jobs):
+            yield from results
+
+    def ring(self):
+        """
+        Returns the shared ring, creating it with one slot per worker on first use.
+        """
+        with self._ringLock:
+            if self._ring is None:
+                self._ring = sr.SharedRing(self.processes, self.batchSize, self.preprocessor.size)
+                for index in range(self.processes):
+                    self._slots.put(index)
+        return self._ring
+
+    def predictTensor(self, x):
+        """
+        Runs one preprocessed batch on the next free worker. Safe to call from
+        several threads; each call waits for a free ring slot.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1).
+
+        Returns:
+        --------
+        tuple
+            (masks, probs) as returned by `FusedModel.predictTensor`.
+        """
+        from common_libs import np
+
+        ring = self.ring()
+        masks = np.empty(x.shape, dtype=np.float32)
+        probs = np.empty(len(x), dtype=np.float32)
+
+        index = self._slots.get()
+        try:
+            for start in range(0, len(x), ring.batchSize):
+                count = min(ring.batchSize, len(x) - start)
+                ring.claim(index)
+                ring.inputs[index, :count] = x[start:start + count]
+                ring.advance(index, ring.FILLING, ring.READY)
+                self.pool.apply(predictSlot, (ring.spec, index, count))
+                ring.advance(index, ring.READY, ring.INFERRED)
+                masks[start:start + count] = ring.masks[index, :count]
+                probs[start:start + count] = ring.probs[index, :count]
+                ring.release(index)
+        except BaseException:
+            # A failed call leaves the slot mid-cycle; only this call held it
+            ring.states[index] = ring.FREE
+            raise
+        finally:
+            self._slots.put(index)
+
+        return masks, probs
+
+    def close(self):
+        """
+        Stops the worker processes and removes the shared ring.
+        """
+        self.pool.terminate()
+        self.pool.join()
+        if self._ring is not None:
+            self._ring.close()
+
+
+def availableCores():
+    """
+    Returns the CPUs this process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def initWorker(config, started, ready):
+    """
+    Worker start-up: pins the process, configures thread pools and loads the models.
+
+    Errors are kept and re-raised by every job, since a failing pool initializer
+    would otherwise make the pool restart the worker forever.
+    """
+    with started.get_lock():
+        index = started.value % config['processes']
+        started.value += 1
+
+    try:
+        os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+        warnings.filterwarnings('ignore')
+
+        cores = None
+        if config['cores']:
+            # Consecutive, non-overlapping slices of the allowed cores
+            allowed = config['cores']
+            cores = [allowed[(index * config['threads'] + k) % len(allowed)] for k in range(config['threads'])]
+            os.sched_setaffinity(0, cores)
+
+        # Thread pools must be sized before TensorFlow runs its first op
+        from common_libs import tf, cv2
+        tf.config.threading.set_intra_op_parallelism_threads(config['threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(config['interThreads'])
+        cv2.setNumThreads(config['cvThreads'])
+
+        import model.FusedModel as fm
+        import model.TensorStore as ts
+
+        start = time.perf_counter()
+        fused_model = fm.FusedModel(SEG_PATH, CLF_PATH)
+        fused_model.warmup()
+
+        store = ts.TensorStore(config['store']) if config['store'] else None
+        _worker.update(index=index, cores=cores, model=fused_model, loadTime=time.perf_counter() - start,
+                       # The pipeline is only used for its decode stage
+                       decoder=sp.StreamingPipeline(fused_model, None, store=store))
+    except Exception as e:
+        _worker.update(index=index, error=f'{type(e).__name__}: {e}')
+    finally:
+        with ready.get_lock():
+            ready.value += 1
+
+
+def workerModel():
+    """
+    Returns the worker's model, or raises the error that stopped it from loading.
+    """
+    if 'error' in _worker:
+        raise RuntimeError(_worker['error'])
+    return _worker['model']
+
+
+def workerStatus(barrier):
+    """
+    Reports the worker's configuration once every worker has picked up a status call.
+    """
+    barrier.wait()
+    if 'error' in _worker:
+        return {'index': _worker.get('index'), 'error': _worker['error']}
+    return {'index': _worker['index'], 'pid': os.getpid(), 'cores': _worker['cores'],
+            'fused': _worker['model'].fused, 'load_time': round(_worker['loadTime'], 2)}
+
+
+def predictSlot(spec, index, count):
+    """
+    Worker job: runs the fused model on the first `count` inputs of a ring slot
+    and writes the masks and probabilities back into the slot.
+    """
+    fused_model = workerModel()
+    ring = _worker.get('ring')
+    if ring is None or ring.spec != spec:
+        ring = _worker['ring'] = sr.SharedRing.attach(spec)
+
+    masks, probs = fused_model.predictTensor(ring.inputs[index, :count])
+    ring.masks[index, :count] = masks
+    ring.probs[index, :count] = probs
+
+
+def scoreFiles(job):
+    """
+    Worker job: decodes a list of files into one batch and scores it.
+
+    Parameters:
+    -----------
+    job : tuple
+        (files, withImages): image paths, and whether to return images and masks.
+
+    Returns:
+    --------
+    list of tuple
+        (file, img, mask, tb, error, fraction) per file, in order; error is a message string.
+    """
+    files, withImages = job
+    fused_model = workerModel()
+    decoder = _worker['decoder']
+
+    # Decoded images fill the buffer front to back, skipping failed files
+    x = fused_model.preprocessor.allocate(len(files))
+    decoded, good = [], 0
+    for file in files:
+        try:
+            decoded.append((file, decoder.decode(file, x[good])))
+            good += 1
+        except Exception as e:
+            decoded.append((file, e))
+
+    masks, probs = fused_model.predictTensor(x[:good]) if good else ([], [])
+    # Lung area fractions for the whole batch in one pass
+    fractions = sm.SegmentationModel.postprocessor.areaFraction(
+        sm.SegmentationModel.postprocessor.binarize(masks)) if good else []
+
+    results, k = [], 0
+    for file, img in decoded:
+        if isinstance(img, Exception):
+            results.append((file, None, None, None, str(img), None))
+            continue
+        results.append((file, img if withImages else None, masks[k] if withImages else None, float(probs[k]), None,
+                        float(fractions[k])))
+        k += 1
+
+    return results
+
+
+def sweep(cores=None, batchSize=8, batches=None, interThreads=1, image=None):
+    """
+    Measures throughput for every split of the cores into workers x threads.
+
+    Worker counts are the powers of two up to `cores`; each worker gets
+    cores // workers intra-op threads. Every split runs the same preprocessed batch
+    `batches` times through the pool.
+
+    Parameters:
+    -----------
+    cores : int, optional
+        Cores to partition. Defaults to all available cores.
+
+    batchSize : int, optional (default=8)
+        Images per model call.
+
+    batches : int, optional
+        Timed batches per split. Defaults to 2 per worker, at least 4.
+
+    interThreads : int, optional (default=1)
+        TensorFlow inter-op threads per worker.
+
+    image : str, optional
+        Image replicated into the batch. Defaults to the bundled sample X-ray.
+
+    Returns:
+    --------
+    list of dict
+        processes, threads, images_per_sec and batch_latency_ms per split, best first.
+    """
+    from common_libs import np
+
+    available = availableCores()
+    cores = min(cores or len(available), len(available))
+
+    preprocessor = pp.Preprocessor()
+    img = preprocessor.decode(image or os.path.abspath('resource/lungs-original.png'))
+    if img is None:
+        img = (np.random.default_rng(0).random(preprocessor.size[::-1]) * 255).astype(np.uint8)
+    x = preprocessor.toBatch([img] * batchSize)
+
+    results = []
+    processes = 1
+    while processes <= cores:
+        threads = cores // processes
+        count = batches or max(4, 2 * processes)
+
+        with InferencePool(processes, threads, interThreads, batchSize=batchSize) as pool, \
+                ThreadPoolExecutor(max_workers=processes) as executor:
+            pool.warmup()
+            start = time.perf_counter()
+            for _ in executor.map(pool.predictTensor, [x] * count):
+                pass
+            elapsed = time.perf_counter() - start
+
+        results.append({'processes': processes, 'threads': threads,
+                        'images_per_sec': round(count * batchSize / elapsed, 3),
+                        'batch_latency_ms': round(elapsed / count * 1000 * processes, 3)})
+        print(f'{processes:>3} processes x {threads:>3} threads: {results[-1]["images_per_sec"]:.2f} img/s')
+        processes *= 2
+
+    return sorted(results, key=lambda r: r['images_per_sec'], reverse=True)
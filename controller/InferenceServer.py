@@ -0,0 +1,565 @@
+import model.SegmentationModel as sm
+import model.ClassificationModel as cm
+import model.FusedModel as fm
+import model.Preprocessor as pp
+import controller.InferencePool as ip
+from common_libs import asyncio, base64, json, time, cv2
+from common_libs import SEG_PATH, CLF_PATH, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+class MicroBatcher:
+    """
+    Groups concurrent inference requests into micro-batches.
+
+    Requests wait in a bounded queue; a single batching loop takes the first
+    waiting request, then collects more until either `maxBatch` requests are
+    gathered or `maxWaitMs` has passed, and runs them through the model in one
+    call on a dedicated inference thread. Up to `concurrency` batches run at once
+    (one per worker of an InferencePool); the next batch only starts collecting
+    once one of them finishes. A full queue rejects new requests immediately
+    instead of letting latency grow without bound.
+
+    Requests are admitted before their body is read: `admit` counts every request
+    from then until its response (reading, decoding, queued or being inferred) and
+    refuses new ones beyond `maxQueue` plus one full batch per inference slot, so
+    the memory held by uploads is bounded by the queue, not by open connections.
+
+    Attributes:
+    -----------
+    fusedModel : FusedModel or InferencePool
+        Model returning the mask and TB probability in one pass.
+
+    maxBatch : int
+        Largest number of images per model call.
+
+    maxWait : float
+        Longest time in seconds a batch waits to fill up.
+
+    queue : asyncio.Queue
+        Pending (tensor, future) pairs, bounded by the maximum queue depth.
+
+    concurrency : int
+        Largest number of batches being inferred at once.
+
+    maxAdmitted : int
+        Largest number of requests in progress before new ones are refused.
+
+    admitted : int
+        Requests currently in progress, from admission to response.
+    """
+
+    def __init__(self, fusedModel, maxBatch=8, maxWaitMs=10, maxQueue=64, concurrency=1):
+        """
+        Creates the batcher; call `run()` as a task to start batching.
+
+        Parameters:
+        -----------
+        fusedModel : FusedModel or InferencePool
+            Model returning the mask and TB probability in one pass.
+
+        maxBatch : int, optional (default=8)
+            Largest number of images per model call.
+
+        maxWaitMs : float, optional (default=10)
+            Longest time in milliseconds a batch waits to fill up.
+
+        maxQueue : int, optional (default=64)
+            Largest number of waiting requests before new ones are rejected.
+
+        concurrency : int, optional (default=1)
+            Largest number of batches being inferred at once.
+        """
+        self.fusedModel: fm.FusedModel = fusedModel
+        """FusedModel: Model returning the mask and TB probability in one pass."""
+
+        self.maxBatch: int = max(1, maxBatch)
+        """int: Largest number of images per model call."""
+
+        self.maxWait: float = maxWaitMs / 1000.0
+        """float: Longest time in seconds a batch waits to fill up."""
+
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxQueue)
+        """asyncio.Queue: Pending (tensor, future) pairs."""
+
+        self.concurrency: int = max(1, concurrency)
+        """int: Largest number of batches being inferred at once."""
+
+        self.maxAdmitted: int = maxQueue + self.concurrency * self.maxBatch
+        """int: Largest number of requests in progress before new ones are refused."""
+
+        self.admitted: int = 0
+        """int: Requests currently in progress, from admission to response."""
+
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='inference')
+
+        # One preallocated input buffer per batch in flight
+        self._free = asyncio.Queue()
+        for _ in range(self.concurrency):
+            self._free.put_nowait(fusedModel.preprocessor.allocate(self.maxBatch))
+        self._tasks = set()
+
+    def admit(self):
+        """
+        Reserves room for one request before its body is read.
+
+        Returns:
+        --------
+        bool
+            True if the request is admitted; it must then be passed to `release`
+            once answered. False if the server is at its limit.
+        """
+        if self.admitted >= self.maxAdmitted:
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self):
+        """
+        Frees the room of an admitted request once it has been answered.
+        """
+        self.admitted -= 1
+
+    def submit(self, x):
+        """
+        Queues one preprocessed image.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 tensor of shape (512, 512, 1).
+
+        Returns:
+        --------
+        asyncio.Future
+            Resolves to (mask, probability).
+
+        Raises:
+        -------
+        asyncio.QueueFull
+            If the queue is at its depth limit.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((x, future))
+        return future
+
+    async def run(self):
+        """
+        Batching loop: collects requests and runs one model call per batch.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free buffer first, so requests keep queuing into the next batch
+            buffer = await self._free.get()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.maxWait
+
+            while len(batch) < self.maxBatch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            for i, (x, _) in enumerate(batch):
+                buffer[i] = x
+
+            task = asyncio.create_task(self.infer(batch, buffer))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def infer(self, batch, buffer):
+        """
+        Runs one batch on the inference thread(s) and resolves its futures.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            masks, probs = await loop.run_in_executor(
+                self._executor, self.fusedModel.predictTensor, buffer[:len(batch)])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._free.put_nowait(buffer)
+
+        for (_, future), mask, tb in zip(batch, masks, probs):
+            if not future.done():
+                future.set_result((mask, float(tb)))
+
+
+class InferenceServer:
+    """
+    Local HTTP inference service around the segmentation and classification models.
+
+    Endpoints:
+    - `POST /predict[?mask=1&overlay=1]`: body is the raw image file (or a
+      multipart/form-data upload); returns the probability, label and confidence
+      as JSON, with the mask and overlay as base64 PNGs when requested.
+    - `GET /health`: liveness, always 200 while the process serves requests.
+    - `GET /ready`: 200 once the models are loaded, 503 before; includes queue depth.
+
+    Prediction requests beyond the queue depth limit receive 503 with `Retry-After`
+    before their body is read; malformed requests receive 400 and bodies larger than
+    `MAX_BODY` 413.
+
+    Attributes:
+    -----------
+    host : str
+        Interface to bind.
+
+    port : int
+        TCP port to bind.
+
+    options : dict
+        MicroBatcher settings (maxBatch, maxWaitMs, maxQueue).
+
+    poolOptions : dict
+        InferencePool settings (processes, threads, interThreads, cvThreads, pin, batchSize);
+        processes 0 runs inference in the server process.
+
+    batcher : MicroBatcher or None
+        Set once the models are loaded.
+    """
+
+    MAX_BODY = 64 * 1024 * 1024
+    """int: Largest accepted request body in bytes."""
+
+    def __init__(self, host='127.0.0.1', port=8080, maxBatch=8, maxWaitMs=10, maxQueue=64,
+                 processes=0, threads=None, interThreads=1, cvThreads=1, pin=True):
+        """
+        Configures the server; call `serve()` to start it.
+
+        Parameters:
+        -----------
+        host : str, optional (default='127.0.0.1')
+            Interface to bind.
+
+        port : int, optional (default=8080)
+            TCP port to bind.
+
+        maxBatch : int, optional (default=8)
+            Largest number of images per model call.
+
+        maxWaitMs : float, optional (default=10)
+            Longest time in milliseconds a batch waits to fill up.
+
+        maxQueue : int, optional (default=64)
+            Largest number of waiting requests before new ones are rejected.
+
+        processes : int, optional (default=0)
+            Worker processes of an InferencePool; 0 runs inference in the server process.
+
+        threads : int, optional
+            Pool mode: TensorFlow intra-op threads per worker (default: cores / processes).
+
+        interThreads : int, optional (default=1)
+            Pool mode: TensorFlow inter-op threads per worker.
+
+        cvThreads : int, optional (default=1)
+            Pool mode: OpenCV threads per worker.
+
+        pin : bool, optional (default=True)
+            Pool mode: pin each worker to its own cores.
+        """
+        self.host: str = host
+        """str: Interface to bind."""
+
+        self.port: int = port
+        """int: TCP port to bind."""
+
+        self.options: dict = {'maxBatch': maxBatch, 'maxWaitMs': maxWaitMs, 'maxQueue': maxQueue}
+        """dict: MicroBatcher settings."""
+
+        self.poolOptions: dict = {'processes': processes, 'threads': threads, 'interThreads': interThreads,
+                                  'cvThreads': cvThreads, 'pin': pin, 'batchSize': maxBatch}
+        """dict: InferencePool settings; processes 0 runs inference in the server process."""
+
+        self.batcher: MicroBatcher = None
+        """MicroBatcher: Set once the models are loaded."""
+
+        self._startTime = time.time()
+
+    def serve(self):
+        """
+        Runs the server until interrupted.
+        """
+        asyncio.run(self._main())
+
+    async def _main(self):
+        """
+        Starts listening immediately and loads the models in the background.
+        """
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f'Serving on http://{self.host}:{self.port}')
+
+        loop = asyncio.get_running_loop()
+        fused = await loop.run_in_executor(None, self.loadModel)
+        self.batcher = MicroBatcher(fused, **self.options, concurrency=self.poolOptions['processes'] or 1)
+        batching = asyncio.create_task(self.batcher.run())
+        print('Models ready')
+
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batching.cancel()
+
+    def loadModel(self):
+        """
+        Loads and warms up the fused model, or starts the worker pool.
+        """
+        if self.poolOptions['processes'] > 0:
+            pool = ip.InferencePool(**self.poolOptions)
+            pool.warmup()
+            return pool
+
+        fused = fm.FusedModel(SEG_PATH, CLF_PATH)
+        fused.warmup()
+        return fused
+
+    async def handle(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection, honouring keep-alive.
+        """
+        try:
+            while True:
+                try:
+                    request = await self.readHead(reader)
+                except ValueError as e:
+                    self.writeResponse(writer, 400, {'error': str(e)}, keepAlive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, headers, length = request
+
+                # Refused requests are answered without reading their body, so the connection is closed
+                if length > self.MAX_BODY:
+                    self.writeResponse(writer, 413, {'error': f'request body exceeds {self.MAX_BODY} bytes'},
+                                       keepAlive=False)
+                    await writer.drain()
+                    break
+                refusal = self.admit(method, target)
+                if refusal is not None:
+                    self.writeResponse(writer, *refusal, keepAlive=False)
+                    await writer.drain()
+                    break
+
+                admitted = self.isPredict(method, target)
+                try:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.route(method, target, headers, body)
+                finally:
+                    if admitted:
+                        self.batcher.release()
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self.writeResponse(writer, status, payload, keep_alive)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def readHead(self, reader):
+        """
+        Reads the request line and headers of one request, leaving its body unread.
+
+        Returns:
+        --------
+        tuple or None
+            (method, target, headers, content length), or None when the client closed the connection.
+
+        Raises:
+        -------
+        ValueError
+            If the request line or the Content-Length header is malformed.
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise ValueError('malformed request line')
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise ValueError('invalid Content-Length header') from None
+        if length < 0:
+            raise ValueError('invalid Content-Length header')
+
+        return method.upper(), target, headers, length
+
+    @staticmethod
+    def isPredict(method, target):
+        """
+        Returns True for a prediction request, the only kind subject to admission.
+        """
+        return method == 'POST' and urlsplit(target).path == '/predict'
+
+    def admit(self, method, target):
+        """
+        Admission check of a request, done before its body is read.
+
+        Returns:
+        --------
+        tuple or None
+            (status, payload) of the refusal, or None if the request may proceed.
+            An admitted prediction must be released with `MicroBatcher.release`.
+        """
+        if not self.isPredict(method, target):
+            return None
+        if self.batcher is None:
+            return 503, {'error': 'models are still loading'}
+        if not self.batcher.admit():
+            return 503, {'error': 'server busy, queue is full'}
+        return None
+
+    @staticmethod
+    def writeResponse(writer, status, payload, keepAlive=True):
+        """
+        Writes a JSON response.
+
+        Parameters:
+        -----------
+        writer : asyncio.StreamWriter
+            Connection writer.
+
+        status : int
+            HTTP status code.
+
+        payload : dict
+            JSON-serializable response body.
+
+        keepAlive : bool, optional (default=True)
+            Keep the connection open after the response.
+        """
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                   413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+        body = json.dumps(payload).encode()
+        head = [f'HTTP/1.1 {status} {reasons.get(status, "")}',
+                'Content-Type: application/json',
+                f'Content-Length: {len(body)}',
+                f'Connection: {"keep-alive" if keepAlive else "close"}']
+        if status == 503:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+
+    async def route(self, method, target, headers, body):
+        """
+        Dispatches a request to its endpoint.
+
+        Returns:
+        --------
+        tuple
+            (status, payload)
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'uptime': round(time.time() - self._startTime, 1)}
+
+        if url.path == '/ready':
+            if self.batcher is None:
+                return 503, {'ready': False}
+            return 200, {'ready': True, 'queue_depth': self.batcher.queue.qsize(),
+                         'max_queue': self.batcher.queue.maxsize, 'in_progress': self.batcher.admitted,
+                         'fused': self.batcher.fusedModel.fused}
+
+        if url.path == '/predict':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            if self.batcher is None:
+                return 503, {'error': 'models are still loading'}
+            flag = lambda name: query.get(name, ['0'])[0].lower() in ('1', 'true', 'yes')
+            return await self.predict(self.extractImage(headers, body), flag('mask'), flag('overlay'))
+
+        return 404, {'error': f'unknown path {url.path}'}
+
+    @staticmethod
+    def extractImage(headers, body):
+        """
+        Returns the image bytes of a raw or multipart/form-data upload.
+        """
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return body
+
+        boundary = content_type.split('boundary=', 1)[-1].strip('"').encode()
+        for part in body.split(b'--' + boundary):
+            head, sep, data = part.partition(b'\r\n\r\n')
+            if sep and b'filename=' in head:
+                return data.rsplit(b'\r\n', 1)[0]
+        return b''
+
+    async def predict(self, data, withMask, withOverlay):
+        """
+        Decodes an upload, queues it for batched inference and builds the JSON result.
+
+        Returns:
+        --------
+        tuple
+            (status, payload)
+        """
+        loop = asyncio.get_running_loop()
+
+        img = await loop.run_in_executor(None, self.decode, data)
+        if img is None:
+            return 400, {'error': 'body is not a readable image'}
+
+        x = await loop.run_in_executor(None, self.batcher.fusedModel.preprocessor.toTensor, img)
+        try:
+            future = self.batcher.submit(x)
+        except asyncio.QueueFull:
+            return 503, {'error': 'server busy, queue is full'}
+
+        try:
+            mask, tb = await future
+        except Exception as e:
+            return 500, {'error': str(e)}
+
+        label, confidence = cm.ClassificationModel.interpret(tb)
+        payload = {'probability': round(tb, 6), 'label': label, 'confidence': round(confidence, 2)}
+        if withMask or withOverlay:
+            payload.update(await loop.run_in_executor(None, self.encode, img, mask, withMask, withOverlay))
+
+        return 200, payload
+
+    @staticmethod
+    def decode(data):
+        """
+        Decodes image bytes into a 512x512 BGR image, or None if unreadable.
+        Large and 16-bit images take the reduced and windowed decode paths.
+        """
+        return pp.Preprocessor().decode(bytes(data), bgr=True) if data else None
+
+    @staticmethod
+    def encode(img, mask, withMask, withOverlay):
+        """
+        Encodes the mask and/or overlay as base64 PNG strings.
+        """
+        postprocessor = sm.SegmentationModel.postprocessor
+        out = {}
+        if withMask:
+            out['mask_png'] = base64.b64encode(cv2.imencode('.png', postprocessor.toMask(mask))[1]).decode()
+        if withOverlay:
+            overlay = postprocessor.overlay(img, postprocessor.binarize(mask))
+            out['overlay_png'] = base64.b64encode(cv2.imencode('.png', overlay)[1]).decode()
+        return out
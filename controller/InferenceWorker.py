@@ -0,0 +1,202 @@
+from common_libs import queue, threading
+
+class InferenceWorker(threading.Thread):
+    """
+    Background thread that runs decode, inference and overlay work off the Tk event loop.
+
+    An optional `setup` callable (e.g. model loading and warm-up) runs first on the
+    worker thread; `ready` is set once it has finished. Jobs are queued with `submit`
+    and processed one at a time by calling `task` (or the job's own task) with the job's file path. Finished jobs are placed on `results` as
+    (job_id, file, result, error) tuples, which the GUI drains with `after()`
+    polling, since Tk widgets and PhotoImages must only be touched from the main thread.
+    A running task may `publish` intermediate results (e.g. a preview) the same way.
+The result of a job cancelled while running is handed to `discard` instead.
+
+    Attributes:
+    -----------
+    task : function
+        Callable run on the worker thread for each queued file path.
+
+    jobs : queue.Queue
+        Pending (job_id, file, task) tuples; task is None for the default task.
+
+    results : queue.Queue
+        Finished (job_id, file, result, error) tuples.
+
+    cancelled : set
+        Job ids whose results must be discarded.
+
+    ready : threading.Event
+        Set once `setup` has finished, successfully or not.
+
+    setupError : Exception or None
+        Exception raised by `setup`, if any.
+
+    discard : function or None
+        Callable receiving the file and result of each job cancelled while running.
+    """
+
+    def __init__(self, task, setup=None, discard=None):
+        """
+        Creates the worker; call `start()` to begin processing.
+
+        Parameters:
+        -----------
+        task : function
+            Callable taking a file path and returning the computed result.
+
+        setup : function, optional
+            Callable run once on the worker thread before any job.
+
+        discard : function, optional
+            Callable run on the worker thread with the file and result of each job
+            cancelled while running, e.g. to log it.
+        """
+        super().__init__(name='InferenceWorker', daemon=True)
+
+        self.task = task
+        """function: Callable run on the worker thread for each queued file path."""
+
+        self.jobs: queue.Queue = queue.Queue()
+        """queue.Queue: Pending (job_id, file, task) tuples; task is None for the default task."""
+
+        self.results: queue.Queue = queue.Queue()
+        """queue.Queue: Finished (job_id, file, result, error) tuples."""
+
+        self.cancelled: set = set()
+        """set: Job ids whose results must be discarded."""
+
+        self.setup = setup
+        """function: Callable run once on the worker thread before any job."""
+
+        self.ready: threading.Event = threading.Event()
+        """threading.Event: Set once `setup` has finished, successfully or not."""
+
+        self.setupError: Exception = None
+        """Exception: Exception raised by `setup`, if any."""
+
+        self.discard = discard
+        """function: Callable receiving the file and result of each job cancelled while running."""
+
+        self._nextId = 0
+        self._unfinished = 0
+        self._active = None
+        self._activeFile = None
+        self._lock = threading.Lock()
+
+    def submit(self, file, task=None):
+        """
+        Queues a file for processing.
+
+        Parameters:
+        -----------
+        file : str
+            Path of the image to process.
+
+        task : function, optional
+            Callable run for this job instead of the worker's `task`, with the same file path.
+
+        Returns:
+        --------
+        int
+            Id of the queued job.
+        """
+        with self._lock:
+            self._nextId += 1
+            self._unfinished += 1
+            job_id = self._nextId
+        self.jobs.put((job_id, file, task))
+        return job_id
+
+    def publish(self, result):
+        """
+        Places an intermediate result of the running job on `results`.
+
+        Called from the task on the worker thread; the job's final result follows
+        later with the same job id. Ignored when the job has been cancelled.
+
+        Parameters:
+        -----------
+        result : any
+            Intermediate result of the running job.
+        """
+        with self._lock:
+            if self._active is None or self._active in self.cancelled:
+                return
+            self.results.put((self._active, self._activeFile, result, None))
+
+    def pending(self):
+        """
+        Returns the number of jobs queued or running, excluding cancelled ones.
+
+        Returns:
+        --------
+        int
+            Count of unfinished jobs.
+        """
+        with self._lock:
+            return self._unfinished - len(self.cancelled)
+
+    def cancelAll(self):
+        """
+        Drops every queued job and discards the result of the running one.
+        The running computation itself cannot be interrupted; its result goes to `discard`.
+        """
+        with self._lock:
+            while True:
+                try:
+                    job_id, _, _ = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job_id is None:
+                    # Keep a pending stop request in the queue
+                    self.jobs.put((None, None, None))
+                    break
+                self._unfinished -= 1
+            if self._active is not None:
+                self.cancelled.add(self._active)
+
+    def stop(self):
+        """
+        Asks the worker to exit after the running job.
+        """
+        self.cancelAll()
+        self.jobs.put((None, None, None))
+
+    def run(self):
+        """
+        Runs `setup`, then processes queued jobs until `stop` is called.
+        """
+        try:
+            if self.setup is not None:
+                self.setup()
+        except Exception as e:
+            self.setupError = e
+        finally:
+            self.ready.set()
+
+        while True:
+            job_id, file, task = self.jobs.get()
+            if job_id is None:
+                break
+
+            with self._lock:
+                self._active, self._activeFile = job_id, file
+
+            result, error = None, None
+            try:
+                result = (task or self.task)(file)
+            except Exception as e:
+                error = e
+
+            with self._lock:
+                self._active, self._activeFile = None, None
+                self._unfinished -= 1
+                cancelled = job_id in self.cancelled
+                if cancelled:
+                    self.cancelled.discard(job_id)
+                else:
+                    self.results.put((job_id, file, result, error))
+
+            if cancelled and error is None and self.discard is not None:
+                self.discard(file, result)
@@ -1,22 +1,53 @@
 import view.MainView as mv
 import view.HomeView as hv
-import model.SegmentationModel as sm
-import model.ClassificationModel as cm
-from common_libs import filedialog, messagebox, ImageTk, Image, cv2
-from common_libs import SEG_PATH, CLF_PATH
+import view.GalleryView as gv
+import controller.InferenceWorker as iw
+import instrumentation as ins
+from common_libs import os, filedialog, messagebox, time
+from common_libs import SEG_PATH, CLF_PATH, CACHE_DIR, CACHE_MEMORY_MB, CACHE_DISK_MB, TTA_ENABLED
+from common_libs import INDEX_DIR, SIMILAR_CASES, EXPLAIN_MODE, PREVIEW_ENABLED
 
 class MainController:
     """
     Main controller that coordinates between the view and model layers.
     It manages user input (file upload), model predictions (segmentation & classification),
     and updating the UI accordingly.
+
+    Inference runs on a background InferenceWorker so the window stays responsive;
+    finished results are picked up on the Tk event loop by `pollResults`.
+
+    Startup is split in two: the window is built right away using only Tkinter,
+    while TensorFlow, the models and their first trace are loaded by the worker.
+    The Upload button is enabled once the worker reports it is ready.
+
+    In progressive mode a low-resolution preview of each upload is shown as soon
+    as it is ready and replaced by the full-resolution result.
+
+    The results of a batch session can be reviewed in a GalleryView; a study
+    opened from it is shown from its saved mask and overlay when available.
     """
 
-    def __init__(self):
+    POLL_MS = 50
+    """int: Interval in milliseconds between checks for finished inference jobs."""
+
+    EXPLAIN_CAPTIONS = {'attention': 'Attention gates', 'gradcam': 'Grad-CAM'}
+    """dict: Caption shown below each explanation heatmap."""
+
+    def __init__(self, startTime=None):
         """
-        Initializes the application components: main view, segmentation model,
-        classification model, and home view.
+        Initializes the application components: main view, inference worker
+        and home view. The fused segmentation/classification model is loaded
+        in the background by the worker.
+
+        Parameters:
+        -----------
+        startTime : float, optional
+            `time.perf_counter()` value at process start, used to report
+            time-to-window and time-to-ready. Defaults to now.
         """
+        self.startTime: float = time.perf_counter() if startTime is None else startTime
+        """float: Reference time for the startup timings."""
+
         # Instantiate the main GUI window.
         self.mainView: mv.MainView = mv.MainView()
         """MainView: The primary window of the application managing the root layout."""
@@ -25,18 +56,47 @@ class MainController:
         self.img: any = None
         """np.ndarray: Image loaded from the user's file input."""
 
-        # Load the trained lung segmentation model.
-        self.segModel: sm.SegmentationModel = sm.SegmentationModel(SEG_PATH)
-        """SegmentationModel: Deep learning model for segmenting lung regions from the X-ray."""
+        # Set on the Tk thread once the worker has finished loading the models.
+        self.ready: bool = False
+        """bool: True once model loading has finished and been reported."""
+
+        # Loaded on the worker thread by loadModels.
+        self.fusedModel = None
+        """FusedModel: Segments lung regions and classifies tuberculosis in a single forward pass."""
+
+        self.cache = None
+        """ResultCache: Serves repeated images without running the models again."""
+
+        self.tta = None
+        """TestTimeAugmenter: Re-checks borderline predictions with augmented views, None when disabled."""
+
+        self.index = None
+        """ResultsIndex: Scored cases searched for similar prior films, None when disabled."""
+
+        self.explainer = None
+        """Explainer: Returns attention-gate (and Grad-CAM) maps with the predictions, None when disabled."""
 
-        # Load the trained tuberculosis classification model.
-        self.clfModel: cm.ClassificationModel = cm.ClassificationModel(CLF_PATH)
-        """ClassificationModel: Deep learning model to classify presence of tuberculosis."""
+        self.preview = None
+        """PreviewModel: Low-resolution model shown before the full result, None when disabled."""
 
-        # Create the HomeView interface and bind the upload button to a callback.
-        self.homeView: hv.HomeView = hv.HomeView(self.mainView, self.browseFile)
+        self.gallery = None
+        """GalleryView: Window listing the results of a batch session, None until one is opened."""
+
+        # Load models, then run inference, off the Tk event loop.
+        self.worker: iw.InferenceWorker = iw.InferenceWorker(self.loadInsight, setup=self.loadModels,
+                                                               discard=self.discardInsight)
+        """InferenceWorker: Background thread running model loading, decode, inference and overlay work."""
+        self.worker.start()
+
+        # Create the HomeView interface and bind the upload and cancel buttons.
+        self.homeView: hv.HomeView = hv.HomeView(self.mainView, self.browseFile, self.cancelJobs,
+                                                 explainSlots={'attention': 1, 'gradcam': 2}.get(EXPLAIN_MODE, 0),
+                                                 galleryCallback=self.openGallery)
         """HomeView: Interface layer presenting the home screen layout and binding file upload event."""
 
+        self.homeView.setUploadEnabled(False)
+        self.homeView.loading.config(text='Loading models...')
+
         # Update the main layout before rendering.
         self.mainView.update_idletasks()
 
@@ -45,96 +105,429 @@ class MainController:
         Launches the application's main loop.
         This keeps the window open and responsive to user actions.
         """
+        self.mainView.after(0, self.reportWindow)
+        self.mainView.after(self.POLL_MS, self.pollResults)
         self.mainView.mainloop()
+        self.worker.stop()
+
+    def reportWindow(self):
+        """
+        Reports the time from process start until the event loop is serving the window.
+        """
+        print(f'Time to window: {time.perf_counter() - self.startTime:.2f}s')
+
+    def loadModels(self):
+        """
+        Imports the model layer, loads the fused model, warms it up and opens the result cache
+        and the results index (and prepares test-time augmentation, explanations and the
+        preview model when enabled).
+
+        Runs on the worker thread before any inference job.
+        """
+        import model.FusedModel as fm
+        import model.ResultCache as rc
+        import model.TestTimeAugmenter as tta
+        import model.ResultsIndex as ri
+        import model.Explainer as ex
+        import model.PreviewModel as pm
+
+        self.fusedModel = fm.FusedModel(SEG_PATH, CLF_PATH)
+        self.fusedModel.warmup()
+        self.cache = rc.ResultCache((SEG_PATH, CLF_PATH), CACHE_MEMORY_MB, CACHE_DIR, CACHE_DISK_MB)
+
+        if TTA_ENABLED:
+            self.tta = tta.TestTimeAugmenter()
+
+        # Similar-case search needs the classifier embeddings of the fused graph
+        if INDEX_DIR and self.fusedModel.embeddingSize:
+            self.index = ri.ResultsIndex(INDEX_DIR, self.cache.fingerprint(), self.fusedModel.embeddingSize)
+
+        # Explanation maps come from the same call as the mask, so they need the fused graph
+        if EXPLAIN_MODE and self.fusedModel.model is not None:
+            self.explainer = ex.Explainer(self.fusedModel, gradCam=EXPLAIN_MODE == 'gradcam')
+            self.explainer.warmup()
+
+        if PREVIEW_ENABLED and self.fusedModel.model is not None:
+            self.preview = pm.PreviewModel(self.fusedModel)
+            self.preview.warmup()
+
+    def onReady(self):
+        """
+        Enables uploads once the models are ready, or reports the loading failure.
+        """
+        if self.worker.setupError is not None:
+            self.homeView.stopLoading('Model loading failed')
+            messagebox.showerror('Error', f'Unable to load the models...\n{self.worker.setupError}')
+            return
+
+        elapsed = time.perf_counter() - self.startTime
+        print(f'Time to ready: {elapsed:.2f}s')
+
+        self.homeView.setUploadEnabled(True)
+        self.homeView.stopLoading(f'Ready ({elapsed:.1f}s)')
 
     def browseFile(self):
         """
-        Handles the file selection dialog, triggers predictions,
-        and updates the view with results.
+        Handles the file selection dialog and queues the selected images for inference.
 
         This method is triggered by the file upload button and facilitates:
-        - Selecting an image file.
-        - Displaying a loading animation.
-        - Performing image segmentation and classification.
-        - Displaying the processed results.
+        - Selecting one or more image files.
+        - Queuing them on the background worker.
+        - Displaying a loading indicator with the queue length.
+
+        Results are displayed by `pollResults` as they finish, so further files
+        can be uploaded while earlier ones are still computing.
         """
-        try:
-            # Open a file dialog for image selection
-            img_file = filedialog.askopenfilename(
-                initialdir='',
-                title='Select a file',
-                filetypes=(('All Files', '*.*'),
-                           ('PNG', '*.png'),
-                           ('JPG', '*.jp*'),
-                           ('BMP', '*.bmp'),
-                           ('TIFF', '*.tif*'))
-            )
-
-            # Check if a valid file was selected
+        # Open a file dialog for image selection
+        img_files = filedialog.askopenfilenames(
+            initialdir='',
+            title='Select a file',
+            filetypes=(('All Files', '*.*'),
+                       ('PNG', '*.png'),
+                       ('JPG', '*.jp*'),
+                       ('BMP', '*.bmp'),
+                       ('TIFF', '*.tif*'))
+        )
+
+        # Queue each valid selection
+        for img_file in img_files:
             if len(img_file) > 3:
-                filename = img_file.split('/')[-1]
+                self.worker.submit(img_file)
 
-                # Trim long filenames for display
-                if len(filename) > 20:
-                    filename = filename[:10] + '...'
+        if self.worker.pending():
+            self.homeView.showLoading(self.worker.pending())
 
-                # Update label and show loading indicator
-                self.homeView.browseLbl.config(text='Uploaded File : ' + filename)
-                self.homeView.showLoading()
-                self.homeView.update_idletasks()
+    def openGallery(self):
+        """
+        Opens a batch results file in a gallery window, replacing any gallery already open.
 
-                # Run prediction pipeline
-                self.loadInsight(img_file)
+        Thumbnails are read from the masks and overlays the batch saved, falling back
+        to the original film when no overlay was written.
+        """
+        import controller.BatchController as bc
+        import model.ThumbnailCache as tc
 
-                # Hide loading indicator
-                self.homeView.stopLoading()
+        results_file = filedialog.askopenfilename(
+            initialdir='',
+            title='Select batch results',
+            filetypes=(('Batch results', '*.jsonl *.json *.csv'),
+                       ('All Files', '*.*'))
+        )
+        if not results_file:
+            return
 
-        except Exception as e:
-            # Show error dialog on failure
-            messagebox.showerror('Error', f'Please check your file type...\n{e}')
+        try:
+            records = bc.BatchController.readResults(results_file)
+        except (OSError, ValueError) as error:
+            messagebox.showerror('Error', f'Unable to read the batch results...\n{error}')
+            return
+
+        if self.gallery is not None and self.gallery.winfo_exists():
+            self.gallery.close()
+
+        thumbnails = tc.ThumbnailCache()
+        self.gallery = gv.GalleryView(self.mainView, records, thumbnails.get, self.openRecord,
+                                      title=f'Batch results - {os.path.basename(results_file)}')
+
+    def openRecord(self, record):
+        """
+        Queues a study picked in the gallery for display in the result panel.
+
+        The study is loaded on the worker thread by `loadRecord`. A study whose
+        source film no longer exists is reported instead of queued.
+
+        Parameters:
+        -----------
+        record : dict
+            Batch result record of the study.
+        """
+        name = os.path.basename(record['file'])
+        if record.get('error'):
+            messagebox.showerror('Error', f"{name} failed in the batch:\n{record['error']}")
+            return
+
+        if not os.path.isfile(record['file']):
+            messagebox.showerror('Error', f"{name} is no longer available:\n{record['file']}")
+            return
+
+        self.worker.submit(record['file'], lambda img_file: self.loadRecord(record))
+        self.homeView.showLoading(self.worker.pending())
+        self.mainView.lift()
+
+    def loadRecord(self, record):
+        """
+        Loads a gallery study for display.
+
+        Runs on the worker thread. A study whose mask and overlay were saved by the
+        batch is shown from those files with its recorded probability; any other
+        study, or one whose saved files are gone, is scored again by `loadInsight`.
+
+        Parameters:
+        -----------
+        record : dict
+            Batch result record of the study.
+
+        Returns:
+        --------
+        dict
+            Result in the format of `loadInsight`.
+        """
+        from common_libs import cv2
+
+        img = mask = overlay = None
+        if record.get('mask') and record.get('overlay'):
+            img = self.fusedModel.preprocessor.decode(record['file'], bgr=True)
+            mask = cv2.imread(record['mask'], cv2.IMREAD_GRAYSCALE)
+            overlay = cv2.imread(record['overlay'], cv2.IMREAD_COLOR)
+
+        if img is None or mask is None or overlay is None:
+            return self.loadInsight(record['file'])
+
+        # Same arrays as a `loadInsight` result: the overlay is passed as blended, like `getColoredMask`'s
+        return {'img': img, 'mask': cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB), 'overlay': overlay,
+                'tb': record['probability']}
+
+    def cancelJobs(self):
+        """
+        Cancels all queued uploads and discards the result of the running one.
+        """
+        self.worker.cancelAll()
+        self.homeView.stopLoading('Cancelled')
+
+    def pollResults(self):
+        """
+        Displays finished inference results on the Tk event loop and reschedules itself.
+        """
+        if not self.ready and self.worker.ready.is_set():
+            self.ready = True
+            self.onReady()
+
+        pending = self.worker.pending()
+
+        while not self.worker.results.empty():
+            _, img_file, result, error = self.worker.results.get_nowait()
+
+            if error is not None:
+                # Show error dialog on failure
+                messagebox.showerror('Error', f'Please check your file type...\n{error}')
+                continue
+
+            filename = img_file.split('/')[-1]
+
+            # Trim long filenames for display
+            if len(filename) > 20:
+                filename = filename[:10] + '...'
+
+            self.homeView.browseLbl.config(text='Uploaded File : ' + filename)
+            self.showInsight(result)
+
+        if pending:
+            self.homeView.showLoading(pending)
+        elif self.ready and self.homeView.isLoading():
+            # Before `onReady` the status shows the model loading, which is not a job to finish
+            self.homeView.stopLoading()
+
+        self.mainView.after(self.POLL_MS, self.pollResults)
 
     def loadInsight(self, img_file):
         """
-        Loads and preprocesses the uploaded image, performs lung segmentation
-        and tuberculosis classification, and updates the view with the results.
+        Loads and preprocesses the uploaded image and performs lung segmentation,
+        tuberculosis classification and overlay rendering.
+
+        Runs on the worker thread, so it must not touch any Tk widget.
 
         Parameters:
         -----------
         img_file : str
             Path to the uploaded image file.
 
+        Returns:
+        --------
+        dict
+            Original image, mask, overlay, TB probability, test-time augmentation
+            uncertainty (None unless augmented), explanation heatmaps (None unless
+            enabled), the most similar prior cases and the request's instrumentation
+            trace (None while instrumentation is disabled). In progressive mode it also
+            holds the preview's Dice/Jaccard agreement with the full-resolution mask.
+
+        Workflow:
+        ---------
+        - Decode the image directly at 512x512 pixels, using a reduced-resolution
+          decode for large files and windowing 16-bit images.
+        - In progressive mode (and on a cache miss), publish a low-resolution
+          preview result first.
+        - Reuse a cached result for identical pixels, or generate the segmentation
+          mask, TB probability and classifier embedding in one fused pass and
+          cache them. With explanations enabled, the same pass also returns the
+          attention-gate (and Grad-CAM) maps, so the cache is not consulted.
+        - If test-time augmentation is enabled and the probability is borderline,
+          score all augmented views in one batch and average them.
+        - Render the colored mask overlay and the explanation heatmaps.
+        - Store the case in the results index and look up the nearest prior cases.
+        """
+        import model.SegmentationModel as sm
+        from common_libs import cv2
+
+        # Time each stage of this request when instrumentation is enabled
+        trace = ins.begin(img_file)
+        try:
+            # Decode straight to a 512x512 image (reduced decode, 16-bit windowing)
+            with ins.stage('decode'):
+                img = self.fusedModel.preprocessor.decode(img_file, bgr=True)
+            if img is None:
+                raise ValueError(f'Unable to read {img_file}')
+
+            # A cached result is only usable once its embedding is in the index too
+            row, key = None, None
+            if self.index is not None:
+                with ins.stage('index.lookup'):
+                    key = self.cache.key(img)
+                    row = self.index.lookup(key)
+
+            # Predict segmentation mask and tuberculosis status, unless already cached
+            usable = self.explainer is None and (self.index is None or row is not None)
+            with ins.stage('cache.lookup'):
+                cached = self.cache.get(img) if usable else None
+            # Quick low-resolution first look, replaced by the full result below
+            preview = None
+            if cached is None and self.preview is not None:
+                with ins.stage('preview'):
+                    preview_mask, preview_tb = self.preview.predict(img)
+                    preview = {'img': img, 'mask': preview_mask, 'tb': preview_tb, 'preview': True, 'similar': None,
+                               'overlay': sm.SegmentationModel.getColoredMask(img, preview_mask)}
+                self.worker.publish(preview)
+
+            maps = None
+            if cached is None and self.explainer is not None:
+                # Explanation maps from the same forward pass as the predictions
+                pred_mask, tb, embedding, maps = self.explainer.predict(img)
+                with ins.stage('cache.store'):
+                    self.cache.put(img, pred_mask, tb)
+            elif cached is None:
+                pred_mask, tb, embedding = self.fusedModel.predict(img, embeddings=True)
+                with ins.stage('cache.store'):
+                    self.cache.put(img, pred_mask, tb)
+            else:
+                pred_mask, tb = cv2.cvtColor(cached[0], cv2.COLOR_GRAY2RGB), cached[1]
+
+            # Borderline cases get a second opinion from augmented views, in one batch
+            uncertainty = None
+            if self.tta is not None and self.tta.inBand(tb):
+                with ins.stage('tta'):
+                    mask, tb, uncertainty = self.tta.predict(
+                        self.fusedModel, self.fusedModel.preprocessor.toBatch([img]))
+                    pred_mask = sm.SegmentationModel.postprocess(mask)
+
+            # Generate mask overlay
+            with ins.stage('overlay'):
+                colored_mask = sm.SegmentationModel.getColoredMask(img, pred_mask)
+
+            explanation = None
+            if maps is not None:
+                with ins.stage('explain.render'):
+                    explanation = {name: sm.SegmentationModel.postprocessor.heatmap(img, maps[name])
+                                   for name in self.explainer.maps}
+
+            agreement = None
+            if preview is not None:
+                with ins.stage('preview.agreement'):
+                    agreement = self.preview.agreement(pred_mask, preview['mask'])
+
+            # Keep the case and find the prior films closest to it
+            similar = None
+            if self.index is not None:
+                with ins.stage('index.search'):
+                    if row is None:
+                        postprocessor = sm.SegmentationModel.postprocessor
+                        fraction = postprocessor.areaFraction(postprocessor.binarize(pred_mask[:, :, 0]))
+                        row = self.index.add(key, img_file, embedding, tb, fraction)
+                    similar = self.index.search(self.index.embedding(row), SIMILAR_CASES, exclude=row)
+        except Exception as e:
+            # A failed job reaches `pollResults` without its trace, so log it here
+            ins.finish(trace, 'error', e)
+            raise
+        finally:
+            ins.detach()
+
+        return {'img': img, 'mask': pred_mask, 'overlay': colored_mask, 'tb': tb, 'uncertainty': uncertainty,
+                'explanation': explanation, 'similar': similar, 'agreement': agreement, 'trace': trace}
+
+    @staticmethod
+    def discardInsight(img_file, result):
+        """
+        Logs the trace of a result discarded because its upload was cancelled.
+
+        Runs on the worker thread. Results of the gallery's `loadRecord` carry no trace.
+        """
+        if isinstance(result, dict):
+            ins.finish(result.get('trace'), 'cancelled')
+
+    def showInsight(self, result):
+        """
+        Updates the view with a finished result from `loadInsight`.
+
+        Parameters:
+        -----------
+        result : dict
+            Original image, mask, overlay, TB probability, augmentation uncertainty,
+            explanation heatmaps, similar prior cases, preview agreement and
+            instrumentation trace; or a preview with only the first four and 'preview' set.
+
         Workflow:
         ---------
-        - Read and resize the image to 512x512 pixels.
-        - Generate the segmentation mask using the segmentation model.
-        - Predict TB probability using the classification model.
-        - Convert images to Tkinter-compatible formats.
-        - Display the original image, segmentation mask, and overlay.
-        - Show TB prediction result and confidence.
-        """
-        # Read and resize the image
-        self.img = cv2.resize(cv2.imread(img_file, 1), (512, 512))
-
-        # Predict segmentation mask
-        pred_mask = self.segModel.predict(self.img)
-
-        # Predict tuberculosis status
-        tb = self.clfModel.predict(self.img)
-
-        # Generate mask overlay
-        colored_mask = self.segModel.getColoredMask(self.img, pred_mask)
-
-        # Convert OpenCV images to Tkinter-compatible format
-        pil_img = ImageTk.PhotoImage(Image.fromarray(self.img))
-        pil_mask = ImageTk.PhotoImage(Image.fromarray(pred_mask))
-        pil_colored_mask = ImageTk.PhotoImage(Image.fromarray(colored_mask))
-
-        # Display original image, mask, and colored overlay
-        self.homeView.addImage(pil_img, 0, 0)
-        self.homeView.addImage(pil_mask, 0, 1)
-        self.homeView.addImage(pil_colored_mask, 0, 2)
-
-        # Display prediction label and confidence
-        self.homeView.addLabel(f'Tuberculosis: {"Positive" if tb > 0.5 else "Negative"}', 1, 0)
-        confidence = tb * 100 if tb > 0.5 else (1 - tb) * 100
-        self.homeView.addLabel(f'Confidence: {confidence:.2f}%', 1, 1)
+        - Display the original image, segmentation mask, and overlay in the
+          result panel's slots, reusing their Tk images.
+        - Show TB prediction result and confidence, and the view agreement
+          when test-time augmentation was used. A preview is marked as such, and
+          the full result reports how well the preview mask agreed with it.
+        - Show the explanation heatmaps in the extra slots, cleared for a preview.
+        - List the most similar prior cases.
+        - Record the request's timings and show them in the status panel.
+        """
+        import model.ClassificationModel as cm
+
+        self.img = result['img']
+        trace = result.get('trace')
+
+        with ins.stage('render', trace):
+            # Update the original image, mask, and colored overlay slots in place
+            self.homeView.setImage(0, result['img'])
+            self.homeView.setImage(1, result['mask'])
+            self.homeView.setImage(2, result['overlay'])
+
+            # Display prediction label and confidence
+            label, confidence = cm.ClassificationModel.interpret(result['tb'])
+            preview = result.get('preview', False)
+            self.homeView.setText(0, f'Tuberculosis: {label}' + (' (preview)' if preview else ''))
+            self.homeView.setText(1, f'Confidence: {confidence:.2f}%')
+
+            notes = []
+            uncertainty = result.get('uncertainty')
+            if uncertainty is not None:
+                notes.append(f"TTA: {uncertainty['agreement'] * 100:.0f}% of {uncertainty['views']} views agree "
+                             f"(±{uncertainty['uncertainty'] * 100:.1f}%)")
+            agreement = result.get('agreement')
+            if agreement is not None:
+                notes.append(f"Preview Dice {agreement['dice']:.3f}, Jaccard {agreement['jaccard']:.3f}")
+            if preview:
+                notes.append('Full resolution pending...')
+            self.homeView.setText(2, '\n'.join(notes))
+
+            # A preview has no explanations yet; never leave the previous film's maps up
+            explanation = result.get('explanation') or {}
+            for slot, name in enumerate(self.EXPLAIN_CAPTIONS, start=self.homeView.SLOTS):
+                if slot >= self.homeView.slots:
+                    break
+                if name in explanation:
+                    self.homeView.setImage(slot, explanation[name])
+                    self.homeView.setText(slot, self.EXPLAIN_CAPTIONS[name])
+                else:
+                    self.homeView.clearSlot(slot)
+
+            if self.index is not None and 'similar' in result:
+                self.homeView.showSimilar(result['similar'])
+
+        # Log the request and show its stage timings
+        record = ins.finish(trace)
+        if record is not None:
+            self.homeView.showTimings(record)
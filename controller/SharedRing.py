@@ -0,0 +1,232 @@
+import weakref
+from multiprocessing import shared_memory
+from common_libs import np
+
+class SharedRing:
+    """
+    Ring of batch slots in one shared memory block, for handing decoded inputs and
+    predicted masks between processes without pickling.
+
+    Each slot holds a whole batch: float32 model inputs, the uint8 grayscale images
+    they came from, float32 output masks and probabilities. Every array is a NumPy
+    view into the block, so decode workers write straight into a slot and the
+    inference process reads the same memory.
+
+    Slot lifecycle, recorded in `states` and enforced by `advance`:
+    FREE -> FILLING (decodes submitted) -> READY (decoded) -> INFERRED (masks
+    written) -> FREE (`release`, once the outputs are done with the slot). A slot
+    whose whole batch failed to decode goes from READY straight back to FREE.
+
+    The creating process owns the block and unlinks it in `close`, when garbage
+    collected or at interpreter exit; if it is killed outright, the multiprocessing
+    resource tracker unlinks it. Attached processes only unmap it, so a crashed
+    worker never takes the block with it.
+
+    Attributes:
+    -----------
+    slots : int
+        Number of batch slots.
+
+    batchSize : int
+        Images per slot.
+
+    size : tuple
+        (width, height) of every image.
+
+    shared : bool
+        False backs the ring with private memory, for thread-only pipelines.
+
+    inputs : np.ndarray
+        Float32 model inputs, shape (slots, batchSize, height, width, 1).
+
+    images : np.ndarray
+        Uint8 grayscale images, shape (slots, batchSize, height, width).
+
+    masks : np.ndarray
+        Float32 predicted masks, shape (slots, batchSize, height, width, 1).
+
+    probs : np.ndarray
+        Float32 TB probabilities, shape (slots, batchSize).
+
+    states : np.ndarray
+        Int32 lifecycle state of each slot.
+    """
+
+    FREE, FILLING, READY, INFERRED = 0, 1, 2, 3
+    """int: Slot lifecycle states."""
+
+    ALIGN = 64
+    """int: Byte alignment of every array in the block."""
+
+    def __init__(self, slots, batchSize, size=(512, 512), shared=True, name=None):
+        """
+        Creates a ring, or attaches to an existing one when `name` is given.
+
+        Parameters:
+        -----------
+        slots : int
+            Number of batch slots.
+
+        batchSize : int
+            Images per slot.
+
+        size : tuple, optional (default=(512, 512))
+            (width, height) of every image.
+
+        shared : bool, optional (default=True)
+            Back the ring with shared memory; False uses private memory.
+
+        name : str, optional
+            Shared memory block to attach to instead of creating one.
+        """
+        self.slots: int = slots
+        """int: Number of batch slots."""
+
+        self.batchSize: int = batchSize
+        """int: Images per slot."""
+
+        self.size: tuple = tuple(size)
+        """tuple: (width, height) of every image."""
+
+        self.shared: bool = shared or name is not None
+        """bool: False backs the ring with private memory, for thread-only pipelines."""
+
+        height, width = self.size[1], self.size[0]
+        layout = (('inputs', np.float32, (slots, batchSize, height, width, 1)),
+                  ('images', np.uint8, (slots, batchSize, height, width)),
+                  ('masks', np.float32, (slots, batchSize, height, width, 1)),
+                  ('probs', np.float32, (slots, batchSize)),
+                  ('states', np.int32, (slots,)))
+
+        offsets, nbytes = [], 0
+        for _, dtype, shape in layout:
+            offsets.append(nbytes)
+            nbytes += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // self.ALIGN) * self.ALIGN
+
+        self._owner = name is None
+        self._shm = None
+        self._finalizer = None
+
+        if not self.shared:
+            backing = np.empty(nbytes, dtype=np.uint8)
+        elif self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._finalizer = weakref.finalize(self, releaseBlock, self._shm, True)
+            backing = self._shm.buf
+        else:
+            self._shm = attachBlock(name)
+            self._finalizer = weakref.finalize(self, releaseBlock, self._shm, False)
+            backing = self._shm.buf
+
+        for (field, dtype, shape), offset in zip(layout, offsets):
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=backing, offset=offset))
+
+        if self._owner:
+            self.states[:] = self.FREE
+
+    def advance(self, index, expected, state):
+        """
+        Moves a slot to its next lifecycle state.
+
+        Parameters:
+        -----------
+        index : int
+            Slot index.
+
+        expected : int or tuple of int
+            State(s) the slot must be in.
+
+        state : int
+            New state.
+
+        Raises:
+        -------
+        RuntimeError
+            If the slot is not in an expected state, e.g. claimed while its outputs still use it.
+        """
+        expected = expected if isinstance(expected, tuple) else (expected,)
+        current = int(self.states[index])
+        if current not in expected:
+            raise RuntimeError(f'ring slot {index} is in state {current}, expected one of {expected}')
+        self.states[index] = state
+
+    def claim(self, index):
+        """
+        Marks a free slot as being filled.
+        """
+        self.advance(index, self.FREE, self.FILLING)
+
+    def release(self, index):
+        """
+        Returns a slot to FREE once nothing reads its images or masks any more; free slots stay free.
+        """
+        self.advance(index, (self.FREE, self.READY, self.INFERRED), self.FREE)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attaches to a ring created in another process.
+
+        Parameters:
+        -----------
+        spec : tuple
+            The creating ring's `spec`.
+
+        Returns:
+        --------
+        SharedRing
+            A ring sharing the creator's memory.
+        """
+        name, slots, batchSize, size = spec
+        return cls(slots, batchSize, size, name=name)
+
+    @property
+    def spec(self):
+        """
+        tuple: (name, slots, batchSize, size), everything another process needs to attach.
+        """
+        return self._shm.name if self._shm else None, self.slots, self.batchSize, self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Drops the views and unmaps the block; the owner also unlinks it.
+        """
+        for field in ('inputs', 'images', 'masks', 'probs', 'states'):
+            setattr(self, field, None)
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def attachBlock(name):
+    """
+    Opens an existing shared memory block without handing it to the resource
+    tracker, which would otherwise unlink it when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block; workers share
+        # the creator's tracker, where the owner's unlink clears the registration
+        return shared_memory.SharedMemory(name=name)
+
+
+def releaseBlock(shm, unlink):
+    """
+    Unmaps a shared memory block and, for its owner, removes it.
+    """
+    try:
+        shm.close()
+    except BufferError:
+        # Views still exist (interpreter exit); the mapping goes with the process
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,324 @@
+import multiprocessing
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+import controller.SharedRing as sr
+from common_libs import os, deque, ThreadPoolExecutor
+
+_decoder = {}
+"""dict: Ring, preprocessor and tensor store of the current decode process."""
+
+class StreamingPipeline:
+    """
+    Overlapped three-stage pipeline for directory-scale inference.
+
+    1. Decode: worker threads, or worker processes with `decodeProcesses`, read,
+       resize and normalize images straight into the slots of a `SharedRing`.
+    2. Inference: the calling thread runs one model call per full batch on a
+       view of the ring while the decoders are already filling the next slots,
+       and writes the masks back into the ring.
+    3. Output: a separate thread pool runs `finish` (overlay rendering, PNG
+       writes, record building) for every image, reading the ring in place.
+
+    The ring holds `prefetch + 1` batches and a slot is only refilled once the
+    outputs reading it are done, so memory stays bounded whatever the number of
+    inputs. With decode processes the ring lives in shared memory: nothing but
+    file names and error messages is pickled. Results are yielded in input order.
+
+    Attributes:
+    -----------
+    fusedModel : FusedModel
+        Model returning the mask and TB probability in one pass.
+
+    finish : function
+        Output-stage callable `finish(file, img, mask, tb, error)` returning a record.
+
+    batchSize : int
+        Number of images per model call.
+
+    decodeWorkers : int
+        Threads decoding and preprocessing images.
+
+    decodeProcesses : int
+        Processes decoding and preprocessing images instead of threads, or 0.
+
+    outputWorkers : int
+        Threads running the output stage.
+
+    prefetch : int
+        Number of batches decoded ahead of the one being inferred.
+
+    outputDepth : int
+        Largest number of outputs waiting to be yielded.
+    """
+
+    def __init__(self, fusedModel, finish, batchSize=8, decodeWorkers=None, outputWorkers=2, prefetch=2, store=None,
+                 decodeProcesses=0):
+        """
+        Configures the pipeline.
+
+        Parameters:
+        -----------
+        fusedModel : FusedModel
+            Model returning the mask and TB probability in one pass.
+
+        finish : function
+            Output-stage callable `finish(file, img, mask, tb, error)`. `img` is the
+            512x512 grayscale image, `mask` the raw (512, 512, 1) sigmoid mask and `tb`
+            the probability; on a decode failure they are None and `error` is set.
+            `img` and `mask` are views into the ring, valid until `finish` returns.
+
+        batchSize : int, optional (default=8)
+            Number of images per model call.
+
+        decodeWorkers : int, optional
+            Decode threads. Defaults to the number of CPUs, capped at 8.
+
+        outputWorkers : int, optional (default=2)
+            Output threads.
+
+        prefetch : int, optional (default=2)
+            Number of batches decoded ahead of the one being inferred.
+
+        store : TensorStore, optional
+            Preprocessed inputs to read instead of decoding the files.
+
+        decodeProcesses : int, optional (default=0)
+            Decode in this many processes writing into shared memory, for when
+            decoding is CPU-bound and threads contend for the GIL; 0 uses threads.
+        """
+        self.fusedModel = fusedModel
+        """FusedModel: Model returning the mask and TB probability in one pass."""
+
+        self.finish = finish
+        """function: Output-stage callable returning a record."""
+
+        self.batchSize: int = max(1, batchSize)
+        """int: Number of images per model call."""
+
+        self.decodeWorkers: int = decodeWorkers or min(8, os.cpu_count() or 1)
+        """int: Threads decoding and preprocessing images."""
+
+        self.outputWorkers: int = max(1, outputWorkers)
+        """int: Threads running the output stage."""
+
+        self.prefetch: int = max(1, prefetch)
+        """int: Number of batches decoded ahead of the one being inferred."""
+
+        self.outputDepth: int = self.batchSize * (self.prefetch + 1)
+        """int: Largest number of outputs waiting to be yielded."""
+
+        self.store = store
+        """TensorStore: Preprocessed inputs read instead of decoding, or None."""
+
+        self.decodeProcesses: int = max(0, decodeProcesses)
+        """int: Processes decoding and preprocessing images instead of threads, or 0."""
+
+    def decode(self, file, slot, image=None):
+        """
+        Reads one image, from the tensor store if one is set, and writes its model
+        input into a buffer slot.
+
+        Parameters:
+        -----------
+        file : str
+            Image path.
+
+        slot : np.ndarray
+            Float32 view of shape (512, 512, 1) inside a batch buffer.
+
+        image : np.ndarray, optional
+            Uint8 array of shape (512, 512) receiving the grayscale image.
+
+        Returns:
+        --------
+        np.ndarray
+            The 512x512 grayscale image, kept for overlay rendering.
+        """
+        return decodeInto(self.fusedModel.preprocessor, self.store, file, slot, image)
+
+    def startDecoders(self, ring):
+        """
+        Starts the decode stage: threads writing into the ring, or processes
+        attached to it when `decodeProcesses` is set.
+        """
+        if not self.decodeProcesses:
+            return ThreadPoolExecutor(self.decodeWorkers, thread_name_prefix='decode')
+
+        return futures.ProcessPoolExecutor(self.decodeProcesses, multiprocessing.get_context('spawn'), initDecoder,
+                                           (ring.spec, self.store.directory if self.store is not None else None))
+
+    def run(self, files):
+        """
+        Streams records for every input file, in input order.
+
+        Parameters:
+        -----------
+        files : iterable of str
+            Image paths; may be a lazy iterator.
+
+        Yields:
+        -------
+        object
+            Whatever `finish` returns for each file.
+        """
+        files = iter(files)
+        ring = sr.SharedRing(self.prefetch + 1, self.batchSize, self.fusedModel.preprocessor.size,
+                             shared=self.decodeProcesses > 0)
+        inUse = [[] for _ in range(ring.slots)]
+        pending, outputs = deque(), deque()
+        counter = 0
+
+        with ring, ThreadPoolExecutor(self.outputWorkers, thread_name_prefix='output') as writers:
+            decoders = self.startDecoders(ring)
+
+            def submit(file, index, position):
+                if self.decodeProcesses:
+                    return decoders.submit(decodeSlot, file, index, position)
+                return decoders.submit(self.decode, file, ring.inputs[index, position], ring.images[index, position])
+
+            def fill():
+                # Keep `prefetch` batches queued on the decoders; item k always
+                # lands in position k % batchSize of ring slot (k // batchSize) % slots
+                nonlocal counter, decoders
+                while len(pending) < self.prefetch * self.batchSize:
+                    file = next(files, None)
+                    if file is None:
+                        return
+                    index, position = (counter // self.batchSize) % ring.slots, counter % self.batchSize
+                    if position == 0:
+                        # Reuse a slot only once the outputs reading its images and masks are done
+                        futures.wait(inUse[index])
+                        inUse[index] = []
+                        ring.release(index)
+                        ring.claim(index)
+                    try:
+                        future = submit(file, index, position)
+                    except BrokenProcessPool:
+                        # A decode process died: its items fail, a fresh pool takes the rest
+                        decoders.shutdown(wait=False)
+                        decoders = self.startDecoders(ring)
+                        future = submit(file, index, position)
+                    pending.append((file, index, position, future))
+                    counter += 1
+
+            try:
+                fill()
+                while pending:
+                    batch = [pending.popleft() for _ in range(min(self.batchSize, len(pending)))]
+                    fill()
+
+                    # Wait for this batch's decodes; move good positions over failed ones in place
+                    index = batch[0][1]
+                    inputs, images, masks = ring.inputs[index], ring.images[index], ring.masks[index]
+                    items, n = [], 0
+                    for file, _, position, future in batch:
+                        try:
+                            future.result()
+                        except BrokenProcessPool:
+                            items.append((file, RuntimeError('decode process crashed')))
+                            continue
+                        except Exception as e:
+                            items.append((file, e))
+                            continue
+                        if position != n:
+                            inputs[n] = inputs[position]
+                            images[n] = images[position]
+                        items.append((file, None))
+                        n += 1
+                    ring.advance(index, ring.FILLING, ring.READY)
+
+                    if n:
+                        # The model reads the ring in place; its masks go back into the slot
+                        predicted, probs = self.fusedModel.predictTensor(inputs[:n])
+                        masks[:n] = predicted
+                        ring.probs[index, :n] = probs
+                        ring.advance(index, ring.READY, ring.INFERRED)
+
+                    k = 0
+                    for file, error in items:
+                        if error is None:
+                            future = writers.submit(self.finish, file, images[k], masks[k], float(ring.probs[index, k]), None)
+                            k += 1
+                        else:
+                            future = writers.submit(self.finish, file, None, None, None, error)
+                        inUse[index].append(future)
+                        outputs.append(future)
+
+                    while len(outputs) > self.outputDepth:
+                        yield outputs.popleft().result()
+
+                while outputs:
+                    yield outputs.popleft().result()
+            finally:
+                decoders.shutdown(cancel_futures=True)
+                futures.wait(outputs)
+
+
+def decodeInto(preprocessor, store, file, slot, image=None):
+    """
+    Decodes one image, or reads it from a tensor store, into a model input slot.
+
+    Parameters:
+    -----------
+    preprocessor : Preprocessor
+        Decodes and normalizes source images.
+
+    store : TensorStore or None
+        Preprocessed inputs to read instead of decoding.
+
+    file : str
+        Image path.
+
+    slot : np.ndarray
+        Float32 array of shape (height, width, 1) receiving the model input.
+
+    image : np.ndarray, optional
+        Uint8 array of shape (height, width) receiving the grayscale image.
+
+    Returns:
+    --------
+    np.ndarray
+        The grayscale image: `image` when given, otherwise the decoded array.
+
+    Raises:
+    -------
+    ValueError
+        If the file cannot be decoded or is missing from the store.
+    """
+    if store is not None:
+        # Normalize straight from the memory-mapped row
+        if store.toTensor(file, out=slot) is None:
+            raise ValueError('not in tensor store')
+        img = store.image(file)
+    else:
+        img = preprocessor.decode(file)
+        if img is None:
+            raise ValueError('unreadable image')
+        preprocessor.toTensor(img, out=slot)
+
+    if image is None:
+        return img
+    image[...] = img
+    return image
+
+
+def initDecoder(spec, storeDir):
+    """
+    Decode process start-up: attaches the ring and opens the tensor store.
+    """
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import model.Preprocessor as pp
+    import model.TensorStore as ts
+
+    ring = sr.SharedRing.attach(spec)
+    _decoder.update(ring=ring, preprocessor=pp.Preprocessor(ring.size),
+                    store=ts.TensorStore(storeDir) if storeDir else None)
+
+
+def decodeSlot(file, index, position):
+    """
+    Decode process job: writes one image into its ring position. Only errors are returned.
+    """
+    ring = _decoder['ring']
+    decodeInto(_decoder['preprocessor'], _decoder['store'], file, ring.inputs[index, position],
+               ring.images[index, position])
@@ -0,0 +1,325 @@
+import model.ResultCache as rc
+import model.ProcessedManifest as pm
+import controller.BatchController as bc
+from common_libs import os, json, time, hashlib
+from common_libs import SEG_PATH, CLF_PATH, IMG_EXTENSIONS, WATCH_INTERVAL, WATCH_SETTLE, WATCH_IGNORED, WATCH_RETRIES
+
+class WatchController:
+    """
+    Headless controller that scores X-rays as they land in watched directories.
+
+    The directories are polled every `interval` seconds. A new or changed file
+    becomes ready once its size and mtime have stayed the same for `settle`
+    seconds, so files still being copied or exported are left alone. Ready files
+    are drained in batches through a BatchController (same models, pipeline,
+    output PNGs and records). Each record is appended to a JSON lines file and
+    the file is then entered into a ProcessedManifest, so a restart skips every
+    file already scored by the current models. Content already scored under
+    another name reuses its record without running the models.
+
+    A file that cannot be read or decoded is recorded as a failure, not as
+    scored, and tried again once it has settled anew, up to `retries` attempts
+    per version of the file. Only the last failed attempt writes an error record.
+
+    Attributes:
+    -----------
+    directories : list of str
+        Watched directories.
+
+    out : str
+        JSON lines file the records are appended to.
+
+    interval : float
+        Seconds between scans.
+
+    settle : float
+        Seconds a file must stay unchanged before it is scored.
+
+    retries : int
+        Attempts per version of a file before it is given up.
+
+    scorer : BatchController
+        Runs the models and builds the records.
+
+    manifest : ProcessedManifest
+        Files already scored, with their hash and the model fingerprint.
+    """
+
+    def __init__(self, directories, out, manifest, batchSize=8, interval=WATCH_INTERVAL, settle=WATCH_SETTLE,
+                 maskDir=None, overlayDir=None, workers=None, prefetch=2, processes=0, threads=None,
+                 interThreads=1, cvThreads=1, pin=True, retries=WATCH_RETRIES):
+        """
+        Loads the models and opens the manifest.
+
+        Parameters:
+        -----------
+        directories : list of str
+            Watched directories.
+
+        out : str
+            JSON lines file the records are appended to.
+
+        manifest : str
+            SQLite manifest file.
+
+        batchSize : int, optional (default=8)
+            Number of images per model call.
+
+        interval : float, optional (default=WATCH_INTERVAL)
+            Seconds between scans.
+
+        settle : float, optional (default=WATCH_SETTLE)
+            Seconds a file must stay unchanged before it is scored.
+
+        maskDir, overlayDir, workers, prefetch, processes, threads, interThreads, cvThreads, pin :
+            Passed to the BatchController.
+
+        retries : int, optional (default=WATCH_RETRIES)
+            Attempts per version of a file before it is given up.
+        """
+        self.directories: list = [os.path.abspath(d) for d in directories]
+        """list of str: Watched directories."""
+
+        self.out: str = out
+        """str: JSON lines file the records are appended to."""
+
+        self.interval: float = interval
+        """float: Seconds between scans."""
+
+        self.settle: float = settle
+        """float: Seconds a file must stay unchanged before it is scored."""
+
+        self.retries: int = max(1, retries)
+        """int: Attempts per version of a file before it is given up."""
+
+        self.scorer: bc.BatchController = bc.BatchController(batchSize, maskDir, overlayDir, workers, prefetch,
+                                                             None, processes, threads, interThreads, cvThreads, pin)
+        """BatchController: Runs the models and builds the records."""
+
+        self.manifest: pm.ProcessedManifest = pm.ProcessedManifest(
+            manifest, rc.ResultCache.modelFingerprint((SEG_PATH, CLF_PATH)))
+        """ProcessedManifest: Files already scored, with their hash and the model fingerprint."""
+
+        # path -> (size, mtime_ns) of files scored or given up, and -> (size, mtime_ns, since) of candidates
+        self._done = {}
+        self._candidates = {}
+        self._outFile = None
+
+    def scan(self, now=None):
+        """
+        Lists the files that are new or changed and have finished writing.
+
+        Parameters:
+        -----------
+        now : float, optional
+            Current `time.monotonic()` value.
+
+        Returns:
+        --------
+        list of tuple
+            (path, size, mtime_ns) of every ready file, oldest first.
+        """
+        now = time.monotonic() if now is None else now
+        ready, seen = [], set()
+
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                name = entry.name.lower()
+                if name.startswith('.') or name.endswith(WATCH_IGNORED) or not name.endswith(IMG_EXTENSIONS):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                path, version = entry.path, (stat.st_size, stat.st_mtime_ns)
+                seen.add(path)
+                if self._done.get(path) == version:
+                    continue
+                if self.manifest.contains(path, *version) or self.manifest.attempts(path, *version) >= self.retries:
+                    self._done[path] = version
+                    continue
+
+                # Ready once the size and mtime have stopped changing for `settle` seconds
+                candidate = self._candidates.get(path)
+                if candidate is None or candidate[:2] != version:
+                    self._candidates[path] = version + (now,)
+                elif stat.st_size > 0 and now - candidate[2] >= self.settle:
+                    ready.append((path, stat.st_size, stat.st_mtime_ns))
+
+        # Forget files that disappeared before they were scored
+        for path in set(self._candidates) - seen:
+            del self._candidates[path]
+
+        return sorted(ready, key=lambda item: item[2])
+
+    @staticmethod
+    def hashFile(path):
+        """
+        Returns the content hash of a file, or None if it cannot be read.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        try:
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    h.update(chunk)
+        except OSError:
+            return None
+        return h.hexdigest()
+
+    def drain(self, ready, write):
+        """
+        Scores a backlog of ready files, one manifest transaction per batch.
+
+        Parameters:
+        -----------
+        ready : list of tuple
+            (path, size, mtime_ns) from `scan`.
+
+        write : function
+            Writes one record to the output.
+
+        Returns:
+        --------
+        int
+            Number of files recorded, scored or given up.
+        """
+        entries, failures, pending = [], [], {}
+        for path, size, mtime_ns in ready:
+            digest = self.hashFile(path)
+            if digest is None:
+                # Unreadable (e.g. permissions or a file being replaced): retried like a decode failure
+                failures.append((path, size, mtime_ns, self.scorer.finish(path, None, None, None, 'cannot read file')))
+                continue
+            previous = self.manifest.lookupHash(digest)
+            if previous is not None:
+                # Same content scored before under another name
+                previous.update(file=path, mask=None, overlay=None)
+                entries.append((path, digest, size, mtime_ns, previous))
+            else:
+                pending[path] = (digest, size, mtime_ns)
+
+        count = self.commit(entries, write) + self.fail(failures, write)
+
+        entries, failures = [], []
+        # Outputs are named relative to the watched directories, so equal names in two of them differ
+        for record in self.scorer.score(list(pending), os.path.commonpath(self.directories)):
+            digest, size, mtime_ns = pending[record['file']]
+            if record['error'] is not None:
+                failures.append((record['file'], size, mtime_ns, record))
+            else:
+                entries.append((record['file'], digest, size, mtime_ns, record))
+            if len(entries) + len(failures) >= self.scorer.batchSize:
+                count += self.commit(entries, write) + self.fail(failures, write)
+                entries, failures = [], []
+
+        return count + self.commit(entries, write) + self.fail(failures, write)
+
+    def commit(self, entries, write):
+        """
+        Writes the records of scored files, then enters the files into the manifest.
+        """
+        if not entries:
+            return 0
+
+        for path, _, size, mtime_ns, record in entries:
+            write(record)
+            self._done[path] = (size, mtime_ns)
+            self._candidates.pop(path, None)
+
+        # Records are on disk before the manifest says the files are done
+        self.sync()
+        self.manifest.add(entries)
+
+        return len(entries)
+
+    def fail(self, failures, write):
+        """
+        Records failed attempts. Files with attempts left settle again before the
+        next one; the error record of a file is only written once it is given up.
+
+        Parameters:
+        -----------
+        failures : list of tuple
+            (path, size, mtime_ns, record) per failed file; the record holds the error.
+
+        write : function
+            Writes one record to the output.
+
+        Returns:
+        --------
+        int
+            Number of files given up.
+        """
+        if not failures:
+            return 0
+
+        given_up = 0
+        now = time.monotonic()
+        for path, size, mtime_ns, record in failures:
+            if self.manifest.attempts(path, size, mtime_ns) + 1 >= self.retries:
+                write(record)
+                self._done[path] = (size, mtime_ns)
+                self._candidates.pop(path, None)
+                given_up += 1
+            else:
+                self._candidates[path] = (size, mtime_ns, now)
+                print(f"Failed to score {path} ({record['error']}), will retry")
+
+        self.sync()
+        self.manifest.addFailures([(path, size, mtime_ns, record['error']) for path, size, mtime_ns, record in failures])
+
+        return given_up
+
+    def sync(self):
+        """
+        Flushes the written records to disk.
+        """
+        self._outFile.flush()
+        os.fsync(self._outFile.fileno())
+
+    def run(self, once=False):
+        """
+        Watches the directories until interrupted.
+
+        Parameters:
+        -----------
+        once : bool, optional (default=False)
+            Score the files present now (after they settle) and return.
+
+        Returns:
+        --------
+        int
+            Number of files recorded.
+        """
+        total = 0
+        self._outFile = open(self.out, 'a')
+        write = lambda record: self._outFile.write(json.dumps(record) + '\n')
+        try:
+            while True:
+                ready = self.scan()
+                count = self.drain(ready, write) if ready else 0
+                if count:
+                    # Drain bursts back to back; sleep only once the backlog is empty
+                    total += count
+                    print(f'Recorded {count} file(s), {total} this session, {len(self.manifest)} in manifest')
+                    continue
+                if once and not self._candidates:
+                    break
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._outFile.close()
+            self.manifest.close()
+            if self.scorer.pool is not None:
+                self.scorer.pool.close()
+
+        return total
@@ -0,0 +1,293 @@
+"""
+Per-stage timing and profiling hooks for the inference pipeline.
+
+Stages are wrapped in `stage(name)` blocks. While instrumentation is disabled
+(the default) `stage` returns a shared no-op context manager, so the hooks cost
+one function call per stage. It is enabled by any of:
+
+- LUNGSIGHT_TIMINGS=1: show per-stage timings in the HomeView status panel.
+- LUNGSIGHT_TRACE_LOG=<file>: append one JSON line of timings per request.
+- LUNGSIGHT_PROFILE=tf|cprofile: capture a TensorFlow profiler trace or a cProfile
+  dump for the first LUNGSIGHT_PROFILE_REQUESTS requests into LUNGSIGHT_PROFILE_DIR.
+
+A request is opened with `begin(name)` on the thread that runs it, which makes it
+the current trace for that thread, so model code can time itself without being
+handed the trace. `detach()` closes the thread's part of the request and
+`finish(trace)` records it once the result is displayed, or with an 'error' or
+'cancelled' status when the request fails or its result is discarded.
+"""
+
+from common_libs import os, json, threading, time, cProfile
+from common_libs import contextmanager, nullcontext
+from common_libs import TIMINGS, TRACE_LOG, PROFILE_MODE, PROFILE_REQUESTS, PROFILE_DIR
+
+NULL_STAGE = nullcontext()
+"""nullcontext: Shared no-op context manager returned while instrumentation is disabled."""
+
+
+class Trace:
+    """
+    Stage timings of a single request.
+
+    Attributes:
+    -----------
+    name : str
+        Request name, usually the image file.
+
+    stages : dict
+        Accumulated seconds per stage name, in first-seen order.
+
+    start : float
+        `time.perf_counter()` value when the request began.
+    """
+
+    def __init__(self, name):
+        """
+        Starts timing a request.
+
+        Parameters:
+        -----------
+        name : str
+            Request name, usually the image file.
+        """
+        self.name: str = name
+        """str: Request name, usually the image file."""
+
+        self.stages: dict = {}
+        """dict: Accumulated seconds per stage name, in first-seen order."""
+
+        self.start: float = time.perf_counter()
+        """float: `time.perf_counter()` value when the request began."""
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block and adds it to the stage `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def record(self, status='ok', error=None):
+        """
+        Returns the request as a JSON-serializable dict with millisecond timings,
+        its outcome ('ok', 'error' or 'cancelled') and the error message, if any.
+        """
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'request': self.name,
+            'status': status,
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+            'stages': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+        }
+        if error is not None:
+            record['error'] = str(error)
+        return record
+
+
+class Instrumentation:
+    """
+    Collects per-request stage timings, writes them to a JSON lines log and
+    optionally profiles the first requests.
+
+    Attributes:
+    -----------
+    enabled : bool
+        False turns every hook into a no-op.
+
+    logPath : str or None
+        JSON lines file receiving one record per finished request.
+
+    profileMode : str or None
+        'tf' for a TensorFlow profiler trace, 'cprofile' for a cProfile dump.
+
+    profileRequests : int
+        Number of requests to profile.
+
+    profileDir : str
+        Directory receiving the profiler output.
+
+    profiled : int
+        Number of requests profiled so far.
+
+    last : dict or None
+        Record of the most recently finished request.
+    """
+
+    def __init__(self, enabled=False, logPath=None, profileMode=None, profileRequests=0, profileDir='profiles'):
+        """
+        Configures the instrumentation.
+
+        Parameters:
+        -----------
+        enabled : bool, optional (default=False)
+            Collect timings even without a log or profiler, e.g. for the status panel.
+
+        logPath : str, optional
+            JSON lines file receiving one record per finished request.
+
+        profileMode : str, optional
+            'tf' or 'cprofile' to profile the first `profileRequests` requests.
+
+        profileRequests : int, optional (default=0)
+            Number of requests to profile.
+
+        profileDir : str, optional (default='profiles')
+            Directory receiving the profiler output.
+        """
+        if profileMode not in (None, '', 'tf', 'cprofile'):
+            raise ValueError(f"Unknown profile mode {profileMode!r}, expected 'tf' or 'cprofile'")
+
+        self.enabled: bool = bool(enabled or logPath or profileMode)
+        """bool: False turns every hook into a no-op."""
+
+        self.logPath: str = logPath
+        """str: JSON lines file receiving one record per finished request."""
+
+        self.profileMode: str = profileMode or None
+        """str: 'tf' for a TensorFlow profiler trace, 'cprofile' for a cProfile dump."""
+
+        self.profileRequests: int = profileRequests
+        """int: Number of requests to profile."""
+
+        self.profileDir: str = profileDir
+        """str: Directory receiving the profiler output."""
+
+        self.profiled: int = 0
+        """int: Number of requests profiled so far."""
+
+        self.last: dict = None
+        """dict: Record of the most recently finished request."""
+
+        self.local = threading.local()
+        """threading.local: Holds the current trace and profiler of each thread."""
+
+        self.lock = threading.Lock()
+        """threading.Lock: Serializes log writes and profiler bookkeeping."""
+
+    def begin(self, name):
+        """
+        Opens a request on the calling thread and starts the profiler if it still
+        has requests to capture.
+
+        Parameters:
+        -----------
+        name : str
+            Request name, usually the image file.
+
+        Returns:
+        --------
+        Trace or None
+            The new trace, or None while disabled.
+        """
+        if not self.enabled:
+            return None
+
+        trace = Trace(name)
+        self.local.trace = trace
+        self.local.profiler = None
+
+        with self.lock:
+            profile = self.profileMode and self.profiled < self.profileRequests
+            if profile:
+                self.profiled += 1
+                index = self.profiled
+
+        if profile:
+            os.makedirs(self.profileDir, exist_ok=True)
+            if self.profileMode == 'tf':
+                from common_libs import tf
+                tf.profiler.experimental.start(os.path.join(self.profileDir, f'request-{index:03d}'))
+                self.local.profiler = 'tf'
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                self.local.profiler = (profiler, os.path.join(self.profileDir, f'request-{index:03d}.prof'))
+
+        return trace
+
+    def stage(self, name, trace=None):
+        """
+        Returns a context manager timing the enclosed block as stage `name`.
+
+        Parameters:
+        -----------
+        name : str
+            Stage name, e.g. 'decode' or 'segmentation.infer'.
+
+        trace : Trace, optional
+            Trace to add the timing to. Defaults to the calling thread's current trace.
+
+        Returns:
+        --------
+        context manager
+            A timing block, or a no-op when disabled or outside a request.
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        if trace is None:
+            trace = getattr(self.local, 'trace', None)
+            if trace is None:
+                return NULL_STAGE
+        return trace.stage(name)
+
+    def detach(self):
+        """
+        Ends the calling thread's part of the request and stops its profiler.
+        """
+        if not self.enabled:
+            return
+
+        profiler = getattr(self.local, 'profiler', None)
+        self.local.trace = None
+        self.local.profiler = None
+
+        if profiler == 'tf':
+            from common_libs import tf
+            tf.profiler.experimental.stop()
+        elif profiler is not None:
+            profiler[0].disable()
+            profiler[0].dump_stats(profiler[1])
+
+    def finish(self, trace, status='ok', error=None):
+        """
+        Records a finished request and appends it to the log.
+
+        Parameters:
+        -----------
+        trace : Trace or None
+            Trace returned by `begin`.
+
+        status : str, optional (default='ok')
+            Outcome of the request: 'ok', 'error' or 'cancelled'.
+
+        error : Exception or str, optional
+            Failure of the request, logged with an 'error' status.
+
+        Returns:
+        --------
+        dict or None
+            The request record, or None if there was no trace.
+        """
+        if trace is None:
+            return None
+
+        record = trace.record(status, error)
+        with self.lock:
+            self.last = record
+            if self.logPath:
+                with open(self.logPath, 'a') as fh:
+                    fh.write(json.dumps(record) + '\n')
+
+        return record
+
+
+INSTRUMENTATION = Instrumentation(TIMINGS, TRACE_LOG, PROFILE_MODE, PROFILE_REQUESTS, PROFILE_DIR)
+"""Instrumentation: Process-wide instance configured from the environment."""
+
+begin = INSTRUMENTATION.begin
+stage = INSTRUMENTATION.stage
+detach = INSTRUMENTATION.detach
+finish = INSTRUMENTATION.finish
@@ -3,19 +3,73 @@ Entry point for the application.
 
 This script initializes and starts the main controller of the application,
 which is responsible for coordinating the execution of the entire project pipeline.
+Without arguments it launches the GUI; the `batch` command scores many X-rays headlessly:
+
+    python main.py batch <dir|glob> --batch-size 16 --out results.jsonl
+
+and the `build-store` command preprocesses a cohort once into a memory-mapped store
+that `batch --store` reads instead of decoding:
+
+    python main.py build-store <dir|glob> --store cohort.store
+    python main.py batch --store cohort.store --out results.csv
+
+and the `evaluate` command scores a validation set against ground-truth masks and labels:
+
+    python main.py evaluate <dir|glob> --masks <dir> --labels labels.csv --out per_image.csv
+
+(with `--preview` it scores the low-resolution preview instead, e.g. against the masks `batch --mask-dir`
+saved from the full-resolution model),
+
+and the `watch` command scores X-rays as they land in one or more directories:
+
+    python main.py watch /exports/cxr --out watch.jsonl --manifest watch.sqlite
+
+and the `export` command converts the .keras models to TFLite/ONNX:
+
+    python main.py export --format tflite onnx --quant fp16 int8 --calibration <dir>
+
+and the `serve` command runs a local HTTP inference service:
+
+    python main.py serve --port 8080 --max-batch 8 --max-wait-ms 10
+
+Batch and serve accept `--processes N` to run inference in N worker processes with
+partitioned cores; `pool-sweep` measures which split is fastest on this machine:
+
+    python main.py pool-sweep --batch-size 8
+
+and the `bench` command measures the pipeline, optionally against a baseline:
+
+    python main.py bench --batch-sizes 1 4 8 --threads 0 4 --out bench.json --baseline old.json
+
+and the `parity` command checks the fast decode path against the reference preprocessing:
+
+    python main.py parity <dir|glob> --out parity.json
 
 Modules Used:
 -------------
 - controller.MainController: Contains the core logic and methods to run the application.
+- controller.BatchController: Headless batched inference over many images.
+- controller.EvaluationController: Dice/IoU and classification metrics against ground truth.
+- controller.WatchController: Watch-folder ingestion with a processed-files manifest.
+- controller.ExportController: Converts the models to TFLite/ONNX.
+- controller.InferenceServer: Local HTTP inference service with micro-batching.
+- controller.BenchmarkController: Stage timings and throughput sweeps.
+- controller.InferencePool: Multi-process inference with partitioned CPU cores.
+- common_libs.argparse: Used for parsing command line arguments.
+- common_libs.time: Used for measuring startup time.
 - common_libs.os: Used for setting environment variables.
 - common_libs.warnings: Used to suppress warning messages during runtime.
 """
 
-# Import the main controller from the controller module
-import controller.MainController as mc
+# Import necessary standard libraries (TensorFlow and other heavy libraries load lazily)
+from common_libs import os, warnings, argparse, json, time
+from common_libs import WATCH_INTERVAL, WATCH_SETTLE, WATCH_RETRIES
+
+# Reference point for the time-to-window and time-to-ready reports
+START_TIME = time.perf_counter()
 
-# Import necessary standard libraries
-from common_libs import os, warnings
+# Import the GUI controller; it loads the models in the background
+import controller.MainController as mc
 
 # Suppress all warnings
 warnings.filterwarnings('ignore')
@@ -23,10 +77,241 @@ warnings.filterwarnings('ignore')
 # Suppress TensorFlow debug logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+
+def addPoolArguments(parser):
+    """
+    Adds the multi-process inference pool options to a command.
+    """
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Worker processes, each with its own model copy (default: 0, in-process).')
+    parser.add_argument('--threads-per-process', type=int,
+                        help='TensorFlow intra-op threads per worker (default: cores / processes).')
+    parser.add_argument('--inter-threads', type=int, default=1, help='TensorFlow inter-op threads per worker (default: 1).')
+    parser.add_argument('--cv-threads', type=int, default=1, help='OpenCV threads per worker (default: 1).')
+    parser.add_argument('--no-pin', action='store_true', help='Do not pin workers to their own cores.')
+
+
+def parseArgs():
+    """
+    Parses the command line.
+
+    Returns:
+    --------
+    argparse.Namespace
+        Parsed arguments; `command` is None when the GUI should start.
+    """
+    parser = argparse.ArgumentParser(prog='LungSight', description='Tuberculosis detection from chest X-rays.')
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser('batch', help='Score many X-rays without the GUI.')
+    batch.add_argument('source', nargs='?', help='Directory or glob pattern of input images '
+                                                 '(optional with --store: every stored image).')
+    batch.add_argument('--batch-size', type=int, default=8, help='Images per model call (default: 8).')
+    batch.add_argument('--out', default='results.jsonl', help='Output file, .jsonl or .csv (default: results.jsonl).')
+    batch.add_argument('--mask-dir', help='Save predicted masks as PNGs in this directory.')
+    batch.add_argument('--overlay-dir', help='Save colored overlays as PNGs in this directory.')
+    batch.add_argument('--workers', type=int, help='Decode threads (default: CPU count, max 8).')
+    batch.add_argument('--prefetch', type=int, default=2, help='Batches decoded ahead of inference (default: 2).')
+    batch.add_argument('--store', help='Read preprocessed inputs from this tensor store instead of decoding.')
+    batch.add_argument('--decode-processes', type=int, default=0,
+                       help='Decode in processes writing into shared memory instead of threads (default: 0).')
+    addPoolArguments(batch)
+
+    store = commands.add_parser('build-store', help='Preprocess X-rays into a memory-mapped tensor store.')
+    store.add_argument('source', help='Directory or glob pattern of input images.')
+    store.add_argument('--store', required=True, help='Store directory; existing stores are appended to.')
+    store.add_argument('--dtype', choices=['uint8', 'float16'], default='uint8',
+                       help='Stored input type for a new store (default: uint8).')
+    store.add_argument('--workers', type=int, help='Decode threads (default: CPU count, max 8).')
+
+    evaluate = commands.add_parser('evaluate', help='Score a validation set against ground-truth masks and labels.')
+    evaluate.add_argument('source', nargs='?', help='Directory or glob pattern of input images '
+                                                    '(optional with --store: every stored image).')
+    evaluate.add_argument('--masks', help='Directory of ground-truth lung masks named after their images.')
+    evaluate.add_argument('--labels', help='CSV of image names and TB labels (0/1, positive/negative).')
+    evaluate.add_argument('--out', help='Write per-image Dice/IoU, probability and label to this CSV.')
+    evaluate.add_argument('--summary', help='Save the summary as JSON.')
+    evaluate.add_argument('--mask-threshold', type=float, default=0.5,
+                          help='Sigmoid value from which a predicted pixel is lung (default: 0.5).')
+    evaluate.add_argument('--batch-size', type=int, default=8, help='Images per model call (default: 8).')
+    evaluate.add_argument('--workers', type=int, help='Decode and metric threads (default: CPU count, max 8).')
+    evaluate.add_argument('--prefetch', type=int, default=2, help='Batches decoded ahead of inference (default: 2).')
+    evaluate.add_argument('--store', help='Read preprocessed inputs from this tensor store instead of decoding.')
+    evaluate.add_argument('--decode-processes', type=int, default=0,
+                          help='Decode in processes writing into shared memory instead of threads (default: 0).')
+    evaluate.add_argument('--preview', action='store_true',
+                          help='Score the low-resolution preview model instead of the full-resolution one.')
+
+    watch = commands.add_parser('watch', help='Score X-rays as they arrive in watched directories.')
+    watch.add_argument('directories', nargs='+', help='Directories to watch.')
+    watch.add_argument('--out', default='watch_results.jsonl', help='JSON lines file records are appended to '
+                                                                    '(default: watch_results.jsonl).')
+    watch.add_argument('--manifest', default='watch_manifest.sqlite',
+                       help='SQLite manifest of scored files, for resuming (default: watch_manifest.sqlite).')
+    watch.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                       help=f'Seconds between scans (default: {WATCH_INTERVAL}).')
+    watch.add_argument('--settle', type=float, default=WATCH_SETTLE,
+                       help=f'Seconds a file must stay unchanged before it is scored (default: {WATCH_SETTLE}).')
+    watch.add_argument('--retries', type=int, default=WATCH_RETRIES,
+                       help=f'Attempts before an unreadable file is given up (default: {WATCH_RETRIES}).')
+    watch.add_argument('--once', action='store_true', help='Score the files present now, then exit.')
+    watch.add_argument('--batch-size', type=int, default=8, help='Images per model call (default: 8).')
+    watch.add_argument('--mask-dir', help='Save predicted masks as PNGs in this directory.')
+    watch.add_argument('--overlay-dir', help='Save colored overlays as PNGs in this directory.')
+    watch.add_argument('--workers', type=int, help='Decode threads (default: CPU count, max 8).')
+    watch.add_argument('--prefetch', type=int, default=2, help='Batches decoded ahead of inference (default: 2).')
+    addPoolArguments(watch)
+
+    export = commands.add_parser('export', help='Convert the .keras models to TFLite and/or ONNX.')
+    export.add_argument('--format', nargs='+', choices=('tflite', 'onnx'), default=['tflite'],
+                        help='Export formats (default: tflite).')
+    export.add_argument('--quant', nargs='+', choices=('fp32', 'fp16', 'dynamic', 'int8'), default=['fp32'],
+                        help='Quantization modes (default: fp32).')
+    export.add_argument('--calibration', help='Directory, glob or tensor store of X-rays for int8 calibration.')
+    export.add_argument('--eval', help='Directory, glob or tensor store for the accuracy report (default: calibration set).')
+    export.add_argument('--out-dir', default='resource/exported', help='Output directory (default: resource/exported).')
+
+    serve = commands.add_parser('serve', help='Run the local HTTP inference service.')
+    serve.add_argument('--host', default='127.0.0.1', help='Interface to bind (default: 127.0.0.1).')
+    serve.add_argument('--port', type=int, default=8080, help='TCP port (default: 8080).')
+    serve.add_argument('--max-batch', type=int, default=8, help='Largest micro-batch (default: 8).')
+    serve.add_argument('--max-wait-ms', type=float, default=10, help='Longest wait to fill a batch (default: 10).')
+    serve.add_argument('--max-queue', type=int, default=64, help='Queue depth before rejecting requests (default: 64).')
+    addPoolArguments(serve)
+
+    sweep = commands.add_parser('pool-sweep', help='Find the fastest split of the cores into worker processes.')
+    sweep.add_argument('--cores', type=int, help='Cores to partition (default: all available).')
+    sweep.add_argument('--batch-size', type=int, default=8, help='Images per model call (default: 8).')
+    sweep.add_argument('--batches', type=int, help='Timed batches per split (default: 2 per worker, at least 4).')
+    sweep.add_argument('--inter-threads', type=int, default=1, help='TensorFlow inter-op threads per worker (default: 1).')
+    sweep.add_argument('--out', help='Save the results as JSON.')
+
+    bench = commands.add_parser('bench', help='Benchmark the inference pipeline.')
+    bench.add_argument('--image', help='Benchmark image (default: resource/lungs-original.png, else synthetic).')
+    bench.add_argument('--repeats', type=int, default=10, help='Timed iterations per measurement (default: 10).')
+    bench.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8], help='Batch sizes to sweep.')
+    bench.add_argument('--threads', type=int, nargs='+', default=[0], help='Thread counts to sweep, 0 = default.')
+    bench.add_argument('--out', default='bench.json', help='Results file (default: bench.json).')
+    bench.add_argument('--baseline', help='Stored results to compare against.')
+    bench.add_argument('--threshold', type=float, default=0.1, help='Allowed relative regression (default: 0.1).')
+
+    check = commands.add_parser('parity', help='Compare fast-decoded model inputs with the reference preprocessing.')
+    check.add_argument('source', help='Directory or glob of X-rays.')
+    check.add_argument('--max-samples', type=int, default=64, help='Largest number of films checked (default: 64).')
+    check.add_argument('--out', help='Save the report as JSON.')
+
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    # Instantiate the main controller
-    app = mc.MainController()
-    """controller.MainController: Contains the core logic and methods to run the application."""
+    args = parseArgs()
+
+    if args.command == 'batch':
+        # Run headless batched inference
+        import controller.BatchController as bc
+        if args.source is None and args.store is None:
+            raise SystemExit('batch: a source or --store is required')
+        app = bc.BatchController(args.batch_size, args.mask_dir, args.overlay_dir, args.workers, args.prefetch,
+                                 args.store, args.processes, args.threads_per_process, args.inter_threads,
+                                 args.cv_threads, not args.no_pin, args.decode_processes)
+        count = app.run(args.source, args.out)
+        print(f'Processed {count} images -> {args.out}')
+
+    elif args.command == 'build-store':
+        # Decode and preprocess once, for later re-runs straight from the memory map
+        import model.TensorStore as ts
+        import controller.BatchController as bc
+        store = ts.TensorStore(args.store, args.dtype)
+        summary = store.append(bc.BatchController.collectFiles(args.source), args.workers)
+        for file, error in summary['errors']:
+            print(f'Failed: {file}: {error}')
+        print(f"Added {summary['added']}, reused {summary['reused']}, skipped {summary['skipped']}, "
+              f"failed {summary['failed']} -> {args.store} ({len(store)} images, {store.dtype})")
+
+    elif args.command == 'evaluate':
+        # Stream the validation set through the model, keeping only overlap counts per image
+        import controller.EvaluationController as evc
+        if args.source is None and args.store is None:
+            raise SystemExit('evaluate: a source or --store is required')
+        if not (args.masks or args.labels):
+            raise SystemExit('evaluate: --masks and/or --labels is required')
+        app = evc.EvaluationController(args.masks, args.labels, args.batch_size, args.workers, args.prefetch,
+                                       args.store, args.decode_processes, args.mask_threshold,
+                                       preview=args.preview)
+        summary = app.run(args.source, args.out)
+        if args.summary:
+            with open(args.summary, 'w') as fh:
+                json.dump(summary, fh, indent=2)
+        for key, value in summary.items():
+            print(f'{key:>12}: {value}')
+
+    elif args.command == 'watch':
+        # Poll the directories and score settled files, resuming from the manifest
+        import controller.WatchController as wc
+        app = wc.WatchController(args.directories, args.out, args.manifest, args.batch_size, args.interval,
+                                 args.settle, args.mask_dir, args.overlay_dir, args.workers, args.prefetch,
+                                 args.processes, args.threads_per_process, args.inter_threads, args.cv_threads,
+                                 not args.no_pin, args.retries)
+        print(f'Watching {", ".join(app.directories)} ({len(app.manifest)} files already scored)')
+        count = app.run(args.once)
+        print(f'Recorded {count} files -> {args.out}')
+
+    elif args.command == 'export':
+        # Convert the models and report their agreement with the originals
+        import controller.ExportController as ec
+        app = ec.ExportController(args.out_dir, args.calibration, args.eval)
+        app.run(args.format, args.quant)
+
+    elif args.command == 'serve':
+        # Serve predictions over HTTP with dynamic micro-batching
+        import controller.InferenceServer as isv
+        app = isv.InferenceServer(args.host, args.port, args.max_batch, args.max_wait_ms, args.max_queue,
+                                  args.processes, args.threads_per_process, args.inter_threads,
+                                  args.cv_threads, not args.no_pin)
+        app.serve()
+
+    elif args.command == 'pool-sweep':
+        # Try every workers x threads split of the cores and recommend the fastest
+        import controller.InferencePool as ip
+        results = ip.sweep(args.cores, args.batch_size, args.batches, args.inter_threads)
+        if args.out:
+            with open(args.out, 'w') as fh:
+                json.dump(results, fh, indent=2)
+        best = results[0]
+        print(f"Best: --processes {best['processes']} --threads-per-process {best['threads']} "
+              f"({best['images_per_sec']:.2f} img/s)")
+
+    elif args.command == 'bench':
+        # Measure every stage and fail on regressions against a baseline
+        import controller.BenchmarkController as bmc
+        app = bmc.BenchmarkController(args.image, args.repeats, args.batch_sizes, args.threads)
+        results = app.run(args.out)
+
+        if args.baseline:
+            with open(args.baseline) as fh:
+                regressions = app.compare(results, json.load(fh), args.threshold)
+            for line in regressions:
+                print('REGRESSION', line)
+            if regressions:
+                raise SystemExit(1)
+            print('No regressions against', args.baseline)
+
+    elif args.command == 'parity':
+        # Tensor and probability differences of the fast decode against the reference path
+        import controller.BenchmarkController as bmc
+        report = bmc.parity(args.source, args.max_samples)
+        if args.out:
+            with open(args.out, 'w') as fh:
+                json.dump(report, fh, indent=2)
+        for path, entry in report.items():
+            print(f"{path:>9}: {entry['films']} films  max|dx|={entry['max_tensor_diff']:.4f}  "
+                  f"mean|dx|={entry['mean_tensor_diff']:.5f}  max|dp|={entry['max_prob_diff']:.5f}  "
+                  f"agreement={entry['label_agreement']:.2%}")
+
+    else:
+        # Instantiate the main controller
+        app = mc.MainController(START_TIME)
+        """controller.MainController: Contains the core logic and methods to run the application."""
 
-    # Start the application workflow
-    app.start()
+        # Start the application workflow
+        app.start()
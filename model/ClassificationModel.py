@@ -1,5 +1,13 @@
-from common_libs import np, cv2, keras
+from common_libs import np
 from common_libs import dice_coefficient, jaccard_index
+from common_libs import TB_THRESHOLD, COMPILED_INFERENCE, XLA_JIT
+from common_libs import TYPE_CHECKING
+import model.Preprocessor as pp
+import model.InferenceBackend as ib
+import instrumentation as ins
+
+if TYPE_CHECKING:
+    from common_libs import keras
 
 class ClassificationModel:
     """
@@ -9,16 +17,22 @@ class ClassificationModel:
     Attributes:
     -----------
     path : str
-        File path to the saved Keras classification model.
+        File path to the classification model (.keras/.h5, or an exported .tflite/.onnx).
 
     customObj : dict
         Dictionary containing any custom metrics used in the model.
 
-    model : keras.Model
-        Loaded Keras model ready for inference.
+    model : keras.Model or None
+        Loaded Keras model ready for inference, None for exported models.
+
+    preprocessor : Preprocessor
+        Converts input images into the float32 model input tensor.
+
+    backend : KerasBackend, TFLiteBackend or OnnxBackend
+        Runtime executing the model, chosen from the file extension.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, model=None, compiled=COMPILED_INFERENCE, jitCompile=XLA_JIT):
         """
         Initializes the ClassificationModel by loading the model with custom metrics.
 
@@ -26,6 +40,16 @@ class ClassificationModel:
         -----------
         path : str
             File path to the trained Keras classification model (.keras or .h5).
+
+        model : keras.Model, optional
+            Already-loaded model for this path. Loaded from disk when omitted.
+
+        compiled : bool, optional (default=COMPILED_INFERENCE)
+            Keras models only: run inference through a compiled tf.function
+            instead of `Model.predict`.
+
+        jitCompile : bool, optional (default=XLA_JIT)
+            Keras models only: XLA JIT compile the tf.function.
         """
         self.path: str = path
         """str: Path to the trained classification model."""
@@ -36,18 +60,21 @@ class ClassificationModel:
         }
         """dict: Custom metrics dictionary used during model training."""
 
-        self.model: keras.Model = keras.models.load_model(self.path, custom_objects=self.customObj)
-        """keras.Model: The classification model loaded from the provided path."""
+        self.backend = ib.loadBackend(self.path, model, self.customObj, compiled, jitCompile)
+        """KerasBackend, TFLiteBackend or OnnxBackend: Runtime executing the model."""
+
+        self.model: keras.Model = self.backend.model
+        """keras.Model: The classification model loaded from the provided path, None for exported models."""
+
+        self.preprocessor: pp.Preprocessor = pp.Preprocessor()
+        """Preprocessor: Converts input images into the float32 model input tensor."""
 
     def predict(self, img):
         """
         Predicts disease presence probability or class from a chest X-ray image.
 
         Preprocessing:
-        - Resize image to 512x512 pixels.
-        - Convert to grayscale.
-        - Normalize pixel values to [0, 1].
-        - Add batch dimension.
+        - Build a float32 batch of one with the shared Preprocessor.
 
         Postprocessing:
         - Squeeze output to return a scalar or 1D array.
@@ -62,22 +89,62 @@ class ClassificationModel:
         float or np.ndarray
             Predicted class probability or logits, depending on model architecture.
         """
-        # Resize to input shape expected by model
-        img = cv2.resize(img, (512, 512))
-
-        # Convert BGR to grayscale
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Normalize to [0, 1]
-        img = img / 255.0
-
-        # Expand dimensions to match model input (1, 512, 512)
-        img = np.expand_dims(img, axis=0)
+        # Resize, convert and normalize input into a float32 batch of one
+        with ins.stage('classification.preprocess'):
+            x = self.preprocessor.toBatch([img])
 
         # Run prediction
-        pred = self.model.predict(img, verbose=0)
+        with ins.stage('classification.infer'):
+            pred = self.predictTensor(x)
 
         # Remove batch or extra dimensions if present
         pred = np.squeeze(pred)
 
         return pred
+
+    def predictTensor(self, x):
+        """
+        Runs the classifier on an already preprocessed input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1) produced by Preprocessor.
+
+        Returns:
+        --------
+        np.ndarray
+            Predicted probabilities of shape (N,).
+        """
+        return self.backend(x)[0].reshape(-1)
+
+    def warmup(self):
+        """
+        Runs the backend once so the first real prediction does not pay for
+        graph tracing or tensor allocation.
+        """
+        self.backend.warmup()
+
+    @staticmethod
+    def interpret(tb, threshold=TB_THRESHOLD):
+        """
+        Turns a TB probability into a readable label and its confidence.
+
+        Parameters:
+        -----------
+        tb : float
+            Predicted TB probability.
+
+        threshold : float, optional (default=TB_THRESHOLD)
+            Probability above which the film is reported as positive.
+
+        Returns:
+        --------
+        tuple
+            (label, confidence) where label is 'Positive' or 'Negative' and
+            confidence is a percentage.
+        """
+        tb = float(tb)
+        if tb > threshold:
+            return 'Positive', tb * 100
+        return 'Negative', (1 - tb) * 100
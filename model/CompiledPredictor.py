@@ -0,0 +1,108 @@
+from common_libs import np, tf
+
+class CompiledPredictor:
+    """
+    Fixed-signature compiled inference function for a Keras model.
+
+    `keras.Model.predict` builds a data adapter and a callback loop on every
+    call, which costs milliseconds for single images. This wraps the model's
+    forward pass in a `tf.function` traced once for float32 inputs of shape
+    (None, height, width, channels), optionally compiled with XLA.
+
+    Attributes:
+    -----------
+    model : keras.Model
+        Model whose forward pass is compiled.
+
+    jitCompile : bool
+        Whether the function is XLA JIT compiled.
+
+    function : tf.types.experimental.GenericFunction
+        The compiled forward pass.
+    """
+
+    def __init__(self, model, jitCompile=False):
+        """
+        Builds the compiled forward pass; tracing happens on the first call or `warmup`.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            Model whose forward pass is compiled.
+
+        jitCompile : bool, optional (default=False)
+            XLA JIT compile the function.
+        """
+        self.model = model
+        """keras.Model: Model whose forward pass is compiled."""
+
+        self.jitCompile: bool = jitCompile
+        """bool: Whether the function is XLA JIT compiled."""
+
+        spec = tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.float32)
+
+        @tf.function(input_signature=[spec], jit_compile=jitCompile)
+        def forward(x):
+            return self.model(x, training=False)
+
+        self.function = forward
+        """tf.types.experimental.GenericFunction: The compiled forward pass."""
+
+    def __call__(self, x):
+        """
+        Runs the compiled forward pass.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 input batch.
+
+        Returns:
+        --------
+        np.ndarray or list of np.ndarray
+            Model output(s), shaped like `Model.predict` output.
+        """
+        out = self.function(x)
+        if isinstance(out, (list, tuple)):
+            return [o.numpy() for o in out]
+        return out.numpy()
+
+    def warmup(self, batchSize=1):
+        """
+        Traces and runs the function once so the first real call is fast.
+
+        Parameters:
+        -----------
+        batchSize : int, optional (default=1)
+            Batch size of the dummy input.
+        """
+        self(np.zeros((batchSize,) + tuple(self.model.inputs[0].shape[1:]), dtype=np.float32))
+
+    def parityCheck(self, x=None, atol=1e-4):
+        """
+        Compares the compiled path against `Model.predict` on the same input.
+
+        Parameters:
+        -----------
+        x : np.ndarray, optional
+            Input batch; a fixed pseudo-random batch of one is used when omitted.
+
+        atol : float, optional (default=1e-4)
+            Largest absolute difference accepted.
+
+        Returns:
+        --------
+        tuple
+            (ok, max_diff) where ok is True when every output agrees within `atol`.
+        """
+        if x is None:
+            rng = np.random.default_rng(0)
+            x = rng.random((1,) + tuple(self.model.inputs[0].shape[1:]), dtype=np.float32)
+
+        compiled = self(x)
+        reference = self.model.predict(x, verbose=0)
+        if not isinstance(compiled, list):
+            compiled, reference = [compiled], [reference]
+
+        max_diff = max(float(np.max(np.abs(c - r))) for c, r in zip(compiled, reference))
+        return max_diff <= atol, max_diff
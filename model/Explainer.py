@@ -0,0 +1,228 @@
+from common_libs import np
+import model.SegmentationModel as sm
+import instrumentation as ins
+
+class Explainer:
+    """
+    Runs the fused model in a multi-output mode that also returns explanation maps.
+
+    The Attention U-Net's gates already compute, for each skip connection, a
+    coefficient per pixel saying how much of it the decoder lets through. These
+    maps are exposed as extra outputs of the same graph that produces the mask,
+    the TB probability and the case embedding, upsampled to the input size and
+    averaged into one attention map. Optionally, a Grad-CAM heatmap of the
+    classifier is computed in the same call: the gradient of the probability with
+    respect to the classifier's last feature map, taken under one GradientTape,
+    only runs back through the small classification head, never through the U-Net.
+
+    Only the fused Keras graph can be explained; exported models expose no gates.
+
+    Attributes:
+    -----------
+    preprocessor : Preprocessor
+        Builds the model input, shared with the fused model.
+
+    gradCam : bool
+        Whether Grad-CAM heatmaps are computed.
+
+    maps : tuple of str
+        Names of the explanation maps returned, in display order.
+
+    model : keras.Model
+        Graph returning [mask, probability, embedding, attention gates..., features].
+    """
+
+    def __init__(self, fusedModel, gradCam=False):
+        """
+        Builds the multi-output graph and its compiled forward pass.
+
+        Parameters:
+        -----------
+        fusedModel : FusedModel
+            Loaded fused model; must be running the fused Keras graph.
+
+        gradCam : bool, optional (default=False)
+            Also compute a Grad-CAM heatmap of the classifier.
+        """
+        if fusedModel.model is None:
+            raise ValueError('Explanations need the fused Keras model')
+
+        self.preprocessor = fusedModel.preprocessor
+        """Preprocessor: Builds the model input, shared with the fused model."""
+
+        self.gradCam: bool = gradCam
+        """bool: Whether Grad-CAM heatmaps are computed."""
+
+        self.maps: tuple = ('attention', 'gradcam') if gradCam else ('attention',)
+        """tuple of str: Names of the explanation maps returned, in display order."""
+
+        self._embeddings = fusedModel.embeddingSize > 0
+        self._gates = 0
+
+        self.model = self.buildExplained(fusedModel.model)
+        """keras.Model: Graph returning [mask, probability, embedding, attention gates..., features]."""
+
+        self._forward = self.buildForward()
+
+    @staticmethod
+    def findFeatureMap(model):
+        """
+        Locates the classifier's last spatial feature map, the input of its global pooling.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            Fused or classification model.
+
+        Returns:
+        --------
+        KerasTensor or None
+            Tensor of shape (N, h, w, C), or None if the classifier has no global pooling.
+        """
+        from common_libs import keras
+
+        pooling = (keras.layers.GlobalAveragePooling2D, keras.layers.GlobalMaxPooling2D, keras.layers.Flatten)
+        for layer in reversed(model.layers):
+            if isinstance(layer, pooling) and len(layer.input.shape) == 4:
+                return layer.input
+        return None
+
+    def buildExplained(self, fused):
+        """
+        Rebuilds the fused graph around a nested U-Net that also returns its gate maps.
+
+        Parameters:
+        -----------
+        fused : keras.Model
+            Fused model mapping the input to [mask, probability(, embedding)].
+
+        Returns:
+        --------
+        keras.Model
+            Model mapping the input to [mask, probability, (embedding,) gate maps...,
+            (feature map)], sharing the fused model's layers and weights.
+        """
+        import model.FusedModel as fm
+        from common_libs import keras
+
+        sub_model, seg_output = fm.FusedModel.findSegmentationNode(fused)
+        gates = sm.SegmentationModel.findAttentionGates(sub_model)
+        if not gates:
+            raise ValueError('The segmentation model has no attention gates')
+        self._gates = len(gates)
+
+        # The U-Net with its gates as extra outputs, and the classifier head fed by its mask
+        unet = keras.Model(sub_model.inputs, [sub_model.outputs[0]] + gates)
+        head_outputs = list(fused.outputs[1:])
+        if self.gradCam:
+            features = self.findFeatureMap(fused)
+            if features is None:
+                raise ValueError('The classifier has no spatial feature map for Grad-CAM')
+            head_outputs.append(features)
+        head = keras.Model([fused.inputs[0], seg_output], head_outputs)
+
+        inputs = keras.Input(fused.inputs[0].shape[1:])
+        unet_outputs = unet(inputs)
+        head_outputs = head([inputs, unet_outputs[0]])
+        head_outputs = head_outputs if isinstance(head_outputs, list) else [head_outputs]
+
+        return keras.Model(inputs, [unet_outputs[0]] + head_outputs[:len(fused.outputs) - 1]
+                           + list(unet_outputs[1:]) + head_outputs[len(fused.outputs) - 1:])
+
+    def buildForward(self):
+        """
+        Compiles the forward pass returning the predictions and the explanation maps.
+
+        Returns:
+        --------
+        tf.types.experimental.GenericFunction
+            Function of a float32 batch returning (masks, probs, embeddings or None,
+            attention, gradcam or None), the maps of shape (N, H, W) in [0, 1].
+        """
+        from common_libs import tf
+
+        size = tuple(self.model.inputs[0].shape[1:3])
+        spec = tf.TensorSpec((None,) + tuple(self.model.inputs[0].shape[1:]), tf.float32)
+        extra = 1 if self._embeddings else 0
+
+        @tf.function(input_signature=[spec])
+        def forward(x):
+            with tf.GradientTape() as tape:
+                outputs = self.model(x, training=False)
+            masks, probs = outputs[0], outputs[1]
+            embeddings = outputs[2] if extra else None
+            gates = outputs[2 + extra:2 + extra + self._gates]
+
+            # Gate coefficients are already in [0, 1]; averaged at the input size
+            attention = tf.add_n([tf.image.resize(gate, size) for gate in gates]) / len(gates)
+
+            gradcam = None
+            if self.gradCam:
+                features = outputs[-1]
+                # Channel weights are the spatially averaged gradients of the probability
+                weights = tf.reduce_mean(tape.gradient(probs, features), axis=(1, 2), keepdims=True)
+                cam = tf.nn.relu(tf.reduce_sum(features * weights, axis=-1, keepdims=True))
+                cam = tf.math.divide_no_nan(cam, tf.reduce_max(cam, axis=(1, 2, 3), keepdims=True))
+                gradcam = tf.image.resize(cam, size)[..., 0]
+
+            return masks, probs, embeddings, attention[..., 0], gradcam
+
+        return forward
+
+    def __call__(self, x):
+        """
+        Runs the multi-output forward pass on a preprocessed batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1) produced by Preprocessor.
+
+        Returns:
+        --------
+        tuple
+            (masks, probs, embeddings, maps): raw sigmoid masks of shape (N, 512, 512, 1),
+            TB probabilities of shape (N,), embeddings of shape (N, D) or None, and a
+            dict of float32 maps of shape (N, 512, 512) in [0, 1] keyed by `maps`.
+        """
+        masks, probs, embeddings, attention, gradcam = self._forward(x)
+        maps = {'attention': attention.numpy()}
+        if self.gradCam:
+            maps['gradcam'] = gradcam.numpy()
+
+        return (masks.numpy(), probs.numpy().reshape(-1), None if embeddings is None else embeddings.numpy(),
+                maps)
+
+    def predict(self, img):
+        """
+        Predicts the lung mask, TB probability, embedding and explanation maps for one image.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Input BGR image (OpenCV format).
+
+        Returns:
+        --------
+        tuple
+            (pred_mask, tb, embedding, maps) where pred_mask is an RGB uint8 mask image,
+            tb the TB probability, embedding of shape (D,) or None, and maps a dict of
+            (512, 512) float32 maps keyed by `maps`.
+        """
+        with ins.stage('fused.preprocess'):
+            x = self.preprocessor.toBatch([img])
+
+        with ins.stage('explain.infer'):
+            masks, probs, embeddings, maps = self(x)
+
+        with ins.stage('fused.postprocess'):
+            pred_mask = sm.SegmentationModel.postprocess(masks)
+
+        return (pred_mask, np.squeeze(probs), None if embeddings is None else embeddings[0],
+                {name: values[0] for name, values in maps.items()})
+
+    def warmup(self):
+        """
+        Traces the forward pass once so the first explained prediction is fast.
+        """
+        self(np.zeros((1,) + tuple(self.model.inputs[0].shape[1:]), dtype=np.float32))
@@ -0,0 +1,341 @@
+from common_libs import os, np
+from common_libs import dice_coefficient, jaccard_index
+from common_libs import COMPILED_INFERENCE, XLA_JIT
+from common_libs import TYPE_CHECKING
+import model.SegmentationModel as sm
+import model.ClassificationModel as cm
+import model.Preprocessor as pp
+import model.InferenceBackend as ib
+import instrumentation as ins
+
+if TYPE_CHECKING:
+    from common_libs import keras
+
+class FusedModel:
+    """
+    Runs lung segmentation and tuberculosis classification in a single forward pass.
+
+    The classifier produced by the training notebook (`combined_unet_classifier`) already
+    contains the Attention U-Net as a nested sub-model. This class exposes the output of
+    that nested U-Net next to the classification head, so one graph execution yields
+    both the mask and the TB probability. An exported (.tflite/.onnx) fused graph, as
+    written by the `export` command, is run the same way: it is recognised by its two
+    outputs, the mask and the probability. When the classifier does not embed a U-Net
+    identical to the standalone segmentation model, or when the exported models are
+    the separate segmentation and classification graphs, it falls back to running
+    SegmentationModel and ClassificationModel separately.
+
+    Attributes:
+    -----------
+    segPath : str
+        File path to the saved Keras segmentation model.
+
+    clfPath : str
+        File path to the saved Keras classification model.
+
+    customObj : dict
+        Dictionary containing the custom metrics used in the models.
+
+    model : keras.Model or None
+        Fused Keras model (mask, probability and, when available, embedding), or None
+        for an exported fused graph or in fallback mode.
+
+    segModel : SegmentationModel or None
+        Standalone segmentation model used only in fallback mode.
+
+    clfModel : ClassificationModel or None
+        Standalone classification model used only in fallback mode.
+
+    preprocessor : Preprocessor
+        Builds the single input tensor shared by both heads.
+
+    backend : KerasBackend, TFLiteBackend, OnnxBackend or None
+        Runtime executing the fused graph, or None in fallback mode.
+
+    embeddingSize : int
+        Length of the case embeddings returned with the predictions, 0 when unavailable.
+    """
+
+    def __init__(self, segPath, clfPath, compiled=COMPILED_INFERENCE, jitCompile=XLA_JIT):
+        """
+        Loads the classification model and tries to build the fused two-output graph.
+
+        Parameters:
+        -----------
+        segPath : str
+            File path to the trained Keras segmentation model.
+
+        clfPath : str
+            File path to the trained Keras classification model.
+
+        compiled : bool, optional (default=COMPILED_INFERENCE)
+            Keras models only: run inference through a compiled tf.function
+            instead of `Model.predict`.
+
+        jitCompile : bool, optional (default=XLA_JIT)
+            Keras models only: XLA JIT compile the tf.function.
+        """
+        self.segPath: str = segPath
+        """str: Path to the trained segmentation model."""
+
+        self.clfPath: str = clfPath
+        """str: Path to the trained classification model."""
+
+        self.customObj: dict = {
+            'dice_coefficient': dice_coefficient,
+            'jaccard_index': jaccard_index
+        }
+        """dict: Custom metrics dictionary used during model training."""
+
+        self.model: keras.Model = None
+        """keras.Model: Fused Keras model returning [mask, probability(, embedding)], or None if exported or in fallback mode."""
+
+        self.segModel: sm.SegmentationModel = None
+        """SegmentationModel: Fallback segmentation model, only loaded when fusion fails."""
+
+        self.clfModel: cm.ClassificationModel = None
+        """ClassificationModel: Fallback classification model, only loaded when fusion fails."""
+
+        self.preprocessor: pp.Preprocessor = pp.Preprocessor()
+        """Preprocessor: Builds the single input tensor shared by both heads."""
+
+        self.backend = None
+        """KerasBackend, TFLiteBackend or OnnxBackend: Runtime executing the fused graph, or None in fallback mode."""
+
+        self.embeddingSize: int = 0
+        """int: Length of the case embeddings returned with the predictions, 0 when unavailable."""
+
+        clf, seg = None, None
+        if ib.isKerasPath(self.segPath) and ib.isKerasPath(self.clfPath):
+            from common_libs import keras
+            clf = keras.models.load_model(self.clfPath, custom_objects=self.customObj)
+            seg = keras.models.load_model(self.segPath, custom_objects=self.customObj)
+            self.model = self.buildFused(clf, seg)
+            if self.model is not None:
+                self.backend = ib.KerasBackend(self.model, compiled, jitCompile)
+                if len(self.model.outputs) > 2:
+                    self.embeddingSize = int(self.model.outputs[2].shape[-1])
+            reason = 'the classifier does not embed a U-Net identical to the segmentation model'
+        else:
+            # An exported fused graph has two outputs; the separate exports have one each
+            path = self.clfPath if not ib.isKerasPath(self.clfPath) else self.segPath
+            backend = ib.loadBackend(path)
+            if backend.outputCount == 2:
+                self.backend = backend
+            reason = f'{os.path.basename(path)} is not a fused two-output export'
+
+        if self.backend is None:
+            # Graphs don't match or the models were exported separately: keep the two-model pipeline
+            print(f'Single-pass inference unavailable ({reason}); running segmentation and classification separately')
+            self.segModel = sm.SegmentationModel(self.segPath, seg, compiled, jitCompile)
+            self.clfModel = cm.ClassificationModel(self.clfPath, clf, compiled, jitCompile)
+
+    @property
+    def fused(self):
+        """
+        bool: True when predictions come from the single-pass fused graph, Keras or exported.
+        """
+        return self.backend is not None
+
+    @staticmethod
+    def findSegmentationNode(clf):
+        """
+        Locates the nested segmentation sub-model inside the classifier graph.
+
+        Only public graph attributes are used: the mask tensor is taken from the
+        inputs of the layers consuming it (the classifier's Multiply gate), and
+        accepted if the graph from the classifier input to it consists of exactly
+        one nested model with the input's shape.
+
+        Parameters:
+        -----------
+        clf : keras.Model
+            Loaded classification model.
+
+        Returns:
+        --------
+        tuple or None
+            (sub_model, output_tensor) where output_tensor is the sub-model's output in
+            the classifier graph, or None if no compatible sub-model exists.
+        """
+        from common_libs import keras
+
+        image = clf.inputs[0]
+        input_shape = tuple(image.shape)
+        candidates = [layer for layer in clf.layers if isinstance(layer, keras.Model)
+                      and tuple(layer.inputs[0].shape) == input_shape and tuple(layer.outputs[0].shape) == input_shape]
+        if not candidates:
+            return None
+
+        for layer in clf.layers:
+            try:
+                inputs = layer.input
+            except (AttributeError, ValueError):
+                # Input layers, or layers called more than once
+                continue
+            for tensor in inputs if isinstance(inputs, (list, tuple)) else [inputs]:
+                if tensor is image or tuple(tensor.shape) != input_shape:
+                    continue
+                try:
+                    upstream = [l for l in keras.Model(image, tensor).layers if not isinstance(l, keras.layers.InputLayer)]
+                except ValueError:
+                    # Not computed from the classifier input alone
+                    continue
+                if len(upstream) == 1 and upstream[0] in candidates:
+                    return upstream[0], tensor
+        return None
+
+    @staticmethod
+    def findEmbeddingTensor(clf):
+        """
+        Locates the classifier's penultimate features, the input of its output layer.
+
+        Parameters:
+        -----------
+        clf : keras.Model
+            Loaded classification model.
+
+        Returns:
+        --------
+        KerasTensor or None
+            Rank-2 feature tensor feeding the classification head, or None if the head
+            does not take a flat feature vector.
+        """
+        history = getattr(clf.outputs[0], '_keras_history', None)
+        if history is None:
+            return None
+        try:
+            features = history[0].input
+        except (AttributeError, ValueError):
+            return None
+        if isinstance(features, (list, tuple)) or len(features.shape) != 2:
+            return None
+        return features
+
+    @staticmethod
+    def buildFused(clf, seg):
+        """
+        Builds a two-output model from the classifier if its nested U-Net matches the
+        standalone segmentation model weight for weight. The classifier's penultimate
+        features are added as a third output when available; they come out of the same
+        forward pass, so case embeddings cost no extra inference.
+
+        Parameters:
+        -----------
+        clf : keras.Model
+            Loaded classification model.
+
+        seg : keras.Model
+            Loaded segmentation model used as the reference.
+
+        Returns:
+        --------
+        keras.Model or None
+            Model mapping the input image to [mask, probability] or [mask, probability,
+            embedding], or None on mismatch.
+        """
+        from common_libs import keras
+
+        found = FusedModel.findSegmentationNode(clf)
+        if found is None:
+            return None
+        sub_model, seg_output = found
+
+        sub_weights = sub_model.get_weights()
+        seg_weights = seg.get_weights()
+        if len(sub_weights) != len(seg_weights):
+            return None
+        for a, b in zip(sub_weights, seg_weights):
+            if a.shape != b.shape or not np.array_equal(a, b):
+                return None
+
+        outputs = [seg_output, clf.outputs[0]]
+        features = FusedModel.findEmbeddingTensor(clf)
+        if features is not None:
+            outputs.append(features)
+
+        return keras.Model(clf.inputs[0], outputs)
+
+    def predict(self, img, embeddings=False):
+        """
+        Predicts the lung mask and the tuberculosis probability for one image.
+
+        Preprocessing:
+        - Build one float32 batch with the shared Preprocessor and hand it
+          to both heads (or both fallback models).
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Input BGR image (OpenCV format).
+
+        embeddings : bool, optional (default=False)
+            Also return the image's case embedding.
+
+        Returns:
+        --------
+        tuple
+            (pred_mask, tb) where pred_mask is an RGB uint8 mask image and tb is the
+            predicted TB probability, followed by the embedding of shape
+            (embeddingSize,) (None when unavailable) if `embeddings` is set.
+        """
+        # Resize, convert and normalize input into a float32 batch of one
+        with ins.stage('fused.preprocess'):
+            x = self.preprocessor.toBatch([img])
+
+        with ins.stage('fused.infer'):
+            pred_mask, tb, features = self.predictTensor(x, embeddings=True)
+
+        with ins.stage('fused.postprocess'):
+            result = sm.SegmentationModel.postprocess(pred_mask), np.squeeze(tb)
+
+        if embeddings:
+            return result + (None if features is None else features[0],)
+        return result
+
+    def predictTensor(self, x, embeddings=False):
+        """
+        Runs both heads on an already preprocessed input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1) produced by Preprocessor.
+
+        embeddings : bool, optional (default=False)
+            Also return the case embeddings.
+
+        Returns:
+        --------
+        tuple
+            (masks, probs): raw sigmoid masks of shape (N, 512, 512, 1) and
+            TB probabilities of shape (N,), followed by float32 embeddings of shape
+            (N, embeddingSize) (None when unavailable) if `embeddings` is set.
+        """
+        if not self.fused:
+            masks, probs, features = self.segModel.predictTensor(x), self.clfModel.predictTensor(x), None
+        elif self.model is None:
+            # Exported graph: runtimes may list the outputs in any order, the mask is the 4-D one
+            outputs = self.backend(x)
+            masks = next(out for out in outputs if out.ndim == 4)
+            probs = next(out for out in outputs if out.ndim != 4).reshape(-1)
+            features = None
+        else:
+            # Single forward pass for both heads and the penultimate features
+            outputs = self.backend(x)
+            masks, probs = outputs[0], outputs[1].reshape(-1)
+            features = outputs[2] if len(outputs) > 2 else None
+
+        return (masks, probs, features) if embeddings else (masks, probs)
+
+    def warmup(self):
+        """
+        Runs one dummy batch so the first real prediction does not pay for
+        graph tracing and memory allocation.
+        """
+        if not self.fused:
+            self.segModel.warmup()
+            self.clfModel.warmup()
+            return
+
+        self.backend.warmup()
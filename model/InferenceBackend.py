@@ -0,0 +1,342 @@
+from common_libs import os, np
+from common_libs import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from common_libs import keras
+
+class KerasBackend:
+    """
+    Runs a Keras model with full TensorFlow, either through a CompiledPredictor
+    or through `Model.predict`.
+
+    Attributes:
+    -----------
+    model : keras.Model
+        The loaded Keras model.
+
+    compiled : CompiledPredictor or None
+        Compiled fixed-signature forward pass, or None to use `Model.predict`.
+    """
+
+    def __init__(self, model, compiled=True, jitCompile=False):
+        """
+        Wraps a loaded Keras model.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            The loaded Keras model.
+
+        compiled : bool, optional (default=True)
+            Run inference through a compiled tf.function instead of `Model.predict`.
+
+        jitCompile : bool, optional (default=False)
+            XLA JIT compile the tf.function.
+        """
+        import model.CompiledPredictor as cp
+
+        self.model: keras.Model = model
+        """keras.Model: The loaded Keras model."""
+
+        self.compiled: cp.CompiledPredictor = cp.CompiledPredictor(model, jitCompile) if compiled else None
+        """CompiledPredictor: Compiled fixed-signature forward pass, or None to use `Model.predict`."""
+
+    @property
+    def inputShape(self):
+        """
+        tuple: Input shape without the batch dimension.
+        """
+        return tuple(self.model.inputs[0].shape[1:])
+
+    @property
+    def outputCount(self):
+        """
+        int: Number of model outputs.
+        """
+        return len(self.model.outputs)
+
+    def __call__(self, x):
+        """
+        Runs the model on a float32 input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 input batch.
+
+        Returns:
+        --------
+        list of np.ndarray
+            Model outputs in model order.
+        """
+        out = self.compiled(x) if self.compiled is not None else self.model.predict(x, verbose=0)
+        return out if isinstance(out, list) else [out]
+
+    def warmup(self):
+        """
+        Runs the inference path once so the first real prediction does not pay for
+        graph tracing. When compiled, the compiled path is first checked against
+        `Model.predict` and disabled if the outputs disagree.
+        """
+        if self.compiled is not None:
+            ok, max_diff = self.compiled.parityCheck()
+            if not ok:
+                # Printed like FusedModel's fallback: main.py filters warnings out
+                print(f'Compiled inference differs from Model.predict by {max_diff:.2e}; using Model.predict')
+                self.compiled = None
+
+        self(np.zeros((1,) + self.inputShape, dtype=np.float32))
+
+
+class TFLiteBackend:
+    """
+    Runs an exported TFLite model on the CPU.
+
+    Uses the standalone LiteRT interpreter (`ai_edge_litert`) when installed and
+    falls back to `tf.lite.Interpreter`. Quantized (int8/uint8) inputs and outputs
+    are converted from and to float32 transparently.
+
+    Attributes:
+    -----------
+    path : str
+        Path to the .tflite file.
+
+    interpreter : Interpreter
+        The TFLite interpreter.
+    """
+
+    model = None
+    """None: Exported backends have no Keras model."""
+
+    def __init__(self, path, numThreads=None):
+        """
+        Loads the TFLite model.
+
+        Parameters:
+        -----------
+        path : str
+            Path to the .tflite file.
+
+        numThreads : int, optional
+            Interpreter threads. Defaults to the number of CPUs.
+        """
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            from common_libs import tf
+            Interpreter = tf.lite.Interpreter
+
+        self.path: str = path
+        """str: Path to the .tflite file."""
+
+        self.interpreter = Interpreter(model_path=path, num_threads=numThreads or os.cpu_count())
+        """Interpreter: The TFLite interpreter."""
+
+        self._input = self.interpreter.get_input_details()[0]
+        self._batch = None
+
+    @property
+    def inputShape(self):
+        """
+        tuple: Input shape without the batch dimension.
+        """
+        return tuple(int(d) for d in self._input['shape'][1:])
+
+    @property
+    def outputCount(self):
+        """
+        int: Number of model outputs.
+        """
+        return len(self.interpreter.get_output_details())
+
+    def __call__(self, x):
+        """
+        Runs the model on a float32 input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 input batch.
+
+        Returns:
+        --------
+        list of np.ndarray
+            Float32 model outputs in model order.
+        """
+        if self._batch != len(x):
+            self.interpreter.resize_tensor_input(self._input['index'], list(x.shape))
+            self.interpreter.allocate_tensors()
+            self._batch = len(x)
+
+        self.interpreter.set_tensor(self._input['index'], self._quantize(x, self._input))
+        self.interpreter.invoke()
+
+        return [self._dequantize(self.interpreter.get_tensor(d['index']), d)
+                for d in self.interpreter.get_output_details()]
+
+    def warmup(self):
+        """
+        Allocates tensors and runs the model once.
+        """
+        self(np.zeros((1,) + self.inputShape, dtype=np.float32))
+
+    @staticmethod
+    def _quantize(x, detail):
+        """
+        Converts a float32 input to the tensor's quantized dtype if needed.
+        """
+        if detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = detail['quantization']
+            info = np.iinfo(detail['dtype'])
+            return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(detail['dtype'])
+        return x
+
+    @staticmethod
+    def _dequantize(y, detail):
+        """
+        Converts a quantized output back to float32 if needed.
+        """
+        if detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = detail['quantization']
+            return (y.astype(np.float32) - zero_point) * scale
+        return y
+
+
+class OnnxBackend:
+    """
+    Runs an exported ONNX model with ONNX Runtime on the CPU.
+
+    Attributes:
+    -----------
+    path : str
+        Path to the .onnx file.
+
+    session : onnxruntime.InferenceSession
+        The ONNX Runtime session.
+    """
+
+    model = None
+    """None: Exported backends have no Keras model."""
+
+    def __init__(self, path, numThreads=None):
+        """
+        Loads the ONNX model.
+
+        Parameters:
+        -----------
+        path : str
+            Path to the .onnx file.
+
+        numThreads : int, optional
+            Intra-op threads. Defaults to ONNX Runtime's choice.
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError('ONNX models require the onnxruntime package (pip install onnxruntime)') from e
+
+        options = ort.SessionOptions()
+        if numThreads:
+            options.intra_op_num_threads = numThreads
+
+        self.path: str = path
+        """str: Path to the .onnx file."""
+
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        """onnxruntime.InferenceSession: The ONNX Runtime session."""
+
+        self._inputName = self.session.get_inputs()[0].name
+
+    @property
+    def inputShape(self):
+        """
+        tuple: Input shape without the batch dimension.
+        """
+        return tuple(self.session.get_inputs()[0].shape[1:])
+
+    @property
+    def outputCount(self):
+        """
+        int: Number of model outputs.
+        """
+        return len(self.session.get_outputs())
+
+    def __call__(self, x):
+        """
+        Runs the model on a float32 input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 input batch.
+
+        Returns:
+        --------
+        list of np.ndarray
+            Model outputs in model order.
+        """
+        return self.session.run(None, {self._inputName: x})
+
+    def warmup(self):
+        """
+        Runs the model once.
+        """
+        self(np.zeros((1,) + self.inputShape, dtype=np.float32))
+
+
+def isKerasPath(path):
+    """
+    Returns True if the file is a Keras model rather than an exported one.
+
+    Parameters:
+    -----------
+    path : str
+        Model file path.
+
+    Returns:
+    --------
+    bool
+        True for .keras/.h5 files.
+    """
+    return not path.lower().endswith(('.tflite', '.onnx'))
+
+
+def loadBackend(path, model=None, customObj=None, compiled=True, jitCompile=False, numThreads=None):
+    """
+    Picks the inference backend matching a model file's extension.
+
+    Parameters:
+    -----------
+    path : str
+        Model file: .keras/.h5 (full TensorFlow), .tflite or .onnx.
+
+    model : keras.Model, optional
+        Already-loaded Keras model for `path`.
+
+    customObj : dict, optional
+        Custom objects needed to load a Keras model.
+
+    compiled : bool, optional (default=True)
+        Keras only: use a compiled tf.function instead of `Model.predict`.
+
+    jitCompile : bool, optional (default=False)
+        Keras only: XLA JIT compile the tf.function.
+
+    numThreads : int, optional
+        TFLite/ONNX only: CPU threads used by the runtime.
+
+    Returns:
+    --------
+    KerasBackend, TFLiteBackend or OnnxBackend
+        Backend ready for inference.
+    """
+    lower = path.lower()
+    if lower.endswith('.tflite'):
+        return TFLiteBackend(path, numThreads)
+    if lower.endswith('.onnx'):
+        return OnnxBackend(path, numThreads)
+
+    if model is None:
+        from common_libs import keras
+        model = keras.models.load_model(path, custom_objects=customObj)
+    return KerasBackend(model, compiled, jitCompile)
@@ -0,0 +1,217 @@
+from common_libs import np, cv2
+from common_libs import MASK_THRESHOLD, OVERLAY_COLOR, OVERLAY_ALPHA, HEATMAP_ALPHA
+
+class Postprocessor:
+    """
+    Turns raw segmentation outputs into binary masks, lung area fractions,
+    display masks and colored overlays.
+
+    Every operation works on a single image or on a whole batch (any leading
+    dimensions) in one vectorized pass. The overlay blend is a lookup into a
+    precomputed (512, 3) table indexed by mask bit * 256 + source intensity, so a
+    grayscale source never needs a 3-channel copy and no per-pixel coordinate
+    arrays are built. The table is computed with `cv2.addWeighted`, so overlays
+    are identical to blending a painted mask image.
+
+    Attributes:
+    -----------
+    threshold : float
+        Sigmoid value from which a pixel counts as lung.
+
+    color : tuple
+        BGR color painted over the lung region.
+
+    alpha : float
+        Weight of the color in the blend.
+    """
+
+    def __init__(self, threshold=MASK_THRESHOLD, color=OVERLAY_COLOR, alpha=OVERLAY_ALPHA):
+        """
+        Initializes the postprocessor.
+
+        Parameters:
+        -----------
+        threshold : float, optional (default=MASK_THRESHOLD)
+            Sigmoid value from which a pixel counts as lung.
+
+        color : tuple, optional (default=OVERLAY_COLOR)
+            BGR color painted over the lung region.
+
+        alpha : float, optional (default=OVERLAY_ALPHA)
+            Weight of the color in the blend.
+        """
+        self.threshold: float = threshold
+        """float: Sigmoid value from which a pixel counts as lung."""
+
+        self.color: tuple = tuple(color)
+        """tuple: BGR color painted over the lung region."""
+
+        self.alpha: float = alpha
+        """float: Weight of the color in the blend."""
+
+        self._lut = None
+        self._colormap = None
+
+    @property
+    def lut(self):
+        """
+        np.ndarray: Uint8 table of shape (512, 3); row bit * 256 + v is the blended
+        BGR pixel for source intensity v outside (bit 0) or inside (bit 1) the mask.
+        """
+        if self._lut is None:
+            levels = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)[None]
+            painted = np.broadcast_to(np.array(self.color, dtype=np.uint8), levels.shape).copy()
+            self._lut = np.concatenate([
+                cv2.addWeighted(levels, 1 - self.alpha, np.zeros_like(levels), self.alpha, 0),
+                cv2.addWeighted(levels, 1 - self.alpha, painted, self.alpha, 0)]).reshape(512, 3)
+        return self._lut
+
+    @property
+    def colormap(self):
+        """
+        np.ndarray: Uint8 RGB table of shape (256, 3) of the JET colormap used for heatmaps.
+        """
+        if self._colormap is None:
+            levels = np.arange(256, dtype=np.uint8)[:, None]
+            self._colormap = cv2.cvtColor(cv2.applyColorMap(levels, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)[:, 0]
+        return self._colormap
+
+    @staticmethod
+    def squeeze(masks):
+        """
+        Drops the trailing channel axis of masks shaped (..., H, W, 1).
+        """
+        return masks[..., 0] if masks.ndim >= 3 and masks.shape[-1] == 1 else masks
+
+    def binarize(self, masks, out=None):
+        """
+        Thresholds masks into lung / background.
+
+        Parameters:
+        -----------
+        masks : np.ndarray
+            Raw sigmoid masks (float, shape (..., H, W) or (..., H, W, 1)) or
+            uint8 display masks from `toMask`.
+
+        out : np.ndarray, optional
+            Bool array of shape (..., H, W) to write into.
+
+        Returns:
+        --------
+        np.ndarray
+            Bool masks of shape (..., H, W).
+        """
+        masks = self.squeeze(masks)
+        if masks.dtype == np.uint8:
+            return np.greater_equal(masks, max(1, int(np.ceil(self.threshold * 255))), out=out)
+        return np.greater_equal(masks, np.float32(self.threshold), out=out)
+
+    @staticmethod
+    def areaFraction(binary):
+        """
+        Returns the fraction of each mask covered by lung, a float or an array
+        with the leading dimensions of `binary`.
+        """
+        return np.count_nonzero(binary, axis=(-2, -1)) / (binary.shape[-2] * binary.shape[-1])
+
+    def toMask(self, masks, out=None):
+        """
+        Scales raw sigmoid masks into single-channel uint8 display masks.
+
+        Parameters:
+        -----------
+        masks : np.ndarray
+            Raw sigmoid masks, shape (..., H, W) or (..., H, W, 1).
+
+        out : np.ndarray, optional
+            Uint8 array of shape (..., H, W) to write into.
+
+        Returns:
+        --------
+        np.ndarray
+            Uint8 masks of shape (..., H, W) with values in [0, 255].
+        """
+        masks = self.squeeze(masks)
+        if out is None:
+            out = np.empty(masks.shape, dtype=np.uint8)
+
+        # Truncating cast, as astype(np.uint8), in the same pass as the scaling
+        return np.multiply(masks, np.float32(255), out=out, casting='unsafe')
+
+    def overlay(self, images, binary):
+        """
+        Blends the mask color over the lung region of each image.
+
+        Parameters:
+        -----------
+        images : np.ndarray
+            Uint8 source images, grayscale (..., H, W) or BGR (..., H, W, 3).
+
+        binary : np.ndarray
+            Bool masks of shape (..., H, W) from `binarize`.
+
+        Returns:
+        --------
+        np.ndarray
+            Uint8 BGR overlays of shape (..., H, W, 3).
+        """
+        index = np.left_shift(binary.view(np.uint8), 8, dtype=np.uint16)
+        if images.ndim == binary.ndim:
+            # One gather of whole BGR rows per pixel
+            index |= images
+            return np.take(self.lut, index, axis=0)
+
+        index = index[..., None] | images
+        out = np.empty(images.shape, dtype=np.uint8)
+        for channel in range(3):
+            np.take(self.lut[:, channel], index[..., channel], out=out[..., channel])
+        return out
+
+    def heatmap(self, images, maps, alpha=HEATMAP_ALPHA):
+        """
+        Blends a JET rendering of explanation maps over the images.
+
+        Parameters:
+        -----------
+        images : np.ndarray
+            Uint8 source images, grayscale (..., H, W) or 3-channel (..., H, W, 3).
+
+        maps : np.ndarray
+            Float maps in [0, 1] of shape (..., H, W).
+
+        alpha : float, optional (default=HEATMAP_ALPHA)
+            Weight of the heatmap colors in the blend.
+
+        Returns:
+        --------
+        np.ndarray
+            Uint8 RGB images of shape (..., H, W, 3).
+        """
+        levels = np.multiply(np.clip(maps, 0, 1), np.float32(255), dtype=np.float32).astype(np.uint8)
+        colors = np.take(self.colormap, levels, axis=0)
+        if images.ndim == levels.ndim:
+            images = images[..., None]
+
+        blend = images * np.float32(1 - alpha) + colors * np.float32(alpha) + np.float32(0.5)
+        return blend.astype(np.uint8)
+
+    def apply(self, images, masks):
+        """
+        Runs the whole postprocessing stage on an image or a batch.
+
+        Parameters:
+        -----------
+        images : np.ndarray
+            Uint8 source images, grayscale (..., H, W) or BGR (..., H, W, 3).
+
+        masks : np.ndarray
+            Raw sigmoid masks, shape (..., H, W) or (..., H, W, 1).
+
+        Returns:
+        --------
+        tuple
+            (displayMasks, fractions, overlays) as returned by `toMask`,
+            `areaFraction` and `overlay`.
+        """
+        binary = self.binarize(masks)
+        return self.toMask(masks), self.areaFraction(binary), self.overlay(images, binary)
@@ -0,0 +1,303 @@
+from common_libs import io, np, cv2
+from common_libs import DECODE_WINDOW, REDUCED_DECODE
+
+class Preprocessor:
+    """
+    Converts chest X-ray images into the float32 input tensor shared by the
+    segmentation and classification models.
+
+    Files are decoded straight to a model-sized image: 8-bit images are decoded
+    at a reduced resolution when they are at least twice the model size (JPEG
+    scales during decompression), and 16-bit PNG/TIFF images are windowed to 8
+    bits instead of having their low byte truncated. The remaining resize is
+    bilinear, like the training notebook and the original GUI path: grayscale
+    decodes match the training inputs, and BGR decodes (for display) are resized
+    in colour and converted to grayscale afterwards, like `loadInsight` did. With
+    `reduced` off the model inputs are identical to those paths; with it on they
+    differ by the reduced decode's prefiltering, measured by `python main.py parity`.
+
+    Each image is resized (only if needed), converted to grayscale (only if it
+    has colour channels) and scaled to [0, 1] directly into a float32 buffer, so
+    no float64 temporaries are created and Keras receives its native dtype.
+
+    Attributes:
+    -----------
+    size : tuple
+        Target (width, height) expected by the models.
+
+    window : tuple
+        Low and high intensity percentiles mapped to 0 and 255 for high bit depth images.
+
+    reduced : bool
+        Decode large 8-bit images at 1/2, 1/4 or 1/8 resolution.
+    """
+
+    REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+                     (4, cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+                     (2, cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2))
+    """tuple: (factor, grayscale flag, colour flag) of the OpenCV reduced decode modes, largest first."""
+
+    def __init__(self, size=(512, 512), window=DECODE_WINDOW, reduced=REDUCED_DECODE):
+        """
+        Initializes the preprocessor.
+
+        Parameters:
+        -----------
+        size : tuple, optional (default=(512, 512))
+            Target (width, height) expected by the models.
+
+        window : tuple, optional (default=DECODE_WINDOW)
+            Low and high intensity percentiles mapped to 0 and 255 for high bit depth images.
+
+        reduced : bool, optional (default=REDUCED_DECODE)
+            Decode large 8-bit images at 1/2, 1/4 or 1/8 resolution.
+        """
+        self.size: tuple = size
+        """tuple: Target (width, height) expected by the models."""
+
+        self.window: tuple = window
+        """tuple: Low and high intensity percentiles mapped to 0 and 255 for high bit depth images."""
+
+        self.reduced: bool = reduced
+        """bool: Decode large 8-bit images at 1/2, 1/4 or 1/8 resolution."""
+
+    @staticmethod
+    def probe(source):
+        """
+        Reads an image header without decoding the pixels.
+
+        Parameters:
+        -----------
+        source : str or bytes
+            Image path or encoded image bytes.
+
+        Returns:
+        --------
+        tuple
+            (width, height, high_depth), or (None, None, False) if the header is not understood.
+        """
+        from common_libs import Image
+
+        try:
+            with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as im:
+                # 16-bit colour PNGs open as 'RGB' but keep their 16-bit raw mode
+                high_depth = im.mode.startswith('I') or im.mode == 'F' or ';16' in repr(im.tile[:1])
+                return im.width, im.height, high_depth
+        except Exception:
+            return None, None, False
+
+    @staticmethod
+    def read(source, flags):
+        """
+        Decodes an image path or encoded bytes with OpenCV, or returns None if unreadable.
+        """
+        if isinstance(source, bytes):
+            return cv2.imdecode(np.frombuffer(source, np.uint8), flags) if source else None
+        return cv2.imread(source, flags)
+
+    def decode(self, source, bgr=False):
+        """
+        Decodes an image file into a model-sized 8-bit image by the cheapest route.
+
+        Workflow:
+        - `load`: read the header to get the size and bit depth, then decode.
+          8-bit images are decoded as grayscale (or BGR), reduced by the largest
+          factor of 8, 4 or 2 that keeps both sides at least the model size;
+          16-bit or float images at full depth.
+        - `fit`: resize the remainder bilinearly, as the models were trained,
+          and window high bit depth images to 8 bits.
+
+        Parameters:
+        -----------
+        source : str or bytes
+            Image path or encoded image bytes.
+
+        bgr : bool, optional (default=False)
+            Decode to a 3-channel BGR image (for display and overlays) instead of grayscale.
+
+        Returns:
+        --------
+        np.ndarray or None
+            uint8 image of the model size, or None if the image cannot be read.
+        """
+        img = self.load(source, bgr)
+        return None if img is None else self.fit(img, bgr)
+
+    def load(self, source, bgr=False):
+        """
+        Decodes an image file at the smallest resolution `fit` can resize from.
+
+        Parameters:
+        -----------
+        source : str or bytes
+            Image path or encoded image bytes.
+
+        bgr : bool, optional (default=False)
+            Decode 8-bit images in colour instead of grayscale.
+
+        Returns:
+        --------
+        np.ndarray or None
+            Decoded image, at least the model size when the source is, or None if
+            the image cannot be read. High bit depth images stay grayscale and
+            keep their depth.
+        """
+        width, height, high_depth = self.probe(source)
+
+        if high_depth:
+            return self.read(source, cv2.IMREAD_GRAYSCALE | cv2.IMREAD_ANYDEPTH)
+
+        flags = cv2.IMREAD_COLOR if bgr else cv2.IMREAD_GRAYSCALE
+        if self.reduced and width is not None:
+            for factor, gray, color in self.REDUCED_FLAGS:
+                if width // factor >= self.size[0] and height // factor >= self.size[1]:
+                    flags = color if bgr else gray
+                    break
+        return self.read(source, flags)
+
+    def fit(self, img, bgr=False):
+        """
+        Resizes a loaded image to the model size and brings it to 8 bits.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Image returned by `load`.
+
+        bgr : bool, optional (default=False)
+            Return a 3-channel BGR image.
+
+        Returns:
+        --------
+        np.ndarray
+            uint8 image of the model size.
+        """
+        if img.shape[1] != self.size[0] or img.shape[0] != self.size[1]:
+            img = cv2.resize(img, self.size)
+
+        if img.dtype != np.uint8:
+            img = self.toUint8(img)
+
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if bgr and img.ndim == 2 else img
+
+    def toUint8(self, img):
+        """
+        Windows a high bit depth grayscale image to 8 bits.
+
+        Intensities between the `window` percentiles are stretched linearly to
+        [0, 255], so 12-bit data stored in 16-bit files keeps its contrast.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Grayscale uint16, int32 or float image.
+
+        Returns:
+        --------
+        np.ndarray
+            Grayscale uint8 image.
+        """
+        low, high = np.percentile(img, self.window)
+        if high <= low:
+            high = low + 1
+
+        scaled = (img.astype(np.float32) - np.float32(low)) * np.float32(255.0 / (high - low))
+
+        return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+    def allocate(self, batch_size):
+        """
+        Allocates an uninitialized input buffer for a batch of images.
+
+        Parameters:
+        -----------
+        batch_size : int
+            Number of images the buffer can hold.
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 array of shape (batch_size, height, width, 1).
+        """
+        return np.empty((batch_size, self.size[1], self.size[0], 1), dtype=np.float32)
+
+    def toGray(self, img):
+        """
+        Resizes an image to the model size and converts it to grayscale,
+        skipping each step when it is not needed.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Input image, either BGR (OpenCV format) or single-channel grayscale.
+
+        Returns:
+        --------
+        np.ndarray
+            Grayscale uint8 image of the model size.
+        """
+        if img.ndim == 3 and img.shape[2] == 1:
+            img = img[:, :, 0]
+
+        # Resize before converting, in the order of the original GUI path; decoded images are already model-sized
+        if img.shape[1] != self.size[0] or img.shape[0] != self.size[1]:
+            img = cv2.resize(img, self.size)
+
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+        return img
+
+    def toTensor(self, img, out=None):
+        """
+        Produces the normalized float32 input tensor for a single image.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Input image, BGR or grayscale.
+
+        out : np.ndarray, optional
+            Float32 array of shape (height, width, 1) to write into, e.g. one
+            slot of a buffer returned by `allocate`. A new array is created if omitted.
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 tensor of shape (height, width, 1) with values in [0, 1].
+        """
+        if out is None:
+            out = np.empty((self.size[1], self.size[0], 1), dtype=np.float32)
+
+        # Normalize to [0, 1] straight into the float32 buffer
+        np.divide(self.toGray(img), np.float32(255.0), out=out[:, :, 0], dtype=np.float32)
+
+        return out
+
+    def toBatch(self, imgs, out=None):
+        """
+        Stacks several images into one model input batch.
+
+        Parameters:
+        -----------
+        imgs : list of np.ndarray
+            Input images, BGR or grayscale.
+
+        out : np.ndarray, optional
+            Preallocated buffer from `allocate` with at least len(imgs) slots.
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 batch of shape (len(imgs), height, width, 1). When `out` is
+            given, this is a view of its first len(imgs) slots.
+        """
+        if out is None:
+            out = self.allocate(len(imgs))
+        elif len(out) < len(imgs):
+            raise ValueError(f'Buffer holds {len(out)} images, got {len(imgs)}')
+
+        for i, img in enumerate(imgs):
+            self.toTensor(img, out=out[i])
+
+        return out[:len(imgs)]
@@ -0,0 +1,193 @@
+from common_libs import np, cv2
+from common_libs import dice_coefficient, jaccard_index
+from common_libs import COMPILED_INFERENCE, PREVIEW_SIZE
+import model.SegmentationModel as sm
+import model.InferenceBackend as ib
+import instrumentation as ins
+
+class PreviewModel:
+    """
+    Low-resolution copy of the fused model for quick first results.
+
+    Both networks are fully convolutional up to the classifier's global pooling,
+    so the fused graph is rebuilt for a smaller input with the same layers and
+    weights. Inputs are downscaled to `size` before the call and the masks are
+    scaled back up, so the model is a drop-in for FusedModel: same input batch,
+    same outputs. At 256x256 a call does a quarter of the work of the 512x512
+    pass. The preview is an approximation; `agreement` measures it against the
+    full-resolution result with the Dice and Jaccard metrics of training.
+
+    Attributes:
+    -----------
+    size : tuple
+        (width, height) the inputs are downscaled to.
+
+    preprocessor : Preprocessor
+        Full-size input preprocessor, shared with the fused model.
+
+    model : keras.Model
+        Fused graph rebuilt for `size` inputs.
+
+    backend : KerasBackend
+        Runtime executing the rebuilt graph.
+    """
+
+    def __init__(self, fusedModel, size=PREVIEW_SIZE, compiled=COMPILED_INFERENCE):
+        """
+        Rebuilds the fused graph for preview-sized inputs.
+
+        Parameters:
+        -----------
+        fusedModel : FusedModel
+            Loaded fused model; must be running the fused Keras graph.
+
+        size : int or tuple, optional (default=PREVIEW_SIZE)
+            Preview input size in pixels, or (width, height).
+
+        compiled : bool, optional (default=COMPILED_INFERENCE)
+            Run inference through a compiled tf.function instead of `Model.predict`.
+        """
+        if fusedModel.model is None:
+            raise ValueError('The preview needs the fused Keras model')
+
+        self.size: tuple = (size, size) if isinstance(size, int) else tuple(size)
+        """tuple: (width, height) the inputs are downscaled to."""
+
+        self.preprocessor = fusedModel.preprocessor
+        """Preprocessor: Full-size input preprocessor, shared with the fused model."""
+
+        self.model = self.buildResized(fusedModel.model, self.size)
+        """keras.Model: Fused graph rebuilt for `size` inputs."""
+
+        self.backend: ib.KerasBackend = ib.KerasBackend(self.model, compiled)
+        """KerasBackend: Runtime executing the rebuilt graph."""
+
+    @staticmethod
+    def buildResized(model, size):
+        """
+        Rebuilds a model, including nested sub-models, for another input size.
+
+        Parameters:
+        -----------
+        model : keras.Model
+            Fully convolutional (up to global pooling) model.
+
+        size : tuple
+            (width, height) of the new input.
+
+        Returns:
+        --------
+        keras.Model
+            New model with the same layers and weights taking (N, height, width, C) inputs.
+        """
+        from common_libs import keras
+
+        def resize(node):
+            if isinstance(node, dict):
+                if node.get('class_name') == 'InputLayer':
+                    # Keras 3 names the shape `batch_shape`, tf.keras 2 `batch_input_shape`
+                    key = 'batch_shape' if 'batch_shape' in node['config'] else 'batch_input_shape'
+                    shape = node['config'][key]
+                    node['config'][key] = [shape[0], size[1], size[0]] + list(shape[3:])
+                for value in node.values():
+                    resize(value)
+            elif isinstance(node, list):
+                for value in node:
+                    resize(value)
+
+        config = model.get_config()
+        resize(config)
+        resized = keras.Model.from_config(config)
+        resized.set_weights(model.get_weights())
+        return resized
+
+    def predictTensor(self, x):
+        """
+        Runs the preview on a full-size input batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1) produced by Preprocessor.
+
+        Returns:
+        --------
+        tuple
+            (masks, probs): raw sigmoid masks scaled back to shape (N, 512, 512, 1)
+            and TB probabilities of shape (N,).
+        """
+        height, width = x.shape[1:3]
+        small = np.empty((len(x), self.size[1], self.size[0], 1), dtype=np.float32)
+        for image, out in zip(x, small):
+            out[..., 0] = cv2.resize(image[..., 0], self.size, interpolation=cv2.INTER_AREA)
+
+        outputs = self.backend(small)
+
+        masks = np.empty(x.shape, dtype=np.float32)
+        for mask, out in zip(outputs[0], masks):
+            out[..., 0] = cv2.resize(mask[..., 0], (width, height), interpolation=cv2.INTER_LINEAR)
+
+        return masks, outputs[1].reshape(-1)
+
+    def predict(self, img):
+        """
+        Predicts a preview lung mask and TB probability for one image.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Input BGR image (OpenCV format).
+
+        Returns:
+        --------
+        tuple
+            (pred_mask, tb) where pred_mask is a full-size RGB uint8 mask image and tb
+            is the preview TB probability.
+        """
+        with ins.stage('preview.preprocess'):
+            x = self.preprocessor.toBatch([img])
+
+        with ins.stage('preview.infer'):
+            pred_mask, tb = self.predictTensor(x)
+
+        with ins.stage('preview.postprocess'):
+            return sm.SegmentationModel.postprocess(pred_mask), np.squeeze(tb)
+
+    @staticmethod
+    def agreement(full, preview, postprocessor=None):
+        """
+        Scores a preview mask against the full-resolution mask.
+
+        Parameters:
+        -----------
+        full : np.ndarray
+            Full-resolution mask, raw sigmoid or uint8 display mask (RGB or single channel).
+
+        preview : np.ndarray
+            Preview mask of the same size and kind.
+
+        postprocessor : Postprocessor, optional
+            Thresholds the masks. Defaults to the shared display postprocessor.
+
+        Returns:
+        --------
+        dict
+            'dice' and 'jaccard' from `common_libs.dice_coefficient` and
+            `common_libs.jaccard_index` on the binarized masks.
+        """
+        postprocessor = postprocessor or sm.SegmentationModel.postprocessor
+
+        def binarize(mask):
+            mask = np.asarray(mask)
+            if mask.ndim == 3 and mask.shape[-1] == 3:
+                mask = mask[..., 0]
+            return postprocessor.binarize(mask).astype(np.float32)
+
+        full, preview = binarize(full), binarize(preview)
+        return {'dice': float(dice_coefficient(full, preview)), 'jaccard': float(jaccard_index(full, preview))}
+
+    def warmup(self):
+        """
+        Runs one dummy batch so the first preview does not pay for graph tracing.
+        """
+        self.backend.warmup()
@@ -0,0 +1,152 @@
+from common_libs import os, json, time, sqlite3
+
+class ProcessedManifest:
+    """
+    SQLite record of the files already scored, for incremental watch-folder runs.
+
+    Every scored file is stored with its size, mtime, content hash, the
+    fingerprint of the models that scored it and its output record. A file is
+    known when a row for the current model fingerprint matches its path, size
+    and mtime; identical content under another name is found by hash. Rows are
+    committed once their output has been written, in one transaction per batch,
+    so a crash or restart loses at most the batch in flight and never skips an
+    unscored file. A model update changes the fingerprint, so files are scored
+    again by the new models.
+
+    Files that could not be read or decoded are kept apart, in the `failed`
+    table, with the number of attempts on their current version; the caller
+    retries them until a limit and a new version of the file starts over.
+
+    Attributes:
+    -----------
+    path : str
+        SQLite database file.
+
+    fingerprint : str
+        Fingerprint of the current model files.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS processed ('
+        ' path TEXT NOT NULL, fingerprint TEXT NOT NULL, hash TEXT NOT NULL,'
+        ' size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, processed_at REAL NOT NULL, record TEXT NOT NULL,'
+        ' PRIMARY KEY (path, fingerprint))',
+        'CREATE INDEX IF NOT EXISTS processed_hash ON processed (hash, fingerprint)',
+        'CREATE TABLE IF NOT EXISTS failed ('
+        ' path TEXT NOT NULL, fingerprint TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+        ' attempts INTEGER NOT NULL, failed_at REAL NOT NULL, error TEXT NOT NULL,'
+        ' PRIMARY KEY (path, fingerprint))',
+    )
+    """tuple: Statements creating the tables and the hash index."""
+
+    def __init__(self, path, fingerprint):
+        """
+        Opens the manifest, creating it if needed.
+
+        Parameters:
+        -----------
+        path : str
+            SQLite database file.
+
+        fingerprint : str
+            Fingerprint of the current model files.
+        """
+        self.path: str = path
+        """str: SQLite database file."""
+
+        self.fingerprint: str = fingerprint
+        """str: Fingerprint of the current model files."""
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path)
+        # Write-ahead logging keeps committed batches safe without a full fsync per row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        """
+        Returns the number of files scored by the current models.
+        """
+        return self._db.execute('SELECT COUNT(*) FROM processed WHERE fingerprint = ?',
+                                (self.fingerprint,)).fetchone()[0]
+
+    def contains(self, path, size, mtime_ns):
+        """
+        Returns True if this exact version of `path` was scored by the current models.
+        """
+        row = self._db.execute('SELECT 1 FROM processed WHERE path = ? AND fingerprint = ? AND size = ? '
+                               'AND mtime_ns = ?', (path, self.fingerprint, size, mtime_ns)).fetchone()
+        return row is not None
+
+    def lookupHash(self, digest):
+        """
+        Returns the output record of content already scored by the current models, or None.
+        """
+        row = self._db.execute('SELECT record FROM processed WHERE hash = ? AND fingerprint = ? LIMIT 1',
+                               (digest, self.fingerprint)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def attempts(self, path, size, mtime_ns):
+        """
+        Returns how often this exact version of `path` failed under the current models.
+        """
+        row = self._db.execute('SELECT attempts FROM failed WHERE path = ? AND fingerprint = ? AND size = ? '
+                               'AND mtime_ns = ?', (path, self.fingerprint, size, mtime_ns)).fetchone()
+        return 0 if row is None else row[0]
+
+    def add(self, entries):
+        """
+        Records scored files in one transaction, clearing their failures.
+
+        Parameters:
+        -----------
+        entries : list of tuple
+            (path, hash, size, mtime_ns, record) per file; a rescored path replaces its row.
+        """
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO processed (path, fingerprint, hash, size, mtime_ns, processed_at, record) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(path, self.fingerprint, digest, size, mtime_ns, now, json.dumps(record))
+                 for path, digest, size, mtime_ns, record in entries])
+            self._db.executemany('DELETE FROM failed WHERE path = ? AND fingerprint = ?',
+                                 [(path, self.fingerprint) for path, *_ in entries])
+
+    def addFailures(self, entries):
+        """
+        Records failed attempts in one transaction.
+
+        Parameters:
+        -----------
+        entries : list of tuple
+            (path, size, mtime_ns, error) per file. A failure of the same version
+            adds one attempt; a new version of the file starts again at one.
+        """
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                'INSERT INTO failed (path, fingerprint, size, mtime_ns, attempts, failed_at, error) '
+                'VALUES (?, ?, ?, ?, 1, ?, ?) ON CONFLICT (path, fingerprint) DO UPDATE SET '
+                ' attempts = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns'
+                '  THEN attempts + 1 ELSE 1 END,'
+                ' size = excluded.size, mtime_ns = excluded.mtime_ns, failed_at = excluded.failed_at,'
+                ' error = excluded.error',
+                [(path, self.fingerprint, size, mtime_ns, now, str(error)) for path, size, mtime_ns, error in entries])
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self._db.close()
@@ -0,0 +1,261 @@
+from common_libs import os, hashlib, threading, np, OrderedDict
+
+class ResultCache:
+    """
+    Content-addressed cache of segmentation/classification results.
+
+    Entries are keyed by a hash of the model input pixels combined with a
+    fingerprint (path, mtime, size) of every model file, so a re-uploaded film
+    is served without inference and any model update invalidates old results.
+    Results live in an in-memory LRU tier and, optionally, in an on-disk tier
+    holding the mask as compressed uint8 plus the probability. Both tiers are
+    bounded by size in bytes.
+
+    Attributes:
+    -----------
+    modelPaths : tuple
+        Model files whose fingerprint is part of every key.
+
+    maxMemoryBytes : int
+        Size bound of the in-memory tier.
+
+    cacheDir : str or None
+        Directory of the on-disk tier, or None to disable it.
+
+    maxDiskBytes : int
+        Size bound of the on-disk tier.
+    """
+
+    def __init__(self, modelPaths, maxMemoryMB=256, cacheDir=None, maxDiskMB=2048):
+        """
+        Initializes the cache and indexes any existing on-disk entries.
+
+        Parameters:
+        -----------
+        modelPaths : list of str
+            Model files whose fingerprint is part of every key.
+
+        maxMemoryMB : int, optional (default=256)
+            Size bound of the in-memory tier in megabytes.
+
+        cacheDir : str, optional
+            Directory of the on-disk tier. Disabled when omitted.
+
+        maxDiskMB : int, optional (default=2048)
+            Size bound of the on-disk tier in megabytes.
+        """
+        self.modelPaths: tuple = tuple(modelPaths)
+        """tuple: Model files whose fingerprint is part of every key."""
+
+        self.maxMemoryBytes: int = int(maxMemoryMB * 1024 * 1024)
+        """int: Size bound of the in-memory tier."""
+
+        self.cacheDir: str = cacheDir
+        """str: Directory of the on-disk tier, or None to disable it."""
+
+        self.maxDiskBytes: int = int(maxDiskMB * 1024 * 1024)
+        """int: Size bound of the on-disk tier."""
+
+        self._memory = OrderedDict()
+        self._memoryBytes = 0
+        self._disk = OrderedDict()
+        self._diskBytes = 0
+        self._lock = threading.Lock()
+        self._fingerprint = self.fingerprint()
+
+        if self.cacheDir:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self._indexDisk()
+
+    def fingerprint(self):
+        """
+        Computes the combined fingerprint of the model files.
+
+        Returns:
+        --------
+        str
+            Hex digest over each file's path, mtime and size.
+        """
+        return self.modelFingerprint(self.modelPaths)
+
+    @staticmethod
+    def modelFingerprint(modelPaths):
+        """
+        Computes the combined fingerprint of the given model files, as used in cache keys.
+
+        Parameters:
+        -----------
+        modelPaths : iterable of str
+            Model files.
+
+        Returns:
+        --------
+        str
+            Hex digest over each file's path, mtime and size.
+        """
+        h = hashlib.blake2b(digest_size=8)
+        for path in modelPaths:
+            try:
+                st = os.stat(path)
+                h.update(f'{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size};'.encode())
+            except OSError:
+                h.update(f'{path}|missing;'.encode())
+        return h.hexdigest()
+
+    def key(self, img):
+        """
+        Builds the cache key for a model input image.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Image exactly as passed to the model (e.g. the 512x512 BGR image).
+
+        Returns:
+        --------
+        str
+            Hex key combining the pixel hash and the model fingerprint.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{img.shape}|{img.dtype}|{self._fingerprint}'.encode())
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+
+    def _refresh(self):
+        """
+        Drops all in-memory entries when a model file has changed. Stale disk
+        entries simply stop matching and age out through eviction.
+        """
+        fingerprint = self.fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._memory.clear()
+            self._memoryBytes = 0
+
+    def get(self, img):
+        """
+        Looks up the cached result for an image.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Image exactly as passed to the model.
+
+        Returns:
+        --------
+        tuple or None
+            (mask, tb) with mask as a single-channel uint8 image, or None on a miss.
+        """
+        with self._lock:
+            self._refresh()
+            key = self.key(img)
+
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if key in self._disk:
+                path = self._diskPath(key)
+                try:
+                    with np.load(path) as data:
+                        entry = (data['mask'], float(data['tb']))
+                    os.utime(path)
+                except (OSError, KeyError, ValueError):
+                    self._dropDisk(key)
+                    return None
+                self._disk.move_to_end(key)
+                self._putMemory(key, entry)
+                return entry
+
+        return None
+
+    def put(self, img, mask, tb):
+        """
+        Stores the result for an image in both tiers.
+
+        Parameters:
+        -----------
+        img : np.ndarray
+            Image exactly as passed to the model.
+
+        mask : np.ndarray
+            Predicted mask, uint8; an RGB mask is reduced to one channel.
+
+        tb : float
+            Predicted TB probability.
+        """
+        if mask.ndim == 3:
+            mask = mask[:, :, 0]
+        entry = (np.array(mask, dtype=np.uint8), float(tb))
+
+        with self._lock:
+            self._refresh()
+            key = self.key(img)
+            self._putMemory(key, entry)
+
+            if self.cacheDir and key not in self._disk:
+                path = self._diskPath(key)
+                tmp = path + '.tmp.npz'
+                np.savez_compressed(tmp, mask=entry[0], tb=np.float32(entry[1]))
+                os.replace(tmp, path)
+                self._disk[key] = os.path.getsize(path)
+                self._diskBytes += self._disk[key]
+                while self._diskBytes > self.maxDiskBytes and len(self._disk) > 1:
+                    self._dropDisk(next(iter(self._disk)))
+
+    def clear(self):
+        """
+        Removes every entry from both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memoryBytes = 0
+            for key in list(self._disk):
+                self._dropDisk(key)
+
+    def _putMemory(self, key, entry):
+        """
+        Inserts an entry into the memory tier and evicts least recently used ones.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = entry
+        self._memoryBytes += entry[0].nbytes
+        while self._memoryBytes > self.maxMemoryBytes and len(self._memory) > 1:
+            _, (old_mask, _) = self._memory.popitem(last=False)
+            self._memoryBytes -= old_mask.nbytes
+
+    def _diskPath(self, key):
+        """
+        Returns the file path of an on-disk entry.
+        """
+        return os.path.join(self.cacheDir, key + '.npz')
+
+    def _dropDisk(self, key):
+        """
+        Deletes an on-disk entry and its accounting.
+        """
+        self._diskBytes -= self._disk.pop(key, 0)
+        try:
+            os.remove(self._diskPath(key))
+        except OSError:
+            pass
+
+    def _indexDisk(self):
+        """
+        Loads the existing on-disk entries, oldest access first, and enforces the size bound.
+        """
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.npz') or name.endswith('.tmp.npz'):
+                continue
+            st = os.stat(os.path.join(self.cacheDir, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._diskBytes += size
+
+        while self._diskBytes > self.maxDiskBytes and len(self._disk) > 1:
+            self._dropDisk(next(iter(self._disk)))
@@ -0,0 +1,279 @@
+from common_libs import os, time, threading, sqlite3, np
+
+class ResultsIndex:
+    """
+    Persistent store of scored cases with cosine similar-case search.
+
+    Every case keeps its classifier embedding, TB probability and lung area
+    fraction. Embeddings are L2-normalized and appended as float16 rows to one
+    matrix file per model fingerprint (embeddings of different models are not
+    comparable), and the metadata of each row goes into SQLite. The matrix is
+    held in memory, so a search is a chunked float32 matrix-vector product
+    followed by a partial sort: a few milliseconds for 100k cases, with the
+    float16 file at 64 bytes per case for the 32-value embeddings of the
+    current classifier.
+
+    A row is written to the matrix file before its metadata is committed; on
+    open the file is cut back to the committed rows, so a crash between the
+    two leaves no orphan embedding.
+
+    Attributes:
+    -----------
+    directory : str
+        Directory holding the SQLite database and the matrix files.
+
+    fingerprint : str
+        Fingerprint of the models whose embeddings are stored and searched.
+
+    dimension : int
+        Length of the embeddings.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS cases ('
+        ' fingerprint TEXT NOT NULL, row INTEGER NOT NULL, key TEXT NOT NULL, path TEXT NOT NULL,'
+        ' probability REAL NOT NULL, lung_fraction REAL, added_at REAL NOT NULL,'
+        ' PRIMARY KEY (fingerprint, row))',
+        'CREATE UNIQUE INDEX IF NOT EXISTS cases_key ON cases (fingerprint, key)',
+    )
+    """tuple: Statements creating the table and its key index."""
+
+    CHUNK_ROWS = 16384
+    """int: Rows converted to float32 and scored per step of a search."""
+
+    def __init__(self, directory, fingerprint, dimension):
+        """
+        Opens the index, creating it if needed, and loads the embedding matrix.
+
+        Parameters:
+        -----------
+        directory : str
+            Directory holding the SQLite database and the matrix files.
+
+        fingerprint : str
+            Fingerprint of the current models.
+
+        dimension : int
+            Length of the embeddings.
+        """
+        self.directory: str = directory
+        """str: Directory holding the SQLite database and the matrix files."""
+
+        self.fingerprint: str = fingerprint
+        """str: Fingerprint of the models whose embeddings are stored and searched."""
+
+        self.dimension: int = int(dimension)
+        """int: Length of the embeddings."""
+
+        # Owner-only: the index holds file paths and predictions of patient films
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+        count = self._db.execute('SELECT COUNT(*) FROM cases WHERE fingerprint = ?', (fingerprint,)).fetchone()[0]
+
+        # Rows beyond the committed count were appended by a run that died before committing
+        self._path = os.path.join(directory, f'embeddings-{fingerprint}-{self.dimension}.f16')
+        self._file = open(self._path, 'a+b')
+        row_bytes = self.dimension * 2
+        if os.path.getsize(self._path) > count * row_bytes:
+            self._file.truncate(count * row_bytes)
+        self._file.seek(0)
+        stored = np.fromfile(self._file, dtype=np.float16, count=count * self.dimension)
+        if len(stored) < count * self.dimension:
+            # Matrix file lost or cut short: forget the metadata of the missing rows
+            count = len(stored) // self.dimension
+            stored = stored[:count * self.dimension]
+            with self._db:
+                self._db.execute('DELETE FROM cases WHERE fingerprint = ? AND row >= ?', (fingerprint, count))
+
+        # Grown by doubling so appends stay amortized O(1)
+        self._matrix = np.empty((max(1024, count * 2), self.dimension), dtype=np.float16)
+        self._matrix[:count] = stored.reshape(count, self.dimension)
+        self._count = count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        """
+        Returns the number of cases searchable with the current models.
+        """
+        return self._count
+
+    @staticmethod
+    def normalize(vectors):
+        """
+        Returns float32 copies of `vectors` scaled to unit length along the last axis.
+        """
+        vectors = np.array(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def lookup(self, key):
+        """
+        Returns the row of an already indexed case, or None.
+
+        Parameters:
+        -----------
+        key : str
+            Content key of the case, e.g. `ResultCache.key` of its model input.
+
+        Returns:
+        --------
+        int or None
+            Row of the case in the embedding matrix.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT row FROM cases WHERE fingerprint = ? AND key = ?',
+                                   (self.fingerprint, key)).fetchone()
+        return None if row is None else row[0]
+
+    def embedding(self, row):
+        """
+        Returns the stored (unit length, float32) embedding of a row.
+        """
+        return self._matrix[row].astype(np.float32)
+
+    def add(self, key, path, embedding, probability, lungFraction=None):
+        """
+        Stores a case, unless a case with the same key is already indexed.
+
+        Parameters:
+        -----------
+        key : str
+            Content key of the case.
+
+        path : str
+            Source image path.
+
+        embedding : np.ndarray
+            Classifier embedding of shape (dimension,).
+
+        probability : float
+            Predicted TB probability.
+
+        lungFraction : float, optional
+            Fraction of the image covered by the predicted lung mask.
+
+        Returns:
+        --------
+        int
+            Row of the case in the embedding matrix.
+        """
+        vector = self.normalize(np.reshape(embedding, self.dimension)).astype(np.float16)
+
+        with self._lock:
+            row = self._db.execute('SELECT row FROM cases WHERE fingerprint = ? AND key = ?',
+                                   (self.fingerprint, key)).fetchone()
+            if row is not None:
+                return row[0]
+
+            row = self._count
+            if row == len(self._matrix):
+                grown = np.empty((len(self._matrix) * 2, self.dimension), dtype=np.float16)
+                grown[:row] = self._matrix[:row]
+                self._matrix = grown
+
+            # Appended (the file ends at the last committed row), before its metadata is committed
+            self._file.write(vector.tobytes())
+            self._file.flush()
+            with self._db:
+                self._db.execute(
+                    'INSERT INTO cases (fingerprint, row, key, path, probability, lung_fraction, added_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.fingerprint, row, key, os.path.abspath(path), float(probability),
+                     None if lungFraction is None else float(lungFraction), time.time()))
+
+            self._matrix[row] = vector
+            self._count = row + 1
+
+        return row
+
+    def scores(self, query):
+        """
+        Computes the cosine similarity of a query to every stored case.
+
+        Parameters:
+        -----------
+        query : np.ndarray
+            Embedding of shape (dimension,).
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 similarities of shape (len(self),).
+        """
+        query = self.normalize(np.reshape(query, self.dimension))
+        matrix, count = self._matrix, self._count
+        out = np.empty(count, dtype=np.float32)
+        chunk = np.empty((min(self.CHUNK_ROWS, count), self.dimension), dtype=np.float32)
+
+        # float16 matmul is slow in NumPy: widen a cache-sized chunk at a time instead
+        for start in range(0, count, self.CHUNK_ROWS):
+            stop = min(start + self.CHUNK_ROWS, count)
+            block = chunk[:stop - start]
+            block[:] = matrix[start:stop]
+            np.matmul(block, query, out=out[start:stop])
+
+        return out
+
+    def search(self, query, k=5, exclude=None):
+        """
+        Finds the stored cases most similar to a query embedding.
+
+        Parameters:
+        -----------
+        query : np.ndarray
+            Embedding of shape (dimension,).
+
+        k : int, optional (default=5)
+            Number of cases returned.
+
+        exclude : int, optional
+            Row left out of the results, e.g. the query case itself.
+
+        Returns:
+        --------
+        list of dict
+            Up to `k` cases, most similar first, each with its 'path', 'probability',
+            'lung_fraction', 'added_at', 'row' and cosine 'similarity'.
+        """
+        similarity = self.scores(query)
+        if exclude is not None and exclude < len(similarity):
+            similarity[exclude] = -np.inf
+
+        k = min(k, len(similarity) - (exclude is not None and exclude < len(similarity)))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(similarity, -k)[-k:]
+        top = top[np.argsort(similarity[top])[::-1]]
+
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT row, path, probability, lung_fraction, added_at FROM cases '
+                f'WHERE fingerprint = ? AND row IN ({",".join("?" * len(top))})',
+                (self.fingerprint, *map(int, top))).fetchall()
+        meta = {row[0]: row for row in rows}
+
+        return [{'row': int(row), 'path': meta[row][1], 'probability': meta[row][2], 'lung_fraction': meta[row][3],
+                 'added_at': meta[row][4], 'similarity': float(similarity[row])}
+                for row in top if row in meta]
+
+    def close(self):
+        """
+        Closes the matrix file and the database.
+        """
+        with self._lock:
+            self._file.close()
+            self._db.close()
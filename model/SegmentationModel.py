@@ -1,5 +1,14 @@
-from common_libs import np, cv2, keras
+from common_libs import np, cv2
 from common_libs import dice_coefficient, jaccard_index
+from common_libs import COMPILED_INFERENCE, XLA_JIT, OVERLAY_COLOR
+from common_libs import TYPE_CHECKING
+import model.Preprocessor as pp
+import model.Postprocessor as ps
+import model.InferenceBackend as ib
+import instrumentation as ins
+
+if TYPE_CHECKING:
+    from common_libs import keras
 
 class SegmentationModel:
     """
@@ -9,16 +18,28 @@ class SegmentationModel:
     Attributes:
     -----------
     path : str
-        Path to the Keras model file (.keras or .h5).
+        Path to the model file (.keras/.h5, or an exported .tflite/.onnx).
 
     customObj : dict
         Custom metrics dictionary required for loading the model.
 
-    model : keras.Model
-        Loaded Keras model ready for segmentation prediction.
+    model : keras.Model or None
+        Loaded Keras model ready for segmentation prediction, None for exported models.
+
+    preprocessor : Preprocessor
+        Converts input images into the float32 model input tensor.
+
+    backend : KerasBackend, TFLiteBackend or OnnxBackend
+        Runtime executing the model, chosen from the file extension.
+
+    postprocessor : Postprocessor
+        Shared thresholding, display mask and overlay stage.
     """
 
-    def __init__(self, path):
+    postprocessor = ps.Postprocessor()
+    """Postprocessor: Shared thresholding, display mask and overlay stage."""
+
+    def __init__(self, path, model=None, compiled=COMPILED_INFERENCE, jitCompile=XLA_JIT):
         """
         Loads the segmentation model from the specified path using custom metrics.
 
@@ -26,6 +47,16 @@ class SegmentationModel:
         -----------
         path : str
             File path to the trained Keras segmentation model.
+
+        model : keras.Model, optional
+            Already-loaded model for this path. Loaded from disk when omitted.
+
+        compiled : bool, optional (default=COMPILED_INFERENCE)
+            Keras models only: run inference through a compiled tf.function
+            instead of `Model.predict`.
+
+        jitCompile : bool, optional (default=XLA_JIT)
+            Keras models only: XLA JIT compile the tf.function.
         """
         self.path: str = path
         """str: Path to the saved Keras model file."""
@@ -36,18 +67,48 @@ class SegmentationModel:
         }
         """dict: Custom evaluation metrics used during model training."""
 
-        self.model: keras.Model = keras.models.load_model(self.path, custom_objects=self.customObj)
-        """keras.Model: The trained segmentation model loaded from disk."""
+        self.backend = ib.loadBackend(self.path, model, self.customObj, compiled, jitCompile)
+        """KerasBackend, TFLiteBackend or OnnxBackend: Runtime executing the model."""
+
+        self.model: keras.Model = self.backend.model
+        """keras.Model: The trained segmentation model loaded from disk, None for exported models."""
+
+        self.preprocessor: pp.Preprocessor = pp.Preprocessor()
+        """Preprocessor: Converts input images into the float32 model input tensor."""
+
+    @staticmethod
+    def findAttentionGates(unet):
+        """
+        Locates the attention-gate coefficient maps of an Attention U-Net.
+
+        Each gate of the training notebook (`attention_gate`) ends in a sigmoid
+        Activation producing one coefficient per pixel of its skip connection.
+
+        Parameters:
+        -----------
+        unet : keras.Model
+            Loaded segmentation model, standalone or nested in the classifier.
+
+        Returns:
+        --------
+        list
+            Output tensors of shape (N, h, w, 1) of the gates, coarsest first; empty
+            when the model has no attention gates.
+        """
+        from common_libs import keras
+
+        gates = [layer.output for layer in unet.layers
+                 if isinstance(layer, keras.layers.Activation) and layer.output.shape[-1] == 1
+                 and getattr(layer.activation, '__name__', '') == 'sigmoid'
+                 and layer.output is not unet.outputs[0]]
+        return sorted(gates, key=lambda tensor: tensor.shape[1])
 
     def predict(self, img):
         """
         Predicts a lung segmentation mask for the given chest X-ray image.
 
         Preprocessing:
-        - Resize to 512x512.
-        - Convert to grayscale.
-        - Normalize pixel values to [0, 1].
-        - Add batch dimension.
+        - Build a float32 batch of one with the shared Preprocessor.
 
         Postprocessing:
         - Squeeze out batch/channel dims.
@@ -64,40 +125,77 @@ class SegmentationModel:
         pred_mask : np.ndarray
             Predicted segmentation mask as an RGB image with uint8 values.
         """
-        # Resize and normalize input
-        img = cv2.resize(img, (512, 512))
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        img = img / 255.0
-        img = np.expand_dims(img, axis=0)
+        # Resize, convert and normalize input into a float32 batch of one
+        with ins.stage('segmentation.preprocess'):
+            x = self.preprocessor.toBatch([img])
 
         # Predict the mask
-        pred_mask = self.model.predict(img, verbose=0)
+        with ins.stage('segmentation.infer'):
+            pred_mask = self.predictTensor(x)
+
+        with ins.stage('segmentation.postprocess'):
+            return self.postprocess(pred_mask)
+
+    def predictTensor(self, x):
+        """
+        Runs the segmentation network on an already preprocessed input batch.
 
-        # Postprocess the prediction
-        pred_mask = (np.squeeze(pred_mask) * 255).astype(np.uint8)
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 batch of shape (N, 512, 512, 1) produced by Preprocessor.
+
+        Returns:
+        --------
+        np.ndarray
+            Raw sigmoid masks of shape (N, 512, 512, 1).
+        """
+        return self.backend(x)[0]
+
+    def warmup(self):
+        """
+        Runs the backend once so the first real prediction does not pay for
+        graph tracing or tensor allocation.
+        """
+        self.backend.warmup()
+
+    @staticmethod
+    def postprocess(pred_mask):
+        """
+        Converts a raw model output into a displayable mask image.
+
+        Parameters:
+        -----------
+        pred_mask : np.ndarray
+            Raw sigmoid output of the segmentation network, shape (1, 512, 512, 1).
+
+        Returns:
+        --------
+        np.ndarray
+            Mask as an RGB image with uint8 values.
+        """
+        pred_mask = SegmentationModel.postprocessor.toMask(np.squeeze(pred_mask))
         pred_mask = cv2.cvtColor(pred_mask, cv2.COLOR_GRAY2RGB)
 
         return pred_mask
 
     @staticmethod
-    def getColoredMask(image, mask_image, color=(255, 20, 255)):
+    def getColoredMask(image, mask_image, color=OVERLAY_COLOR):
         """
         Overlays a transparent colored segmentation mask on the input image
         to visualize segmented regions.
 
         Workflow:
-        - Convert mask to grayscale to create binary mask.
-        - Apply binary mask to extract relevant regions.
-        - Paint masked regions with a specified color.
-        - Blend the overlay with the original image.
+        - Threshold the mask into a binary lung mask.
+        - Blend the color into the masked pixels through the Postprocessor lookup table.
 
         Parameters:
         -----------
         image : np.ndarray
-            Original image in BGR format.
+            Original image in BGR or grayscale format.
 
         mask_image : np.ndarray
-            Segmentation mask image in RGB format (binary/grayscale-like).
+            Segmentation mask image in RGB or single-channel format (binary/grayscale-like).
 
         color : tuple, optional
             BGR color for mask overlay. Default is magenta (255, 20, 255).
@@ -107,19 +205,12 @@ class SegmentationModel:
         np.ndarray
             BGR image with the colored mask overlaid.
         """
-        # Convert mask to grayscale for binary masking
-        mask_image_gray = cv2.cvtColor(mask_image, cv2.COLOR_BGR2GRAY)
-
-        # Extract mask region using the grayscale mask
-        mask = cv2.bitwise_and(mask_image, mask_image, mask=mask_image_gray)
-
-        # Identify non-black pixels (mask region)
-        mask_coord = np.where(mask != [0, 0, 0])
-
-        # Paint those pixels with overlay color
-        mask[mask_coord[0], mask_coord[1], :] = color
+        postprocessor = SegmentationModel.postprocessor
+        if tuple(color) != postprocessor.color:
+            postprocessor = ps.Postprocessor(color=color)
 
-        # Blend original and colored mask
-        blended = cv2.addWeighted(image, 0.6, mask, 0.4, 0)
+        # RGB display masks are thresholded on their gray level
+        if mask_image.ndim == 3 and mask_image.shape[-1] == 3:
+            mask_image = cv2.cvtColor(mask_image, cv2.COLOR_BGR2GRAY)
 
-        return blended
+        return postprocessor.overlay(image, postprocessor.binarize(mask_image))
@@ -0,0 +1,366 @@
+from common_libs import os, io, csv, json, hashlib, threading, np, ThreadPoolExecutor
+import model.Preprocessor as pp
+
+class TensorStore:
+    """
+    Append-only, memory-mapped store of preprocessed model inputs.
+
+    Every source image is decoded once into its 512x512 grayscale model input and
+    appended as one row of a raw array file, stored either as uint8 pixels (exact,
+    normalized on read) or as float16 values in [0, 1]. An index maps each source
+    path to its row together with its size, mtime and content hash, so appends skip
+    unchanged files and identical content is stored once. Reads are views into the
+    memory map: a re-run over a cohort pages rows in from disk instead of decoding.
+
+    Layout of the store directory:
+    - meta.json: dtype and image size.
+    - inputs.bin: rows of shape (height, width, 1), back to back.
+    - index.csv: path, row, size, mtime_ns and hash of every indexed file.
+
+    Attributes:
+    -----------
+    directory : str
+        Store directory.
+
+    dtype : str
+        Row dtype, 'uint8' or 'float16'.
+
+    size : tuple
+        (width, height) of every row.
+
+    entries : dict
+        Index entry of each source path; later entries for a path replace earlier ones.
+
+    hashes : dict
+        Row holding each content hash.
+
+    preprocessor : Preprocessor
+        Decodes source images and defines the model input size.
+    """
+
+    DTYPES = {'uint8': np.uint8, 'float16': np.float16}
+    """dict: Supported row dtypes."""
+
+    FIELDS = ('path', 'row', 'size', 'mtime_ns', 'hash')
+    """tuple: Column order of the index."""
+
+    CHUNK = 64
+    """int: Images decoded per append step, bounding the memory held by pending rows."""
+
+    def __init__(self, directory, dtype='uint8', size=(512, 512)):
+        """
+        Opens the store in `directory`, creating it if needed.
+
+        Parameters:
+        -----------
+        directory : str
+            Store directory.
+
+        dtype : str, optional (default='uint8')
+            Row dtype for a new store, 'uint8' or 'float16'. An existing store keeps its own.
+
+        size : tuple, optional (default=(512, 512))
+            (width, height) of the rows of a new store.
+        """
+        self.directory: str = directory
+        """str: Store directory."""
+
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, 'meta.json')
+
+        if os.path.isfile(meta_path):
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+            dtype, size = meta['dtype'], tuple(meta['size'])
+        else:
+            if dtype not in self.DTYPES:
+                raise ValueError(f"Unsupported store dtype {dtype!r}, expected 'uint8' or 'float16'")
+            with open(meta_path, 'w') as fh:
+                json.dump({'dtype': dtype, 'size': list(size)}, fh)
+
+        self.dtype: str = dtype
+        """str: Row dtype, 'uint8' or 'float16'."""
+
+        self.size: tuple = size
+        """tuple: (width, height) of every row."""
+
+        self.entries: dict = {}
+        """dict: Index entry of each source path; later entries for a path replace earlier ones."""
+
+        self.hashes: dict = {}
+        """dict: Row holding each content hash."""
+
+        self.preprocessor: pp.Preprocessor = pp.Preprocessor(self.size)
+        """Preprocessor: Decodes source images and defines the model input size."""
+
+        self._dataPath = os.path.join(self.directory, 'inputs.bin')
+        self._indexPath = os.path.join(self.directory, 'index.csv')
+        self._rowShape = (self.size[1], self.size[0], 1)
+        self._rowBytes = int(np.prod(self._rowShape)) * np.dtype(self.DTYPES[self.dtype]).itemsize
+        self._data = None
+        self._lock = threading.Lock()
+
+        self._load()
+
+    @staticmethod
+    def isStore(path):
+        """
+        Returns True if `path` is a tensor store directory.
+        """
+        return bool(path) and os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def _load(self):
+        """
+        Reads the index and drops rows and index lines that a crash left partially
+        written or unindexed.
+        """
+        rows = os.path.getsize(self._dataPath) // self._rowBytes if os.path.isfile(self._dataPath) else 0
+
+        if os.path.isfile(self._indexPath):
+            with open(self._indexPath, 'r+b') as fh:
+                content = fh.read()
+                # Drop a last line cut short by a crash mid-write, so appends start on a fresh line
+                complete = content.rfind(b'\n') + 1
+                if complete != len(content):
+                    fh.truncate(complete)
+
+            for entry in csv.DictReader(io.StringIO(content[:complete].decode('utf-8'), newline='')):
+                try:
+                    entry['row'] = int(entry['row'])
+                    int(entry['size']), int(entry['mtime_ns'])
+                except (TypeError, ValueError):
+                    # Missing fields, e.g. a line spliced together with a cut-short one
+                    continue
+                if entry['hash'] and entry['row'] < rows:
+                    self.entries[entry['path']] = entry
+                    self.hashes[entry['hash']] = entry['row']
+
+        # Rows are written before their index lines, so anything past the last indexed row is garbage
+        count = max(self.hashes.values(), default=-1) + 1
+        if os.path.isfile(self._dataPath) and os.path.getsize(self._dataPath) != count * self._rowBytes:
+            with open(self._dataPath, 'r+b') as fh:
+                fh.truncate(count * self._rowBytes)
+
+    def __len__(self):
+        """
+        Returns the number of stored rows.
+        """
+        return len(self.hashes)
+
+    def __contains__(self, path):
+        """
+        Returns True if `path` is indexed.
+        """
+        return os.path.abspath(path) in self.entries
+
+    def paths(self):
+        """
+        Returns every indexed source path, in the order they were first added.
+        """
+        return list(self.entries)
+
+    def data(self):
+        """
+        Returns the read-only memory map of all rows, shape (rows, height, width, 1).
+        """
+        with self._lock:
+            if self._data is None or len(self._data) != len(self):
+                self._data = np.memmap(self._dataPath, dtype=self.DTYPES[self.dtype], mode='r',
+                                       shape=(len(self),) + self._rowShape) if len(self) else \
+                    np.empty((0,) + self._rowShape, dtype=self.DTYPES[self.dtype])
+            return self._data
+
+    def row(self, path):
+        """
+        Returns the row index of `path`, or None if it is not indexed.
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        return None if entry is None else entry['row']
+
+    def image(self, path):
+        """
+        Returns the stored grayscale uint8 image of `path`, or None if it is not indexed.
+
+        For a uint8 store this is a zero-copy view into the memory map.
+        """
+        row = self.row(path)
+        if row is None:
+            return None
+
+        stored = self.data()[row, :, :, 0]
+        if self.dtype == 'uint8':
+            return stored
+        return np.rint(stored.astype(np.float32) * 255).astype(np.uint8)
+
+    def toTensor(self, path, out=None):
+        """
+        Writes the normalized float32 model input of `path` straight from the memory map.
+
+        Parameters:
+        -----------
+        path : str
+            Indexed source path.
+
+        out : np.ndarray, optional
+            Float32 array of shape (height, width, 1) to write into.
+
+        Returns:
+        --------
+        np.ndarray or None
+            Float32 tensor with values in [0, 1], or None if `path` is not indexed.
+        """
+        row = self.row(path)
+        if row is None:
+            return None
+
+        if out is None:
+            out = np.empty(self._rowShape, dtype=np.float32)
+        self.normalize(self.data()[row], out)
+
+        return out
+
+    def batch(self, start=0, stop=None, out=None):
+        """
+        Returns rows `start` to `stop` as a float32 model input batch in one pass.
+
+        Parameters:
+        -----------
+        start : int, optional (default=0)
+            First row.
+
+        stop : int, optional
+            Row after the last one. Defaults to the end of the store.
+
+        out : np.ndarray, optional
+            Preallocated float32 buffer with at least `stop - start` slots.
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 batch of shape (stop - start, height, width, 1).
+        """
+        rows = self.data()[start:stop]
+        if out is None:
+            out = np.empty(rows.shape, dtype=np.float32)
+        elif len(out) < len(rows):
+            raise ValueError(f'Buffer holds {len(out)} images, got {len(rows)}')
+
+        self.normalize(rows, out[:len(rows)])
+
+        return out[:len(rows)]
+
+    def normalize(self, stored, out):
+        """
+        Converts stored rows into float32 model input values, writing into `out`.
+        """
+        if self.dtype == 'uint8':
+            np.divide(stored, np.float32(255.0), out=out, dtype=np.float32)
+        else:
+            np.copyto(out, stored)
+
+    def append(self, files, workers=None):
+        """
+        Adds source images to the store.
+
+        Unchanged files (same size and mtime) are skipped without being read. Files whose
+        content is already stored under another path are indexed against the existing
+        row. Everything else is decoded in parallel and appended.
+
+        Parameters:
+        -----------
+        files : iterable of str
+            Source image paths.
+
+        workers : int, optional
+            Decode threads. Defaults to the number of CPUs, capped at 8.
+
+        Returns:
+        --------
+        dict
+            Counts of 'added', 'reused', 'skipped' and 'failed' files, plus the
+            'errors' list of (path, message) for the failed ones.
+        """
+        summary = {'added': 0, 'reused': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+        pending = []
+        for file in files:
+            file = os.path.abspath(file)
+            try:
+                stat = os.stat(file)
+            except OSError as e:
+                # Deleted or unreadable since it was listed
+                summary['failed'] += 1
+                summary['errors'].append((file, str(e)))
+                continue
+            entry = self.entries.get(file)
+            if entry and int(entry['size']) == stat.st_size and int(entry['mtime_ns']) == stat.st_mtime_ns:
+                summary['skipped'] += 1
+            else:
+                pending.append((file, stat))
+
+        with ThreadPoolExecutor(workers or min(8, os.cpu_count() or 1)) as pool, \
+                open(self._dataPath, 'ab') as data, open(self._indexPath, 'a', newline='', encoding='utf-8') as index:
+            writer = csv.DictWriter(index, fieldnames=self.FIELDS)
+            if index.tell() == 0:
+                writer.writeheader()
+
+            for start in range(0, len(pending), self.CHUNK):
+                chunk = pending[start:start + self.CHUNK]
+                rows, lines = [], []
+
+                for (file, stat), (digest, img) in zip(chunk, pool.map(self.prepare, [f for f, _ in chunk])):
+                    if digest is None:
+                        summary['failed'] += 1
+                        summary['errors'].append((file, img))
+                        continue
+
+                    row = self.hashes.get(digest)
+                    if row is None:
+                        # New content gets the next row, in append order
+                        row = len(self.hashes)
+                        self.hashes[digest] = row
+                        rows.append(self.encode(img))
+                        summary['added'] += 1
+                    else:
+                        summary['reused'] += 1
+
+                    entry = {'path': file, 'row': row, 'size': stat.st_size,
+                             'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+                    self.entries[file] = entry
+                    lines.append(entry)
+
+                # Rows first, then the index lines that point at them
+                data.write(b''.join(rows))
+                data.flush()
+                writer.writerows(lines)
+                index.flush()
+
+        return summary
+
+    def prepare(self, file):
+        """
+        Reads, hashes and decodes one source image.
+
+        Returns:
+        --------
+        tuple
+            (hash, image) with the grayscale uint8 model-size image, or (None, message) on failure.
+        """
+        try:
+            with open(file, 'rb') as fh:
+                content = fh.read()
+        except OSError as e:
+            return None, str(e)
+
+        img = self.preprocessor.decode(content)
+        if img is None:
+            return None, 'unreadable image'
+
+        return hashlib.blake2b(content, digest_size=16).hexdigest(), img
+
+    def encode(self, img):
+        """
+        Converts a grayscale uint8 image into the bytes of one stored row.
+        """
+        if self.dtype == 'uint8':
+            return np.ascontiguousarray(img).tobytes()
+        return (img.astype(np.float32) / np.float32(255.0)).astype(np.float16).tobytes()
@@ -0,0 +1,190 @@
+from common_libs import np
+from common_libs import TB_THRESHOLD, TTA_BAND, TTA_SHIFT, TTA_CONTRAST
+
+class TestTimeAugmenter:
+    """
+    Test-time augmentation for borderline predictions.
+
+    An image's model input is expanded into several views: the original, a
+    horizontal flip, small shifts in each direction and contrast jitter. All views
+    go through the models as one batch, so both heads see them in a single call.
+    The masks are mapped back onto the original geometry (pixels a shift moved out
+    of the frame are left out of the average) and averaged, as are the TB
+    probabilities. How far the views agree is reported as an uncertainty score.
+
+    Attributes:
+    -----------
+    band : float
+        Half-width of the probability band around TB_THRESHOLD that triggers augmentation.
+
+    views : list of tuple
+        (flip, dy, dx, gain) of every view; the first is the identity.
+    """
+
+    def __init__(self, band=TTA_BAND, shift=TTA_SHIFT, contrast=TTA_CONTRAST, flip=True):
+        """
+        Builds the list of views.
+
+        Parameters:
+        -----------
+        band : float, optional (default=TTA_BAND)
+            Half-width of the probability band around TB_THRESHOLD that triggers augmentation.
+
+        shift : int, optional (default=TTA_SHIFT)
+            Shift in pixels of the four translated views; 0 disables them.
+
+        contrast : tuple, optional (default=TTA_CONTRAST)
+            Contrast gains of the jittered views.
+
+        flip : bool, optional (default=True)
+            Include the horizontally flipped view.
+        """
+        self.band: float = band
+        """float: Half-width of the probability band around TB_THRESHOLD that triggers augmentation."""
+
+        views = [(False, 0, 0, 1.0)]
+        if flip:
+            views.append((True, 0, 0, 1.0))
+        if shift:
+            views += [(False, 0, shift, 1.0), (False, 0, -shift, 1.0), (False, shift, 0, 1.0), (False, -shift, 0, 1.0)]
+        views += [(False, 0, 0, float(gain)) for gain in contrast]
+
+        self.views: list = views
+        """list of tuple: (flip, dy, dx, gain) of every view; the first is the identity."""
+
+    def inBand(self, tb):
+        """
+        Returns True if a first-pass probability is close enough to the threshold
+        to be worth augmenting.
+        """
+        return abs(float(tb) - TB_THRESHOLD) <= self.band
+
+    @staticmethod
+    def window(dy, dx, height, width):
+        """
+        Returns the (source, target) slice pairs that move an image by (dy, dx),
+        leaving the uncovered border out.
+        """
+        source = (slice(max(0, -dy), height - max(0, dy)), slice(max(0, -dx), width - max(0, dx)))
+        target = (slice(max(0, dy), height - max(0, -dy)), slice(max(0, dx), width - max(0, -dx)))
+        return source, target
+
+    def augment(self, x, out=None):
+        """
+        Stacks every view of one preprocessed image into a batch.
+
+        Parameters:
+        -----------
+        x : np.ndarray
+            Float32 model input of shape (1, H, W, 1) or (H, W, 1).
+
+        out : np.ndarray, optional
+            Float32 buffer of shape (len(views), H, W, 1) to write into.
+
+        Returns:
+        --------
+        np.ndarray
+            Float32 batch of shape (len(views), H, W, 1).
+        """
+        image = x.reshape(x.shape[-3:])
+        height, width = image.shape[:2]
+        if out is None:
+            out = np.empty((len(self.views),) + image.shape, dtype=np.float32)
+
+        mean = np.float32(image.mean())
+        for view, (flip, dy, dx, gain) in zip(out, self.views):
+            source = image[:, ::-1] if flip else image
+            if dy or dx:
+                # Uncovered borders are black, like the film margins
+                view[:] = 0
+                src, dst = self.window(dy, dx, height, width)
+                view[dst] = source[src]
+            else:
+                view[:] = source
+            if gain != 1.0:
+                # Contrast around the image mean, kept in [0, 1]
+                view -= mean
+                view *= np.float32(gain)
+                view += mean
+                np.clip(view, 0, 1, out=view)
+
+        return out
+
+    def deaugment(self, masks):
+        """
+        Maps every view's mask back onto the original geometry and averages them.
+
+        Parameters:
+        -----------
+        masks : np.ndarray
+            Raw sigmoid masks of shape (len(views), H, W, 1) for the augmented batch.
+
+        Returns:
+        --------
+        np.ndarray
+            Averaged float32 mask of shape (1, H, W, 1).
+        """
+        height, width = masks.shape[1:3]
+        total = np.zeros(masks.shape[1:], dtype=np.float32)
+        count = np.zeros(masks.shape[1:], dtype=np.float32)
+
+        for mask, (flip, dy, dx, _) in zip(masks, self.views):
+            # Undo the shift first, then the flip, the reverse of `augment`
+            src, dst = self.window(-dy, -dx, height, width)
+            restored = np.zeros_like(total)
+            valid = np.zeros_like(count)
+            restored[dst] = mask[src]
+            valid[dst] = 1
+            if flip:
+                restored, valid = restored[:, ::-1], valid[:, ::-1]
+            total += restored
+            count += valid
+
+        return (total / np.maximum(count, 1))[None]
+
+    def combine(self, masks, probs):
+        """
+        De-augments and averages the outputs of an augmented batch.
+
+        Parameters:
+        -----------
+        masks : np.ndarray
+            Raw sigmoid masks of shape (len(views), H, W, 1).
+
+        probs : np.ndarray
+            TB probabilities of shape (len(views),).
+
+        Returns:
+        --------
+        tuple
+            (mask, tb, uncertainty): the averaged (1, H, W, 1) mask, the averaged
+            probability, and a dict with the number of 'views', the 'uncertainty'
+            (standard deviation of the view probabilities) and the 'agreement'
+            (share of views on the same side of TB_THRESHOLD as the average).
+        """
+        probs = np.asarray(probs, dtype=np.float32).reshape(-1)
+        tb = float(probs.mean())
+        agreement = float(np.mean((probs > TB_THRESHOLD) == (tb > TB_THRESHOLD)))
+
+        return self.deaugment(masks), tb, {'views': len(probs), 'uncertainty': float(probs.std()),
+                                           'agreement': agreement}
+
+    def predict(self, model, x):
+        """
+        Runs every view of one image through the models in a single batch.
+
+        Parameters:
+        -----------
+        model : FusedModel
+            Model whose `predictTensor` returns masks and probabilities for a batch.
+
+        x : np.ndarray
+            Float32 model input of shape (1, H, W, 1).
+
+        Returns:
+        --------
+        tuple
+            (mask, tb, uncertainty) as returned by `combine`.
+        """
+        masks, probs = model.predictTensor(self.augment(x))
+        return self.combine(np.asarray(masks), probs)
@@ -0,0 +1,177 @@
+from common_libs import os, hashlib, threading, OrderedDict, np, cv2
+from common_libs import GALLERY_THUMB_SIZE, GALLERY_THUMB_MEMORY_MB, GALLERY_THUMB_DIR
+import model.Preprocessor as pp
+
+class ThumbnailCache:
+    """
+    Bounded cache of downscaled images for the results gallery.
+
+    Thumbnails are decoded straight to a small size: 8-bit files use OpenCV's
+    reduced decode modes (JPEG scales during decompression) before an area
+    resize, and 16-bit files go through the Preprocessor windowing. Decoded
+    thumbnails are kept in memory in least-recently-used order, bounded in bytes
+    rather than in entries, and optionally written as small PNGs to a directory
+    so a gallery reopened later does not decode the full-size files again. Disk
+    entries are keyed by the source path, size and modification time, so a
+    rewritten mask or overlay is never shown stale.
+
+    The cache is thread-safe; `get` is meant to be called from decode threads.
+
+    Attributes:
+    -----------
+    size : int
+        Edge in pixels of the square thumbnails.
+
+    maxBytes : int
+        Memory bound of the decoded thumbnails.
+
+    directory : str or None
+        Directory of the thumbnail PNGs, or None to keep them in memory only.
+    """
+
+    REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                     (4, cv2.IMREAD_REDUCED_COLOR_4),
+                     (2, cv2.IMREAD_REDUCED_COLOR_2))
+    """tuple: (factor, flag) pairs of the OpenCV reduced colour decode modes, largest first."""
+
+    def __init__(self, size=GALLERY_THUMB_SIZE, maxMemoryMB=GALLERY_THUMB_MEMORY_MB, directory=GALLERY_THUMB_DIR):
+        """
+        Initializes an empty cache.
+
+        Parameters:
+        -----------
+        size : int, optional (default=GALLERY_THUMB_SIZE)
+            Edge in pixels of the square thumbnails.
+
+        maxMemoryMB : float, optional (default=GALLERY_THUMB_MEMORY_MB)
+            Memory bound of the decoded thumbnails.
+
+        directory : str, optional (default=GALLERY_THUMB_DIR)
+            Directory of the thumbnail PNGs; None keeps them in memory only.
+        """
+        self.size: int = int(size)
+        """int: Edge in pixels of the square thumbnails."""
+
+        self.maxBytes: int = int(maxMemoryMB * 1024 * 1024)
+        """int: Memory bound of the decoded thumbnails."""
+
+        self.directory: str = directory
+        """str: Directory of the thumbnail PNGs, or None to keep them in memory only."""
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._preprocessor = pp.Preprocessor(size=(self.size, self.size))
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of thumbnails held in memory.
+        """
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """
+        int: Memory used by the thumbnails held.
+        """
+        return self._bytes
+
+    def get(self, path):
+        """
+        Returns the thumbnail of an image file, decoding it on a miss.
+
+        Parameters:
+        -----------
+        path : str
+            Image path.
+
+        Returns:
+        --------
+        np.ndarray or None
+            RGB uint8 thumbnail of shape (size, size, 3), or None if the file cannot be read.
+        """
+        with self._lock:
+            thumb = self._entries.get(path)
+            if thumb is not None:
+                self._entries.move_to_end(path)
+                return thumb
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        stored = self.storedPath(path, stat)
+        thumb = cv2.imread(stored, cv2.IMREAD_COLOR) if stored and os.path.exists(stored) else None
+        if thumb is None:
+            thumb = self.render(path)
+            if thumb is None:
+                return None
+            if stored:
+                # Written under a temporary name so a concurrent reader never sees half a file
+                temp = f'{stored}.{threading.get_ident()}.tmp.png'
+                if cv2.imwrite(temp, thumb):
+                    os.replace(temp, stored)
+        thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2RGB)
+
+        with self._lock:
+            if path not in self._entries:
+                self._entries[path] = thumb
+                self._bytes += thumb.nbytes
+                while self._bytes > self.maxBytes and len(self._entries) > 1:
+                    _, dropped = self._entries.popitem(last=False)
+                    self._bytes -= dropped.nbytes
+
+        return thumb
+
+    def storedPath(self, path, stat):
+        """
+        Returns the file name of a thumbnail in `directory`, or None without a directory.
+        """
+        if not self.directory:
+            return None
+        key = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size}'
+        return os.path.join(self.directory, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.png')
+
+    def render(self, path):
+        """
+        Decodes an image file straight to a BGR thumbnail.
+
+        Parameters:
+        -----------
+        path : str
+            Image path.
+
+        Returns:
+        --------
+        np.ndarray or None
+            BGR uint8 image of shape (size, size, 3), or None if the file cannot be read.
+        """
+        width, height, high_depth = self._preprocessor.probe(path)
+        if high_depth:
+            return self._preprocessor.decode(path, bgr=True)
+
+        flags = cv2.IMREAD_COLOR
+        if width is not None:
+            for factor, reduced in self.REDUCED_FLAGS:
+                if width // factor >= self.size and height // factor >= self.size:
+                    flags = reduced
+                    break
+
+        img = cv2.imread(path, flags)
+        if img is None:
+            return None
+        if img.shape[:2] != (self.size, self.size):
+            img = cv2.resize(img, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(img)
+
+    def clear(self):
+        """
+        Drops every thumbnail held in memory; stored PNGs are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
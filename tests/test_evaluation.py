@@ -0,0 +1,50 @@
+import pytest
+from common_libs import np
+import controller.EvaluationController as ec
+
+Evaluation = ec.EvaluationController
+
+
+def test_overlap_from_counts():
+    assert Evaluation.overlap(30, 40, 50) == {'dice': round(60 / 90, 6), 'iou': round(30 / 60, 6)}
+    assert Evaluation.overlap(0, 10, 10) == {'dice': 0.0, 'iou': 0.0}
+    assert Evaluation.overlap(0, 0, 0) == {'dice': 1.0, 'iou': 1.0}
+
+
+def test_pooled_overlap_weighs_images_by_size():
+    # A small perfect mask and a large disjoint one: the mean is 0.5, the pooled score is small
+    images = [(10, 10, 10), (0, 990, 990)]
+    sums = np.sum(images, axis=0)
+    pooled = Evaluation.overlap(*sums)
+
+    assert pooled == {'dice': round(20 / 2000, 6), 'iou': round(10 / 1990, 6)}
+    assert np.mean([Evaluation.overlap(*image)['dice'] for image in images]) == 0.5
+
+
+def test_auc_known_values():
+    assert Evaluation.auc([0, 0, 1, 1], [0.1, 0.2, 0.8, 0.9]) == 1.0
+    assert Evaluation.auc([1, 1, 0, 0], [0.1, 0.2, 0.8, 0.9]) == 0.0
+    # Positive/negative pairs ranked correctly: (0.35 > 0.1), (0.8 > 0.1), (0.8 > 0.4), of 4
+    assert Evaluation.auc([0, 0, 1, 1], [0.1, 0.4, 0.35, 0.8]) == 0.75
+
+
+def test_auc_ties_count_half():
+    assert Evaluation.auc([0, 1], [0.5, 0.5]) == 0.5
+    # Pairs: 0.7 vs 0.3 wins, 0.7 vs 0.7 ties, 0.9 wins twice: 3.5 of 4
+    assert Evaluation.auc([0, 0, 1, 1], [0.3, 0.7, 0.7, 0.9]) == 0.875
+
+
+def test_auc_matches_pairwise_count():
+    rng = np.random.default_rng(0)
+    labels = rng.random(200) > 0.6
+    scores = np.round(rng.random(200), 2)
+
+    diff = scores[labels][:, None] - scores[~labels][None, :]
+    expected = (np.sum(diff > 0) + 0.5 * np.sum(diff == 0)) / diff.size
+
+    assert Evaluation.auc(labels, scores) == pytest.approx(expected)
+
+
+def test_auc_needs_both_classes():
+    assert Evaluation.auc([1, 1], [0.2, 0.9]) is None
+    assert Evaluation.auc([0, 0], [0.2, 0.9]) is None
@@ -0,0 +1,65 @@
+import pytest
+from common_libs import np, cv2
+import model.Postprocessor as ps
+import model.SegmentationModel as sm
+
+
+def blend(image, binary, color=(255, 20, 255)):
+    """
+    Reference overlay: paints the mask and blends it with cv2.addWeighted.
+    """
+    bgr = image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    painted = np.zeros_like(bgr)
+    painted[binary] = color
+    return cv2.addWeighted(bgr, 0.6, painted, 0.4, 0)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.mark.parametrize('channels', [None, 3])
+def test_overlay_matches_add_weighted(rng, channels):
+    shape = (64, 48) if channels is None else (64, 48, channels)
+    image = rng.integers(0, 256, shape, dtype=np.uint8)
+    binary = rng.random((64, 48)) > 0.5
+
+    np.testing.assert_array_equal(ps.Postprocessor().overlay(image, binary), blend(image, binary))
+
+
+@pytest.mark.parametrize('channels', [None, 3])
+def test_overlay_batch_matches_single_images(rng, channels):
+    shape = (4, 32, 32) if channels is None else (4, 32, 32, channels)
+    images = rng.integers(0, 256, shape, dtype=np.uint8)
+    binary = rng.random((4, 32, 32)) > 0.5
+
+    out = ps.Postprocessor().overlay(images, binary)
+
+    assert out.shape == (4, 32, 32, 3)
+    for image, mask, result in zip(images, binary, out):
+        np.testing.assert_array_equal(result, blend(image, mask))
+
+
+def test_lut_covers_every_level():
+    lut = ps.Postprocessor().lut
+    levels = np.arange(256, dtype=np.uint8)
+
+    assert lut.shape == (512, 3) and lut.dtype == np.uint8
+    np.testing.assert_array_equal(lut[:256], blend(levels[None], np.zeros((1, 256), dtype=bool))[0])
+    np.testing.assert_array_equal(lut[256:], blend(levels[None], np.ones((1, 256), dtype=bool))[0])
+
+
+def test_colored_mask_matches_original_algorithm(rng):
+    image = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    gray = rng.integers(0, 256, (64, 64), dtype=np.uint8)
+    gray[gray < 128] = 0
+    mask_image = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+    # Mask, paint and blend as getColoredMask did before the lookup table
+    mask_gray = cv2.cvtColor(mask_image, cv2.COLOR_BGR2GRAY)
+    mask = cv2.bitwise_and(mask_image, mask_image, mask=mask_gray)
+    mask[np.any(mask != 0, axis=-1)] = (255, 20, 255)
+    expected = cv2.addWeighted(image, 0.6, mask, 0.4, 0)
+
+    np.testing.assert_array_equal(sm.SegmentationModel.getColoredMask(image, mask_image), expected)
@@ -0,0 +1,65 @@
+import pytest
+import model.ProcessedManifest as pm
+import controller.BatchController as bc
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'state' / 'manifest.sqlite')
+
+
+def record(name):
+    # A scored record as BatchController.finish builds it and WatchController stores it
+    record = dict.fromkeys(bc.BatchController.FIELDS)
+    record.update(file=name, probability=0.4, label='Negative', confidence=60.0, lung_fraction=0.3125)
+    return record
+
+
+def test_scored_files_are_skipped_after_restart(path):
+    with pm.ProcessedManifest(path, 'v1') as manifest:
+        manifest.add([('/in/a.png', 'h1', 10, 100, record('a.png')), ('/in/b.png', 'h2', 20, 200, record('b.png'))])
+
+    with pm.ProcessedManifest(path, 'v1') as manifest:
+        assert len(manifest) == 2
+        assert manifest.contains('/in/a.png', 10, 100)
+        # A new version of the file, or a file never committed, is scored again
+        assert not manifest.contains('/in/a.png', 10, 101)
+        assert not manifest.contains('/in/c.png', 30, 300)
+        assert manifest.lookupHash('h2') == record('b.png')
+        assert manifest.lookupHash('h3') is None
+
+
+def test_model_update_rescores_everything(path):
+    with pm.ProcessedManifest(path, 'v1') as manifest:
+        manifest.add([('/in/a.png', 'h1', 10, 100, record('a.png'))])
+
+    with pm.ProcessedManifest(path, 'v2') as manifest:
+        assert len(manifest) == 0
+        assert not manifest.contains('/in/a.png', 10, 100)
+        assert manifest.lookupHash('h1') is None
+
+
+def test_failures_count_attempts_per_version(path):
+    with pm.ProcessedManifest(path, 'v1') as manifest:
+        assert manifest.attempts('/in/bad.png', 5, 50) == 0
+        manifest.addFailures([('/in/bad.png', 5, 50, 'unreadable image')])
+        manifest.addFailures([('/in/bad.png', 5, 50, 'unreadable image')])
+        assert manifest.attempts('/in/bad.png', 5, 50) == 2
+        assert len(manifest) == 0 and not manifest.contains('/in/bad.png', 5, 50)
+
+        # A rewritten file starts over
+        manifest.addFailures([('/in/bad.png', 6, 60, 'unreadable image')])
+        assert manifest.attempts('/in/bad.png', 6, 60) == 1
+        assert manifest.attempts('/in/bad.png', 5, 50) == 0
+
+    with pm.ProcessedManifest(path, 'v2') as manifest:
+        assert manifest.attempts('/in/bad.png', 6, 60) == 0
+
+
+def test_scoring_clears_failures(path):
+    with pm.ProcessedManifest(path, 'v1') as manifest:
+        manifest.addFailures([('/in/a.png', 5, 50, 'truncated')])
+        manifest.add([('/in/a.png', 'h1', 7, 70, record('a.png'))])
+
+        assert manifest.attempts('/in/a.png', 5, 50) == 0
+        assert manifest.contains('/in/a.png', 7, 70)
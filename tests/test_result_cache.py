@@ -0,0 +1,101 @@
+import pytest
+from common_libs import os, np
+import model.ResultCache as rc
+
+MASK_BYTES = 32 * 32
+
+
+@pytest.fixture
+def models(tmp_path):
+    paths = [tmp_path / 'seg.keras', tmp_path / 'clf.keras']
+    for path in paths:
+        path.write_bytes(b'weights')
+    return [str(path) for path in paths]
+
+
+def image(seed):
+    return np.random.default_rng(seed).integers(0, 256, (16, 16, 3), dtype=np.uint8)
+
+
+def mask(seed):
+    return np.random.default_rng(seed + 100).integers(0, 256, (32, 32), dtype=np.uint8)
+
+
+def test_hit_returns_stored_result(models):
+    cache = rc.ResultCache(models)
+    assert cache.get(image(0)) is None
+
+    cache.put(image(0), np.stack([mask(0)] * 3, axis=-1), 0.25)
+    stored, tb = cache.get(image(0))
+
+    np.testing.assert_array_equal(stored, mask(0))
+    assert tb == 0.25
+    assert cache.get(image(1)) is None
+
+
+def test_memory_tier_evicts_least_recently_used(models):
+    cache = rc.ResultCache(models, maxMemoryMB=3 * MASK_BYTES / 2 ** 20)
+    for seed in range(3):
+        cache.put(image(seed), mask(seed), seed / 10)
+
+    cache.get(image(0))
+    cache.put(image(3), mask(3), 0.3)
+
+    assert cache.get(image(1)) is None
+    assert all(cache.get(image(seed)) is not None for seed in (0, 2, 3))
+
+
+def test_disk_tier_is_bounded_and_survives_restart(models, tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = rc.ResultCache(models, maxMemoryMB=MASK_BYTES / 2 ** 20, cacheDir=directory)
+    cache.put(image(0), mask(0), 0.1)
+    entry_bytes = os.path.getsize(os.path.join(directory, os.listdir(directory)[0]))
+
+    cache = rc.ResultCache(models, maxMemoryMB=MASK_BYTES / 2 ** 20, cacheDir=directory,
+                           maxDiskMB=2.5 * entry_bytes / 2 ** 20)
+    for seed in range(1, 4):
+        cache.put(image(seed), mask(seed), seed / 10)
+
+    files = os.listdir(directory)
+    assert len(files) == 2 and sum(os.path.getsize(os.path.join(directory, f)) for f in files) <= cache.maxDiskBytes
+
+    # A new process finds the newest entries on disk, the oldest were evicted
+    restarted = rc.ResultCache(models, cacheDir=directory, maxDiskMB=cache.maxDiskBytes / 2 ** 20)
+    assert restarted.get(image(0)) is None and restarted.get(image(1)) is None
+    stored, tb = restarted.get(image(3))
+    np.testing.assert_array_equal(stored, mask(3))
+    assert tb == pytest.approx(0.3)
+
+
+def test_restart_enforces_a_smaller_disk_bound(models, tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = rc.ResultCache(models, cacheDir=directory)
+    for seed in range(3):
+        cache.put(image(seed), mask(seed), 0.5)
+        os.utime(cache._diskPath(cache.key(image(seed))), (seed, seed))
+
+    rc.ResultCache(models, cacheDir=directory, maxDiskMB=0)
+
+    assert os.listdir(directory) == [cache.key(image(2)) + '.npz']
+
+
+def test_model_update_invalidates_both_tiers(models, tmp_path):
+    cache = rc.ResultCache(models, cacheDir=str(tmp_path / 'cache'))
+    cache.put(image(0), mask(0), 0.5)
+    before = cache.fingerprint()
+
+    with open(models[1], 'ab') as fh:
+        fh.write(b'retrained')
+
+    assert cache.fingerprint() != before
+    assert cache.get(image(0)) is None
+    assert rc.ResultCache(models, cacheDir=str(tmp_path / 'cache')).get(image(0)) is None
+
+
+def test_clear_removes_everything(models, tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = rc.ResultCache(models, cacheDir=directory)
+    cache.put(image(0), mask(0), 0.5)
+    cache.clear()
+
+    assert cache.get(image(0)) is None and os.listdir(directory) == []
@@ -0,0 +1,153 @@
+import shutil
+import pytest
+from common_libs import os, np, cv2
+import model.TensorStore as ts
+
+
+def write(path, seed, size=(96, 80)):
+    img = np.random.default_rng(seed).integers(0, 256, size[::-1], dtype=np.uint8)
+    cv2.imwrite(str(path), img)
+    return str(path)
+
+
+@pytest.fixture
+def files(tmp_path):
+    return [write(tmp_path / f'img{i}.png', i) for i in range(3)]
+
+
+def open_store(tmp_path, **kwargs):
+    return ts.TensorStore(str(tmp_path / 'store'), size=(32, 32), **kwargs)
+
+
+def test_append_stores_decoded_rows(tmp_path, files):
+    store = open_store(tmp_path)
+    summary = store.append(files, workers=2)
+
+    assert (summary['added'], summary['reused'], summary['skipped'], summary['failed']) == (3, 0, 0, 0)
+    assert len(store) == 3 and store.paths() == files
+    for file in files:
+        expected = store.preprocessor.decode(file)
+        np.testing.assert_array_equal(store.image(file), expected)
+        np.testing.assert_array_equal(store.toTensor(file)[..., 0], expected / np.float32(255))
+    assert store.batch().shape == (3, 32, 32, 1)
+
+
+def test_unchanged_files_are_skipped_and_reopened(tmp_path, files):
+    open_store(tmp_path).append(files)
+
+    store = open_store(tmp_path)
+    summary = store.append(files)
+
+    assert (summary['added'], summary['skipped']) == (0, 3)
+    assert len(store) == 3 and all(file in store for file in files)
+
+
+def test_identical_content_is_stored_once(tmp_path, files):
+    copy = str(tmp_path / 'copy.png')
+    shutil.copyfile(files[0], copy)
+    store = open_store(tmp_path)
+    summary = store.append(files + [copy])
+
+    assert (summary['added'], summary['reused']) == (3, 1)
+    assert len(store) == 3 and store.row(copy) == store.row(files[0])
+    assert os.path.getsize(os.path.join(store.directory, 'inputs.bin')) == 3 * 32 * 32
+
+
+def test_changed_file_gets_a_new_row(tmp_path, files):
+    store = open_store(tmp_path)
+    store.append(files)
+    write(files[1], 99)
+    os.utime(files[1], ns=(1, 1))
+
+    summary = store.append(files)
+
+    assert (summary['added'], summary['skipped']) == (1, 2)
+    assert store.row(files[1]) == 3
+    np.testing.assert_array_equal(store.image(files[1]), store.preprocessor.decode(files[1]))
+
+
+def test_unreadable_files_are_reported(tmp_path, files):
+    bad = tmp_path / 'bad.png'
+    bad.write_bytes(b'not an image')
+    summary = open_store(tmp_path).append(files + [str(bad)])
+
+    assert summary['failed'] == 1 and summary['errors'][0][0] == str(bad)
+
+
+def test_crash_leftovers_are_truncated(tmp_path, files):
+    store = open_store(tmp_path)
+    store.append(files[:2])
+    data_path = os.path.join(store.directory, 'inputs.bin')
+
+    # A crash between writing rows and their index lines leaves unindexed bytes behind
+    with open(data_path, 'ab') as fh:
+        fh.write(b'\x7f' * (32 * 32 + 100))
+
+    store = open_store(tmp_path)
+    assert len(store) == 2
+    assert os.path.getsize(data_path) == 2 * 32 * 32
+
+    summary = store.append(files)
+    assert (summary['added'], summary['skipped']) == (1, 2)
+    np.testing.assert_array_equal(store.image(files[2]), store.preprocessor.decode(files[2]))
+
+
+def test_index_lines_past_the_data_are_dropped(tmp_path, files):
+    store = open_store(tmp_path)
+    store.append(files)
+    data_path = os.path.join(store.directory, 'inputs.bin')
+
+    # Rows lost from the data file after their index lines were written
+    with open(data_path, 'r+b') as fh:
+        fh.truncate(2 * 32 * 32 + 10)
+
+    store = open_store(tmp_path)
+    assert len(store) == 2 and files[2] not in store
+    assert os.path.getsize(data_path) == 2 * 32 * 32
+
+
+def test_float16_rows(tmp_path, files):
+    store = open_store(tmp_path, dtype='float16')
+    store.append(files)
+
+    np.testing.assert_array_equal(store.image(files[0]), store.preprocessor.decode(files[0]))
+    assert open_store(tmp_path, dtype='uint8').dtype == 'float16'
+
+
+def test_half_written_index_line_is_dropped(tmp_path, files):
+    store = open_store(tmp_path)
+    store.append(files[:2])
+    index_path = os.path.join(store.directory, 'index.csv')
+
+    # A crash halfway through the third file's index line, after its row was written
+    with open(index_path, 'a') as fh:
+        fh.write(files[2] + ',2,12')
+    with open(os.path.join(store.directory, 'inputs.bin'), 'ab') as fh:
+        fh.write(b'\x7f' * 32 * 32)
+
+    store = open_store(tmp_path)
+    assert len(store) == 2 and files[2] not in store
+
+    # The next append starts on a fresh line and survives a reopen
+    assert store.append(files)['added'] == 1
+    store = open_store(tmp_path)
+    assert len(store) == 3 and store.row(files[2]) == 2
+    np.testing.assert_array_equal(store.image(files[2]), store.preprocessor.decode(files[2]))
+
+
+def test_malformed_index_lines_are_skipped(tmp_path, files):
+    store = open_store(tmp_path)
+    store.append(files[:1])
+    with open(os.path.join(store.directory, 'index.csv'), 'a') as fh:
+        fh.write(files[1] + ',0,12\n' + files[2] + ',zero,1,1,abc\n')
+
+    store = open_store(tmp_path)
+    assert store.paths() == files[:1]
+
+
+def test_vanished_files_are_reported(tmp_path, files):
+    missing = str(tmp_path / 'gone.png')
+    summary = open_store(tmp_path).append(files + [missing])
+
+    assert (summary['added'], summary['failed']) == (3, 1)
+    assert summary['errors'][0][0] == missing
@@ -0,0 +1,50 @@
+import pytest
+from common_libs import np
+from common_libs import TB_THRESHOLD
+import model.TestTimeAugmenter as tta
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).random((1, 40, 40, 1), dtype=np.float32)
+
+
+def test_views_round_trip_to_the_original(image):
+    augmenter = tta.TestTimeAugmenter(shift=4, contrast=())
+    views = augmenter.augment(image)
+
+    assert views.shape == (len(augmenter.views), 40, 40, 1)
+    np.testing.assert_allclose(augmenter.deaugment(views), image, rtol=1e-6)
+
+
+@pytest.mark.parametrize('flip, dy, dx', [(True, 0, 0), (False, 0, 4), (False, 0, -4), (False, 4, 0), (False, -4, 0)])
+def test_each_view_round_trips_inside_its_window(image, flip, dy, dx):
+    augmenter = tta.TestTimeAugmenter(shift=0, contrast=(), flip=False)
+    augmenter.views = [(flip, dy, dx, 1.0)]
+
+    restored = augmenter.deaugment(augmenter.augment(image))
+
+    # Pixels shifted out of the frame have no view covering them and come back empty
+    src, _ = augmenter.window(dy, dx, 40, 40)
+    np.testing.assert_array_equal(restored[0][src], image[0][src])
+
+
+def test_shifted_views_leave_uncovered_pixels_out_of_the_average():
+    augmenter = tta.TestTimeAugmenter(shift=4, contrast=(), flip=False)
+    masks = np.ones((len(augmenter.views), 16, 16, 1), dtype=np.float32)
+
+    # Every pixel is covered by at least the identity view, so the average stays 1
+    np.testing.assert_array_equal(augmenter.deaugment(masks), np.ones((1, 16, 16, 1), dtype=np.float32))
+
+
+def test_combine_averages_and_reports_agreement(image):
+    augmenter = tta.TestTimeAugmenter(shift=0, contrast=(), flip=True)
+    probs = np.array([TB_THRESHOLD + 0.2, TB_THRESHOLD - 0.1], dtype=np.float32)
+
+    mask, tb, stats = augmenter.combine(augmenter.augment(image), probs)
+
+    np.testing.assert_allclose(mask, image, rtol=1e-6)
+    assert tb == pytest.approx(TB_THRESHOLD + 0.05)
+    assert stats['views'] == 2
+    assert stats['uncertainty'] == pytest.approx(0.15, abs=1e-6)
+    assert stats['agreement'] == 0.5
@@ -0,0 +1,447 @@
+from common_libs import tk, os, queue, OrderedDict, ThreadPoolExecutor
+from common_libs import TXT_11, TXT_12_B, GALLERY_THUMB_SIZE, GALLERY_PHOTO_CACHE
+
+class GalleryView(tk.Toplevel):
+    """
+    GalleryView is a scrollable window listing the scored studies of a batch session.
+
+    The list is virtualized: the canvas scroll region spans every row, but canvas
+    items only exist for the rows in view (plus one row above and below), and the
+    items of rows scrolled away are recycled for the rows scrolled in. Each row
+    shows the overlay and mask thumbnails with the file name, TB probability,
+    label and lung fraction. Thumbnails are decoded by `loader` on background
+    threads, only for visible rows; requests for rows scrolled away before their
+    turn are dropped. A thumbnail that fails to decode is shown as a blank
+    placeholder and not decoded again until the sort order changes. Tk images are created on the Tk thread and kept in a
+    least-recently-shown cache of `maxPhotos` entries, so the number of canvas
+    items and Tk images stays bounded however many studies are loaded.
+
+    Attributes:
+    -----------
+    records : list of dict
+        Batch result records with 'file', 'probability', 'label', 'lung_fraction',
+        'mask', 'overlay' and 'error'.
+
+    order : list of int
+        Indices into `records` in display order.
+
+    loader : function
+        Callable returning the RGB uint8 thumbnail of an image path, or None.
+
+    openCallback : function
+        The function called with a record when one of its thumbnails is clicked.
+
+    thumbSize : int
+        Edge in pixels of the thumbnails.
+
+    rowHeight : int
+        Height in pixels of one row.
+
+    maxPhotos : int
+        Number of Tk thumbnail images kept.
+
+    sortMode : str
+        Current order: 'desc' or 'asc' TB probability, or 'file' for the results file order.
+
+    headerLbl : tk.Label
+        Label showing the number of studies.
+
+    sortBtn : tk.Button
+        Button cycling through the sort orders.
+
+    canvas : tk.Canvas
+        Canvas drawing the visible rows.
+
+    scrollbar : tk.Scrollbar
+        Vertical scrollbar of the canvas.
+    """
+
+    PAD = 6
+    """int: Spacing in pixels between thumbnails and around the rows."""
+
+    POLL_MS = 30
+    """int: Interval at which decoded thumbnails are turned into Tk images."""
+
+    SORT_MODES = {'desc': 'Highest TB first', 'asc': 'Lowest TB first', 'file': 'File order'}
+    """dict: Sort orders, in the order the sort button cycles through them, with their button text."""
+
+    def __init__(self, parent, records, loader, openCallback, thumbSize=GALLERY_THUMB_SIZE,
+                 maxPhotos=GALLERY_PHOTO_CACHE, workers=2, title='Batch results'):
+        """
+        Initializes the gallery window and draws the first rows.
+
+        Parameters:
+        -----------
+        parent : tk.Tk
+            The main window.
+
+        records : list of dict
+            Batch result records, e.g. from `BatchController.readResults`.
+
+        loader : function
+            Callable returning the RGB uint8 thumbnail of an image path, or None; called from worker threads.
+
+        openCallback : function
+            The function called with a record when one of its thumbnails is clicked.
+
+        thumbSize : int, optional (default=GALLERY_THUMB_SIZE)
+            Edge in pixels of the thumbnails.
+
+        maxPhotos : int, optional (default=GALLERY_PHOTO_CACHE)
+            Number of Tk thumbnail images kept.
+
+        workers : int, optional (default=2)
+            Threads decoding thumbnails.
+
+        title : str, optional (default='Batch results')
+            Window title.
+        """
+        super().__init__(parent)
+        self.title(title)
+        self.geometry('720x640')
+
+        self.records: list = list(records)
+        """list of dict: Batch result records."""
+
+        self.order: list = list(range(len(self.records)))
+        """list of int: Indices into `records` in display order."""
+
+        self.loader = loader
+        """function: Callable returning the RGB uint8 thumbnail of an image path, or None."""
+
+        self.openCallback = openCallback
+        """function: The function called with a record when one of its thumbnails is clicked."""
+
+        self.thumbSize: int = thumbSize
+        """int: Edge in pixels of the thumbnails."""
+
+        self.rowHeight: int = thumbSize + 2 * self.PAD
+        """int: Height in pixels of one row."""
+
+        self.maxPhotos: int = maxPhotos
+        """int: Number of Tk thumbnail images kept."""
+
+        self.sortMode: str = 'file'
+        """str: Current order: 'desc' or 'asc' TB probability, or 'file' for the results file order."""
+
+        self._rows = {}  # position -> canvas items of the rows in view
+        self._free = []  # canvas items of rows scrolled away, reused for the next rows
+        self._photos = OrderedDict()  # path -> PhotoImage, least recently shown first
+        self._pending = set()  # paths submitted for decoding, touched on the Tk thread only
+        self._failed = set()  # paths whose decode failed, shown as the placeholder until the next sort
+        self._placeholder = None  # blank Tk image shown for failed thumbnails
+        self._wanted = frozenset()  # paths of the rows in view, read by the decode threads
+        self._decoded = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._closed = False
+
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        header = tk.Frame(self, name='menu')
+        header.grid(row=0, column=0, columnspan=2, sticky=tk.NSEW)
+        header.columnconfigure(0, weight=1)
+
+        errors = sum(1 for record in self.records if record.get('error'))
+        self.headerLbl = tk.Label(header, text=f'{len(self.records)} studies' + (f', {errors} failed' if errors else ''),
+                                  font=TXT_12_B, anchor=tk.W)
+        """tk.Label: Label showing the number of studies."""
+
+        self.headerLbl.grid(row=0, column=0, sticky=tk.NSEW)
+
+        self.sortBtn = tk.Button(header, text=self.SORT_MODES[self.sortMode], command=self.nextSort, font=TXT_12_B)
+        """tk.Button: Button cycling through the sort orders."""
+
+        self.sortBtn.grid(row=0, column=1, sticky=tk.NSEW)
+
+        self.canvas = tk.Canvas(self, height=1)
+        """tk.Canvas: Canvas drawing the visible rows."""
+
+        self.canvas.grid(row=1, column=0, sticky=tk.NSEW)
+
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        """tk.Scrollbar: Vertical scrollbar of the canvas."""
+
+        self.scrollbar.grid(row=1, column=1, sticky=tk.NS)
+        self.canvas.config(yscrollcommand=self.scrollbar.set, yscrollincrement=self.rowHeight // 4)
+        self.updateScrollRegion()
+
+        self.canvas.bind('<Configure>', lambda event: self.refresh())
+        self.canvas.bind('<MouseWheel>', self.onWheel)
+        self.canvas.bind('<Button-4>', self.onWheel)
+        self.canvas.bind('<Button-5>', self.onWheel)
+        self.canvas.bind('<Button-1>', self.onClick)
+        self.protocol('WM_DELETE_WINDOW', self.close)
+
+        self.after(self.POLL_MS, self.pollThumbnails)
+
+    def updateScrollRegion(self):
+        """
+        Sizes the scroll region to every row, visible or not.
+        """
+        self.canvas.config(scrollregion=(0, 0, self.canvas.winfo_width(), len(self.order) * self.rowHeight))
+
+    def nextSort(self):
+        """
+        Switches to the next sort order, keeping studies that failed at the end.
+        """
+        modes = list(self.SORT_MODES)
+        self.sortBy(modes[(modes.index(self.sortMode) + 1) % len(modes)])
+
+    def sortBy(self, mode):
+        """
+        Reorders the rows and scrolls back to the top.
+
+        Parameters:
+        -----------
+        mode : str
+            'desc' or 'asc' TB probability, or 'file' for the results file order.
+        """
+        self.sortMode = mode
+        self.sortBtn.config(text=self.SORT_MODES[mode])
+        # Give thumbnails that failed another chance, e.g. once a missing film is restored
+        self._failed.clear()
+
+        if mode == 'file':
+            self.order = list(range(len(self.records)))
+        else:
+            sign = -1 if mode == 'desc' else 1
+            probability = [record.get('probability') for record in self.records]
+            self.order = sorted(range(len(self.records)),
+                                key=lambda i: (probability[i] is None, sign * (probability[i] or 0.0), i))
+
+        for position in list(self._rows):
+            self.recycle(position)
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def yview(self, *args):
+        """
+        Scrollbar command: scrolls the canvas, then updates the rows in view.
+        """
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def onWheel(self, event):
+        """
+        Scrolls on mouse wheel events (event.delta on Windows and macOS, buttons 4 and 5 on X11).
+        """
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.yview('scroll', -1, 'units')
+        elif event.num == 5 or getattr(event, 'delta', 0) < 0:
+            self.yview('scroll', 1, 'units')
+
+    def onClick(self, event):
+        """
+        Opens the record of the thumbnail under the pointer.
+        """
+        current = self.canvas.find_withtag(tk.CURRENT)
+        for items in self._rows.values():
+            if current and current[0] in (items['overlay'], items['mask']):
+                self.openCallback(self.records[items['index']])
+                return
+
+    def visibleRange(self):
+        """
+        Returns the first and one-past-last row positions in view, with one row of margin.
+        """
+        top = self.canvas.canvasy(0)
+        bottom = top + max(self.canvas.winfo_height(), self.rowHeight)
+        first = max(0, int(top // self.rowHeight) - 1)
+        last = min(len(self.order), int(bottom // self.rowHeight) + 2)
+        return first, last
+
+    def refresh(self):
+        """
+        Draws the rows in view and recycles the items of the rows scrolled away.
+        """
+        if self._closed:
+            return
+        self.updateScrollRegion()
+        first, last = self.visibleRange()
+
+        for position in list(self._rows):
+            if not first <= position < last:
+                self.recycle(position)
+
+        for position in range(first, last):
+            if position not in self._rows:
+                self._rows[position] = self.drawRow(position)
+
+        wanted = set()
+        for position in range(first, last):
+            wanted.update(path for path in self.thumbnailPaths(self.records[self.order[position]]) if path)
+        self._wanted = frozenset(wanted)
+
+        for path in wanted:
+            if path not in self._photos and path not in self._pending and path not in self._failed:
+                self._pending.add(path)
+                self._executor.submit(self.decode, path)
+
+    @staticmethod
+    def thumbnailPaths(record):
+        """
+        Returns the (overlay, mask) thumbnail sources of a record, the overlay falling back to the original image.
+        """
+        return record.get('overlay') or record.get('file'), record.get('mask')
+
+    def drawRow(self, position):
+        """
+        Places a row's canvas items, reusing recycled ones when available.
+
+        Parameters:
+        -----------
+        position : int
+            Row position in display order.
+
+        Returns:
+        --------
+        dict
+            Canvas item ids of the row ('overlay', 'mask', 'text'), the thumbnail
+            paths ('overlay_path', 'mask_path') and the record 'index'.
+        """
+        if self._free:
+            items = self._free.pop()
+        else:
+            items = {
+                'overlay': self.canvas.create_image(0, 0, anchor=tk.NW),
+                'mask': self.canvas.create_image(0, 0, anchor=tk.NW),
+                'text': self.canvas.create_text(0, 0, anchor=tk.NW, font=TXT_11, fill=self.headerLbl.cget('fg')),
+            }
+
+        index = self.order[position]
+        record = self.records[index]
+        y = position * self.rowHeight + self.PAD
+        step = self.thumbSize + self.PAD
+
+        for column, (name, path) in enumerate(zip(('overlay', 'mask'), self.thumbnailPaths(record))):
+            item = items[name]
+            self.canvas.coords(item, self.PAD + column * step, y)
+            self.canvas.itemconfigure(item, image=self.photo(path) or '', state=tk.NORMAL)
+            items[name + '_path'] = path
+        items['index'] = index
+
+        self.canvas.coords(items['text'], self.PAD + 2 * step, y)
+        self.canvas.itemconfigure(items['text'], text=self.describe(position, record), state=tk.NORMAL)
+
+        return items
+
+    @staticmethod
+    def describe(position, record):
+        """
+        Returns the text shown next to a record's thumbnails.
+        """
+        name = f"{position + 1}. {os.path.basename(record.get('file') or '')}"
+        if record.get('error'):
+            return f"{name}\nFailed: {record['error']}"
+
+        text = f"{name}\nTB {record['probability'] * 100:.1f}%   {record.get('label') or ''}"
+        if record.get('lung_fraction') is not None:
+            text += f"\nLung area {record['lung_fraction'] * 100:.0f}%"
+        return text
+
+    def recycle(self, position):
+        """
+        Hides a row's items and keeps them for reuse, releasing their Tk images.
+        """
+        items = self._rows.pop(position)
+        for name in ('overlay', 'mask', 'text'):
+            self.canvas.itemconfigure(items[name], state=tk.HIDDEN)
+        self.canvas.itemconfigure(items['overlay'], image='')
+        self.canvas.itemconfigure(items['mask'], image='')
+        self._free.append(items)
+
+    def photo(self, path):
+        """
+        Returns the cached Tk image of a thumbnail and marks it as recently shown,
+        the placeholder if it failed to decode, or None.
+        """
+        if path in self._failed:
+            return self.placeholder()
+        photo = self._photos.get(path) if path else None
+        if photo is not None:
+            self._photos.move_to_end(path)
+        return photo
+
+    def placeholder(self):
+        """
+        Returns the blank Tk image shown in place of thumbnails that failed to decode.
+        """
+        from common_libs import Image, ImageTk
+
+        if self._placeholder is None:
+            blank = Image.new('RGB', (self.thumbSize, self.thumbSize), (64, 64, 64))
+            self._placeholder = ImageTk.PhotoImage(blank, master=self)
+        return self._placeholder
+
+    def decode(self, path):
+        """
+        Worker thread: decodes a thumbnail unless its row was scrolled away meanwhile.
+        Queues (path, thumbnail or None, whether the decode failed).
+        """
+        if path not in self._wanted or self._closed:
+            self._decoded.put((path, None, False))
+            return
+        try:
+            thumb = self.loader(path)
+        except Exception:
+            thumb = None
+        self._decoded.put((path, thumb, thumb is None))
+
+    def pollThumbnails(self):
+        """
+        Turns decoded thumbnails into Tk images and shows them in the rows in view.
+        """
+        from common_libs import Image, ImageTk
+
+        if self._closed:
+            return
+
+        shown = False
+        while True:
+            try:
+                path, thumb, failed = self._decoded.get_nowait()
+            except queue.Empty:
+                break
+
+            self._pending.discard(path)
+            if failed:
+                # Missing or unreadable: show the placeholder instead of decoding it on every refresh
+                self._failed.add(path)
+                shown = True
+            if thumb is None:
+                continue
+
+            self._photos[path] = ImageTk.PhotoImage(Image.fromarray(thumb), master=self)
+            shown = True
+
+        if shown:
+            for items in self._rows.values():
+                for name in ('overlay', 'mask'):
+                    photo = self.photo(items[name + '_path'])
+                    if photo is not None:
+                        self.canvas.itemconfigure(items[name], image=photo)
+            self.evictPhotos()
+
+        self.after(self.POLL_MS, self.pollThumbnails)
+
+    def evictPhotos(self):
+        """
+        Drops the least recently shown Tk images beyond `maxPhotos`, never those of rows in view.
+        """
+        visible = {items[name + '_path'] for items in self._rows.values() for name in ('overlay', 'mask')}
+        for path in list(self._photos):
+            if len(self._photos) <= self.maxPhotos:
+                break
+            if path not in visible:
+                # Dropping the last reference to the PhotoImage deletes its Tk image
+                del self._photos[path]
+
+    def close(self):
+        """
+        Stops the decode threads and destroys the window.
+        """
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._photos.clear()
+        self.destroy()
@@ -1,12 +1,16 @@
-from common_libs import tk, TXT_12_B
+from common_libs import tk, os, TXT_11, TXT_12_B, DISPLAY_FIT, DISPLAY_MIN_SIZE
 
 class HomeView(tk.Frame):
     """
     HomeView represents the main content view in the application window.
 
     This view includes:
-    - A top menu bar with an upload label, button, and loading indicator.
-    - A content area to display uploaded images and prediction labels.
+    - A top menu bar with an upload label, button, a gallery button and loading indicator.
+    - A result panel with fixed image and text slots that are updated in place
+      for every upload, so widgets and Tk images do not accumulate, with extra
+      slots for the explanation heatmaps when explanations are enabled.
+    - A panel listing the most similar prior cases, shown when the results index is enabled.
+    - A status panel with per-stage timings, shown when instrumentation is enabled.
 
     Attributes:
     -----------
@@ -16,6 +20,12 @@ class HomeView(tk.Frame):
     callback : function
         The function to be called when the 'Upload' button is clicked.
 
+    cancelCallback : function
+        The function to be called when the 'Cancel' button is clicked.
+
+    galleryCallback : function
+        The function to be called when the 'Gallery' button is clicked.
+
     menuFrm : tk.Frame
         Frame that contains the upload label, button, and loading text.
 
@@ -25,14 +35,48 @@ class HomeView(tk.Frame):
     browseBtn : tk.Button
         Button to trigger the upload action.
 
+    cancelBtn : tk.Button
+        Button to cancel queued and running uploads.
+
+    galleryBtn : tk.Button
+        Button opening the results gallery of a batch session.
+
     loading : tk.Label
         Label used to show the current status ("Loading..." or "Finished").
 
     contentFrm : tk.Frame
-        Frame where the output images and labels are dynamically displayed.
+        Frame holding the image and text slots of the result panel.
+
+    fitDisplay : bool
+        Scale result images to their slot's size instead of showing them at their own size.
+
+    slots : int
+        Number of image (and text) slots: the three result slots plus the explanation slots.
+
+    imageSlots : list of tk.Label
+        Labels showing the original image, the mask, the overlay and any explanation heatmaps.
+
+    textSlots : list of tk.Label
+        Labels showing the prediction text below the images.
+
+    photos : list of ImageTk.PhotoImage or None
+        Tk image currently shown in each image slot.
+
+    sources : list of PIL.Image.Image or None
+        Full-size image of each slot, kept to re-render when the panel is resized.
+
+    similarLbl : tk.Label
+        Panel listing the prior cases most similar to the last upload.
+
+    timingLbl : tk.Label
+        Status panel listing the stage timings of the last request.
     """
 
-    def __init__(self, parent, callback):
+    SLOTS = 3
+    """int: Number of result image (and text) slots, before the explanation slots."""
+
+    def __init__(self, parent, callback, cancelCallback=None, fitDisplay=DISPLAY_FIT, explainSlots=0,
+                 galleryCallback=None):
         """
         Initializes the HomeView frame, sets up layout and interface elements.
 
@@ -43,6 +87,18 @@ class HomeView(tk.Frame):
 
         callback : function
             The function triggered when the upload button is clicked.
+
+        cancelCallback : function, optional
+            The function triggered when the cancel button is clicked.
+
+        fitDisplay : bool, optional (default=DISPLAY_FIT)
+            Scale result images to their slot's size instead of showing them at their own size.
+
+        explainSlots : int, optional (default=0)
+            Number of extra slots for explanation heatmaps, after the overlay.
+
+        galleryCallback : function, optional
+            The function triggered when the gallery button is clicked.
         """
         super().__init__(parent)
         self.parent = parent
@@ -51,6 +107,12 @@ class HomeView(tk.Frame):
         self.callback = callback
         """function: The function to be called when the 'Upload' button is clicked."""
 
+        self.cancelCallback = cancelCallback
+        """function: The function to be called when the 'Cancel' button is clicked."""
+
+        self.galleryCallback = galleryCallback
+        """function: The function to be called when the 'Gallery' button is clicked."""
+
         # Layout configuration
         self.grid(row=0, column=0, sticky=tk.NSEW)
         self.rowconfigure(0, weight=1)
@@ -80,66 +142,277 @@ class HomeView(tk.Frame):
 
         self.browseBtn.grid(row=0, column=1, sticky=tk.NSEW)
 
+        self.cancelBtn = tk.Button(
+            self.menuFrm,
+            text='Cancel',
+            command=self.cancelCallback,
+            font=TXT_12_B,
+            anchor=tk.CENTER,
+            state=tk.DISABLED
+        )
+        """tk.Button: Button to cancel queued and running uploads."""
+
+        self.cancelBtn.grid(row=0, column=2, sticky=tk.NSEW)
+
+        self.galleryBtn = tk.Button(
+            self.menuFrm,
+            text='Gallery',
+            command=self.galleryCallback,
+            font=TXT_12_B,
+            anchor=tk.CENTER,
+            state=tk.NORMAL if self.galleryCallback else tk.DISABLED
+        )
+        """tk.Button: Button opening the results gallery of a batch session."""
+
+        self.galleryBtn.grid(row=0, column=3, sticky=tk.NSEW)
+
         self.loading = tk.Label(self.menuFrm, text='', font=TXT_12_B)
         """tk.Label: Label used to show the current status ("Loading..." or "Finished")."""
 
-        self.loading.grid(row=0, column=2, sticky=tk.NSEW)
+        self.loading.grid(row=0, column=4, sticky=tk.NSEW)
 
-        # Content display area
+        # Result panel with a fixed set of image and text slots
         self.contentFrm = tk.Frame(self)
-        """tk.Frame: Frame where the output images and labels are dynamically displayed."""
+        """tk.Frame: Frame holding the image and text slots of the result panel."""
         self.contentFrm.grid(row=1, column=0, sticky=tk.NSEW)
         self.contentFrm.rowconfigure(0, weight=1)
         self.contentFrm.rowconfigure(1, weight=1)
-        self.contentFrm.columnconfigure(0, weight=1)
-        self.contentFrm.columnconfigure(1, weight=1)
-        self.contentFrm.columnconfigure(2, weight=1)
 
-    def addImage(self, img, row, column):
+        self.fitDisplay: bool = fitDisplay
+        """bool: Scale result images to their slot's size instead of showing them at their own size."""
+
+        self.slots: int = self.SLOTS + explainSlots
+        """int: Number of image (and text) slots: the three result slots plus the explanation slots."""
+
+        self.imageSlots: list = []
+        """list of tk.Label: Labels showing the original image, the mask, the overlay and any heatmaps."""
+
+        self.textSlots: list = []
+        """list of tk.Label: Labels showing the prediction text below the images."""
+
+        for column in range(self.slots):
+            self.contentFrm.columnconfigure(column, weight=1, uniform='slot')
+
+            image_slot = tk.Label(self.contentFrm, bd=0)
+            image_slot.grid(row=0, column=column, sticky=tk.NSEW)
+            self.imageSlots.append(image_slot)
+
+            text_slot = tk.Label(self.contentFrm, text='', font=TXT_12_B)
+            text_slot.grid(row=1, column=column, sticky=tk.NSEW)
+            self.textSlots.append(text_slot)
+
+        self.photos: list = [None] * self.slots
+        """list of ImageTk.PhotoImage: Tk image currently shown in each image slot."""
+
+        self.sources: list = [None] * self.slots
+        """list of PIL.Image.Image: Full-size image of each slot, kept to re-render on resize."""
+
+        if self.fitDisplay:
+            self.contentFrm.bind('<Configure>', self.onResize)
+
+        # Similar prior cases, only placed once a result from the index is reported
+        self.similarLbl = tk.Label(self, text='', font=TXT_11, anchor=tk.W, justify=tk.LEFT)
+        """tk.Label: Panel listing the prior cases most similar to the last upload."""
+
+        # Stage timing status panel, only placed once timings are reported
+        self.timingLbl = tk.Label(self, text='', font=TXT_11, anchor=tk.W, justify=tk.LEFT)
+        """tk.Label: Status panel listing the stage timings of the last request."""
+
+    def setImage(self, slot, image):
         """
-        Displays an image in the content frame at the specified position.
+        Shows an image in a result slot, reusing the slot's widget and Tk image.
 
         Parameters:
         -----------
-        img : PhotoImage
-            The image to be displayed (Tkinter-compatible).
-
-        row : int
-            Row index in the grid layout.
+        slot : int
+            Slot index: 0 original, 1 mask, 2 overlay, then the explanation heatmaps.
 
-        column : int
-            Column index in the grid layout.
+        image : np.ndarray or PIL.Image.Image
+            Image to display (uint8, grayscale or 3-channel).
         """
-        img_container = tk.Label(self.contentFrm, image=img, bd=0)
-        img_container.image = img  # Keep a reference to avoid garbage collection
-        img_container.grid(row=row, column=column, sticky=tk.NSEW)
+        from common_libs import Image
 
-    def addLabel(self, text, row, column):
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+
+        self.sources[slot] = image
+        self.render(slot)
+
+    def setText(self, slot, text):
         """
-        Adds a label with specified text to the content frame.
+        Shows text in a result slot below the images.
 
         Parameters:
         -----------
+        slot : int
+            Slot index.
+
         text : str
             Text content of the label.
+        """
+        self.textSlots[slot].config(text=text)
 
-        row : int
-            Row index in the grid layout.
+    def clearSlot(self, slot):
+        """
+        Empties one slot and releases its Tk image.
 
-        column : int
-            Column index in the grid layout.
+        Parameters:
+        -----------
+        slot : int
+            Slot index.
         """
-        lbl = tk.Label(self.contentFrm, text=text, font=TXT_12_B)
-        lbl.grid(row=row, column=column, sticky=tk.NSEW)
+        self.imageSlots[slot].config(image='')
+        self.textSlots[slot].config(text='')
+        self.photos[slot] = None
+        self.sources[slot] = None
 
-    def showLoading(self):
+    def clearResults(self):
         """
-        Displays a 'Loading...' status in the menu frame.
+        Empties every slot and releases their Tk images.
         """
-        self.loading.config(text='Loading...')
+        for slot in range(self.slots):
+            self.clearSlot(slot)
 
-    def stopLoading(self):
+    def displaySize(self, image):
+        """
+        Returns the size at which an image is shown in its slot.
+
+        Parameters:
+        -----------
+        image : PIL.Image.Image
+            Full-size source image.
+
+        Returns:
+        --------
+        tuple
+            (width, height) in pixels: the image's own size, or the largest size
+            with the same aspect ratio that fits a slot when `fitDisplay` is set.
+        """
+        if not self.fitDisplay:
+            return image.size
+
+        width = self.contentFrm.winfo_width() // self.slots
+        height = self.contentFrm.winfo_height() - self.textSlots[0].winfo_reqheight()
+        scale = min(width / image.width, height / image.height)
+        scale = max(scale, DISPLAY_MIN_SIZE / min(image.size))
+
+        return max(1, round(image.width * scale)), max(1, round(image.height * scale))
+
+    def render(self, slot):
+        """
+        Draws a slot's source image at its display size.
+
+        The slot's PhotoImage is updated in place when the size is unchanged; otherwise
+        it is replaced and the previous one released, so the number of Tk images never
+        grows beyond one per slot.
+
+        Parameters:
+        -----------
+        slot : int
+            Slot index.
+        """
+        from common_libs import Image, ImageTk
+
+        image = self.sources[slot]
+        if image is None:
+            return
+
+        size = self.displaySize(image)
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+
+        photo = self.photos[slot]
+        if photo is not None and (photo.width(), photo.height()) == size:
+            photo.paste(image)
+            return
+
+        photo = ImageTk.PhotoImage(image)
+        self.imageSlots[slot].config(image=photo)
+
+        # Dropping the last reference to the previous PhotoImage deletes its Tk image
+        self.photos[slot] = photo
+
+    def onResize(self, event):
+        """
+        Re-renders the result images when the panel size changes in fit mode.
+        """
+        for slot in range(self.slots):
+            self.render(slot)
+
+    def showTimings(self, record):
+        """
+        Shows the stage timings of a finished request in the status panel.
+
+        Parameters:
+        -----------
+        record : dict
+            Request record with 'total_ms' and a 'stages' mapping of stage name to milliseconds.
+        """
+        stages = '   '.join(f'{name} {ms:.1f} ms' for name, ms in record['stages'].items())
+        self.timingLbl.config(text=f"Total {record['total_ms']:.1f} ms   |   {stages}")
+        self.timingLbl.grid(row=3, column=0, sticky=tk.NSEW)
+
+    def showSimilar(self, cases):
+        """
+        Lists the prior cases most similar to the last upload.
+
+        Parameters:
+        -----------
+        cases : list of dict or None
+            Cases from `ResultsIndex.search`, most similar first, with 'path',
+            'probability', 'lung_fraction' and 'similarity'; None while the search
+            for the current film is pending.
+        """
+        if cases is None:
+            text = 'Similar prior cases: searching...'
+        elif not cases:
+            text = 'Similar prior cases: none yet'
+        else:
+            lines = [f"{os.path.basename(case['path'])}   TB {case['probability'] * 100:.1f}%   "
+                     + (f"lung {case['lung_fraction'] * 100:.0f}%   " if case['lung_fraction'] is not None else '')
+                     + f"similarity {case['similarity']:.3f}" for case in cases]
+            text = 'Similar prior cases:\n' + '\n'.join(lines)
+        self.similarLbl.config(text=text)
+        self.similarLbl.grid(row=2, column=0, sticky=tk.NSEW)
+
+    def showLoading(self, pending=1):
+        """
+        Displays a 'Loading...' status in the menu frame and enables cancelling.
+
+        Parameters:
+        -----------
+        pending : int, optional (default=1)
+            Number of uploads queued or running; shown when more than one.
+        """
+        text = 'Loading...' if pending <= 1 else f'Loading... ({pending} pending)'
+        self.loading.config(text=text)
+        self.cancelBtn.config(state=tk.NORMAL if self.cancelCallback else tk.DISABLED)
+
+    def stopLoading(self, text='Finished'):
         """
         Updates the loading label to indicate completion ('Finished').
+
+        Parameters:
+        -----------
+        text : str, optional (default='Finished')
+            Final status text.
+        """
+        self.loading.config(text=text)
+        self.cancelBtn.config(state=tk.DISABLED)
+
+    def setUploadEnabled(self, enabled):
+        """
+        Enables or disables the upload button.
+
+        Parameters:
+        -----------
+        enabled : bool
+            True to accept uploads.
+        """
+        self.browseBtn.config(state=tk.NORMAL if enabled else tk.DISABLED)
+
+    def isLoading(self):
+        """
+        Returns True while the status label shows a loading message.
         """
-        self.loading.config(text='Finished')
+        return self.loading.cget('text').startswith('Loading')